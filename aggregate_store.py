@@ -0,0 +1,74 @@
+import json
+import os
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+import pandas as pd
+
+from aggregates import PartialAggregate, month_partial, week_partial
+from cleaning import RULES_VERSION
+from sketches import read_sketches, write_sketches
+
+
+def source_fingerprint(source):
+    """Cheap change detector for a monthly source: HTTP validators, or name, size and mtime on disk."""
+    if urlparse(str(source)).scheme in ('http', 'https'):
+        with urlopen(Request(source, method='HEAD')) as response:
+            return '|'.join(response.headers.get(h) or '' for h in ['ETag', 'Last-Modified', 'Content-Length'])
+    stat = os.stat(source)
+    return f'{os.path.basename(source)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+
+class AggregateStore:
+    """Per-month windowed partial aggregates persisted as parquet, with a JSON manifest.
+
+    An entry is reused while both the source fingerprint and cleaning.RULES_VERSION match.
+    Partials are stored with WINDOW_KEYS and without any date filter, so they stay valid
+    for any start_date / end_date. Week quantile sketches (see sketches.py) are stored
+    alongside when given, and an entry without them is stale for a run that needs them.
+    """
+
+    def __init__(self, path='.aggregate_store'):
+        self.path = path
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def _partial_path(self, month, kind):
+        return os.path.join(self.path, f'{month}.{kind}.parquet')
+
+    def load(self, month, fingerprint, sketches=False):
+        """Return the stored (week, month, sketches) partials for ``month``, or None if missing or stale.
+
+        The sketches are None unless ``sketches`` is set.
+        """
+        entry = self.manifest.get(month) or {}
+        if (entry.get('fingerprint'), entry.get('rules_version')) != (fingerprint, RULES_VERSION):
+            return None
+        if sketches and not entry.get('sketches'):
+            return None
+
+        partials = []
+        for kind, empty in [('week', week_partial(windowed=True)), ('month', month_partial(windowed=True))]:
+            frame = pd.read_parquet(self._partial_path(month, kind))
+            partials.append(PartialAggregate(empty.keys, empty.aggs, frame.set_index(empty.keys)))
+        sketch = read_sketches(self._partial_path(month, 'sketch'), windowed=True) if sketches else None
+        return (*partials, sketch)
+
+    def save(self, month, fingerprint, week_part, month_part, sketches=None):
+        for kind, partial in [('week', week_part), ('month', month_part)]:
+            partial.frame.reset_index().to_parquet(self._partial_path(month, kind), index=False)
+        entry = {'fingerprint': fingerprint, 'rules_version': RULES_VERSION}
+        if sketches is not None:
+            write_sketches(self._partial_path(month, 'sketch'), sketches)
+            entry['sketches'] = True
+
+        self.manifest[month] = entry
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+WEEK_KEYS = ['year_week']
+MONTH_KEYS = ['rate_category', 'year_month', 'day_type']
+# pickup_day = floor(pickup) and dropoff_day_end = ceil(dropoff), so for midnight bounds
+# "pickup >= start_date and dropoff <= end_date" can still be applied after aggregating.
+WINDOW_KEYS = ['pickup_day', 'dropoff_day_end']
+
+WEEK_AGGS = {
+    'min_trip_time': ('trip_time_in_seconds', 'min'),
+    'max_trip_time': ('trip_time_in_seconds', 'max'),
+    'sum_trip_time': ('trip_time_in_seconds', 'sum'),
+    'min_trip_distance': ('trip_distance', 'min'),
+    'max_trip_distance': ('trip_distance', 'max'),
+    'sum_trip_distance': ('trip_distance', 'sum'),
+    'min_trip_amount': ('total_amount', 'min'),
+    'max_trip_amount': ('total_amount', 'max'),
+    'sum_trip_amount': ('total_amount', 'sum'),
+    'total_services': ('total_amount', 'count'),
+}
+MONTH_AGGS = {
+    'services': ('trip_distance', 'count'),
+    'distances': ('trip_distance', 'sum'),
+    'passengers': ('passenger_count', 'sum'),
+}
+MERGE_OPS = {'min': 'min', 'max': 'max', 'sum': 'sum', 'count': 'sum'}
+# Daily cube the week and month partials are rolled up from, see daily_cube
+CUBE_KEYS = ['year_month_day', 'rate_category']
+CUBE_AGGS = {
+    **WEEK_AGGS,
+    'min_passengers': ('passenger_count', 'min'),
+    'max_passengers': ('passenger_count', 'max'),
+    'sum_passengers': ('passenger_count', 'sum'),
+}
+
+RATE_CATEGORIES = {1: 'regular', 2: 'jfk'}
+OTHER_RATE_CATEGORY = 'other'
+
+
+def derive_keys(df):
+    """Add trip_time_in_seconds and the grouping keys used by the partial aggregates.
+
+    year_week is ISO year * 100 + ISO week and year_month is year * 100 + month; they are
+    only turned into labels once aggregated (see format_year_week / format_year_month).
+    """
+    dt = df['tpep_dropoff_datetime']
+    iso = dt.dt.isocalendar()
+    rate_code = df['RatecodeID']
+
+    return df.assign(
+        trip_time_in_seconds=(dt - df['tpep_pickup_datetime']).dt.total_seconds(),
+        year_week=iso['year'].to_numpy(dtype=np.int32) * 100 + iso['week'].to_numpy(dtype=np.int32),
+        year_month=dt.dt.year.to_numpy(dtype=np.int32) * 100 + dt.dt.month.to_numpy(dtype=np.int32),
+        day_type=np.where(dt.dt.dayofweek >= 5, 2, 1),
+        rate_category=np.select(
+            [rate_code == code for code in RATE_CATEGORIES],
+            list(RATE_CATEGORIES.values()),
+            default=OTHER_RATE_CATEGORY
+        ),
+        pickup_day=df['tpep_pickup_datetime'].dt.floor('D'),
+        dropoff_day_end=dt.dt.ceil('D'),
+    )
+
+
+def window_bound(date):
+    """``date`` as a Timestamp, which must be a midnight: the WINDOW_KEYS filter is only exact for day bounds."""
+    bound = pd.Timestamp(date)
+    if bound != bound.normalize():
+        raise ValueError(f'{date} is not at midnight: windowed partials can only be cut at day boundaries')
+    return bound
+
+
+def format_year_week(codes):
+    codes = np.asarray(codes)
+    return [f'{year}-{week:02d}' for year, week in zip(codes // 100, codes % 100)]
+
+
+def format_year_month(codes):
+    codes = np.asarray(codes)
+    return [f'{year}-{month:02d}' for year, month in zip(codes // 100, codes % 100)]
+
+
+def labelled_codes(codes, format_code, dtype_backend=None):
+    """Categorical grouping like the integer ``codes``, labelled by ``format_code`` per distinct code only.
+
+    With dtype_backend='pyarrow' the labels are Arrow strings rather than Python objects.
+    """
+    positions, uniques = pd.factorize(np.asarray(codes), sort=True)
+    labels = [format_code(code) for code in uniques]
+    if dtype_backend == 'pyarrow':
+        labels = pd.Index(labels, dtype=pd.ArrowDtype(pa.string()))
+    return pd.Categorical.from_codes(positions, categories=labels)
+
+
+class PartialAggregate:
+    """Mergeable group-by state: ``aggs`` maps an output column to (source column, op).
+
+    Partials built from disjoint slices of the data merge into the partial of their union,
+    so they can be built per batch, month or worker and reduced at the end.
+    """
+
+    def __init__(self, keys, aggs, frame=None):
+        self.keys = keys
+        self.aggs = aggs
+        if frame is None:
+            frame = pd.DataFrame(columns=list(aggs), index=pd.MultiIndex.from_tuples([], names=keys))
+        self.frame = frame
+
+    @property
+    def merge_ops(self):
+        return {column: MERGE_OPS[op] for column, (_, op) in self.aggs.items()}
+
+    @classmethod
+    def from_frame(cls, df, keys, aggs):
+        return cls(keys, aggs, df.groupby(keys, observed=True).agg(**aggs))
+
+    def merge(self, other):
+        if self.frame.empty:
+            return PartialAggregate(self.keys, self.aggs, other.frame)
+        if other.frame.empty:
+            return self
+        merged = pd.concat([self.frame, other.frame]).groupby(level=self.keys).agg(self.merge_ops)
+        return PartialAggregate(self.keys, self.aggs, merged)
+
+    def subtract(self, other):
+        """Remove rows counted twice, e.g. duplicates found after merging the partials of their slices.
+
+        Counts and sums are subtracted; min and max are kept, since a row equal to each
+        removed one is still counted in the same group.
+        """
+        frame = self.frame.copy()
+        for column, op in self.merge_ops.items():
+            if op == 'sum':
+                frame[column] = frame[column].sub(other.frame[column], fill_value=0).astype(frame[column].dtype)
+        return PartialAggregate(self.keys, self.aggs, frame)
+
+    def rollup(self, keys, start_date=None, end_date=None):
+        """Group onto a subset of ``keys``, keeping only the date window when WINDOW_KEYS are present.
+
+        The window bounds must be midnights, see window_bound.
+        """
+        frame = self.frame
+        if start_date is not None:
+            frame = frame[frame.index.get_level_values('pickup_day') >= window_bound(start_date)]
+        if end_date is not None:
+            frame = frame[frame.index.get_level_values('dropoff_day_end') <= window_bound(end_date)]
+        if frame.empty:
+            return PartialAggregate(keys, self.aggs)
+        return PartialAggregate(keys, self.aggs, frame.groupby(level=keys).agg(self.merge_ops))
+
+    def to_ipc(self):
+        """Serialize as an Arrow IPC stream, e.g. to return it from a worker process."""
+        table = pa.Table.from_pandas(self.frame.reset_index(), preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    @classmethod
+    def from_ipc(cls, keys, aggs, data):
+        frame = pa.ipc.open_stream(data).read_all().to_pandas()
+        return cls(keys, aggs, frame.set_index(keys)) if len(frame) else cls(keys, aggs)
+
+    def update(self, df):
+        merged = self.merge(PartialAggregate.from_frame(df, self.keys, self.aggs))
+        self.frame = merged.frame
+
+
+def week_partial(df=None, windowed=False):
+    keys = WINDOW_KEYS + WEEK_KEYS if windowed else WEEK_KEYS
+    return PartialAggregate(keys, WEEK_AGGS) if df is None else PartialAggregate.from_frame(df, keys, WEEK_AGGS)
+
+
+def month_partial(df=None, windowed=False):
+    keys = WINDOW_KEYS + MONTH_KEYS if windowed else MONTH_KEYS
+    return PartialAggregate(keys, MONTH_AGGS) if df is None else PartialAggregate.from_frame(df, keys, MONTH_AGGS)
+
+
+def daily_cube(df):
+    """Count, sums and min/max per (dropoff day, rate category) of trips with year_month_day and rate_category.
+
+    year_month_day is the integer code year * 10000 + month * 100 + day. A few hundred rows
+    per year, from which cube_week_partial and cube_month_partial, or any other calendar
+    granularity, are rolled up without reading the trips again.
+    """
+    return PartialAggregate.from_frame(df, CUBE_KEYS, CUBE_AGGS)
+
+
+def cube_calendar(cube):
+    """The cube rows with year_week, year_month (integer codes) and day_type derived from their day code."""
+    frame = cube.frame.reset_index()
+    codes = frame['year_month_day'].to_numpy(dtype=np.int64)
+    day = pd.to_datetime(pd.DataFrame({'year': codes // 10000, 'month': codes // 100 % 100, 'day': codes % 100}))
+    iso = day.dt.isocalendar()
+    return frame.assign(
+        year_week=iso['year'].to_numpy(dtype=np.int32) * 100 + iso['week'].to_numpy(dtype=np.int32),
+        year_month=(codes // 100).astype(np.int32),
+        day_type=np.where(day.dt.dayofweek >= 5, 2, 1),
+        rate_category=frame['rate_category'].astype(str),
+    )
+
+
+def cube_week_partial(cube):
+    merge_ops = {column: MERGE_OPS[op] for column, (_, op) in WEEK_AGGS.items()}
+    return PartialAggregate(WEEK_KEYS, WEEK_AGGS, cube_calendar(cube).groupby(WEEK_KEYS).agg(merge_ops))
+
+
+def cube_month_partial(cube):
+    frame = cube_calendar(cube).groupby(MONTH_KEYS).agg(
+        services=('total_services', 'sum'),
+        distances=('sum_trip_distance', 'sum'),
+        passengers=('sum_passengers', 'sum'),
+    )
+    return PartialAggregate(MONTH_KEYS, MONTH_AGGS, frame)
+
+
+def week_metrics(partial):
+    """Build the generate_week_metrics csv_df from a week partial."""
+    frame = partial.frame.sort_index()
+    csv_df = pd.DataFrame({'year_week': format_year_week(frame.index.get_level_values('year_week'))})
+    for stat in ['trip_time', 'trip_distance', 'trip_amount']:
+        csv_df[f'min_{stat}'] = frame[f'min_{stat}'].to_numpy(dtype=float)
+        csv_df[f'max_{stat}'] = frame[f'max_{stat}'].to_numpy(dtype=float)
+        csv_df[f'mean_{stat}'] = frame[f'sum_{stat}'].to_numpy(dtype=float) / frame['total_services'].to_numpy(dtype=float)
+    csv_df['total_services'] = frame['total_services'].to_numpy(dtype='int64')
+
+    csv_df['percentage_variation'] = (
+        csv_df['total_services'] - csv_df['total_services'].shift(1)
+    ) / csv_df['total_services'].shift(1) * 100
+    return csv_df
+
+
+def month_metrics(partial):
+    """Split a month partial into the (regular_df, jfk_df, other_df) generate_month_metrics tables."""
+    grouped = partial.frame.sort_index().reset_index()
+    grouped['year_month'] = format_year_month(grouped['year_month'])
+    grouped['services'] = grouped['services'].astype('int64')
+
+    return tuple(
+        grouped[grouped['rate_category'] == category].drop(columns='rate_category').reset_index(drop=True)
+        for category in [*RATE_CATEGORIES.values(), OTHER_RATE_CATEGORY]
+    )
@@ -1,6 +1,13 @@
+import json
 import time
 import subprocess
 import sys
+from instrumentation import PHASE_LABELS
+
+
+def metrics_path(script_name):
+    """phase_metrics JSON written by a script, named after its processed_data outputs."""
+    return 'phase_metrics' + script_name[len('main'):-len('.py')] + '.json'
 
 
 def run_version(script_name):
@@ -20,18 +27,10 @@ def run_version(script_name):
         print(f"ERROR: {script_name} failed with return code {result.returncode}")
         return None, total
 
-    # Parse phase times from output
-    phases = {}
-    lines = output.strip().split('\n')
-    current_phase = None
-    for line in lines:
-        if line.startswith(('Init', 'Importing', 'Cleaning', 'Adding', 'Generating week',
-                           'Generating month', 'Formatting', 'Exporting')):
-            current_phase = line.strip().rstrip('.')
-        elif '*** ' in line and ' seconds ***' in line and current_phase:
-            t = float(line.split('*** ')[1].split(' seconds')[0])
-            phases[current_phase] = t
-            current_phase = None
+    # Phase times come from the metrics file each script writes through Instrumentation
+    with open(metrics_path(script_name)) as f:
+        metrics = json.load(f)
+    phases = {PHASE_LABELS.get(m['phase'], m['phase']): m['wall_seconds'] for m in metrics['phases']}
 
     return phases, total
 
@@ -63,6 +62,10 @@ if __name__ == '__main__':
         'Original (Pandas)': 'main.py',
         'Optimized (Pandas)': 'main_optimized.py',
         'Polars': 'main_polars.py',
+        'Polars (lazy)': 'main_polars_lazy.py',
+        'PyArrow': 'main_arrow.py',
+        'Streaming (Pandas)': 'main_streaming.py',
+        'Dask': 'main_dask.py',
     }
 
     results = {}
@@ -106,3 +109,7 @@ if __name__ == '__main__':
     print('='*60)
     compare_csv('processed_data.csv', 'processed_data_optimized.csv')
     compare_csv('processed_data.csv', 'processed_data_polars.csv')
+    compare_csv('processed_data.csv', 'processed_data_polars_lazy.csv')
+    compare_csv('processed_data.csv', 'processed_data_arrow.csv')
+    compare_csv('processed_data.csv', 'processed_data_streaming.csv')
+    compare_csv('processed_data.csv', 'processed_data_dask.csv')
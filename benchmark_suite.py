@@ -0,0 +1,184 @@
+"""Offline benchmark of every engine against local parquet files.
+
+    python benchmark_suite.py run --data-dir fixtures --repeat 5 --output results.json
+    python benchmark_suite.py compare baseline.json results.json --threshold 0.10
+
+Each repetition runs in a fresh process, so peak RSS and import costs are not shared
+between runs. The month files are looked up in --data-dir by the basename of each
+engine's download URL; --generate-rows fills it with trip_generator first.
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import trip_generator
+from instrumentation import Instrumentation
+
+ENGINES = {
+    'Original (Pandas)': 'main',
+    'Optimized (Pandas)': 'main_optimized',
+    'Polars': 'main_polars',
+    'Polars (lazy)': 'main_polars_lazy',
+    'PyArrow': 'main_arrow',
+    'Streaming (Pandas)': 'main_streaming',
+    'Dask': 'main_dask',
+}
+
+
+def run_once(module_name, data_dir, start_date, end_date):
+    """Run every phase of one engine in a scratch directory; returns {phase: (seconds, peak rss bytes)}."""
+    module = importlib.import_module(module_name)
+    data_dir = os.path.abspath(data_dir)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            taxi_data = module.YellowTaxiData(start_date=start_date, end_date=end_date)
+            taxi_data.urls_list = [os.path.join(data_dir, os.path.basename(url)) for url in taxi_data.urls_list]
+            instrumentation = Instrumentation()
+            try:
+                instrumentation.run(taxi_data)
+            finally:
+                if hasattr(taxi_data, 'close'):
+                    # Stops the cluster of the Dask engine
+                    taxi_data.close()
+        finally:
+            os.chdir(cwd)
+    return {m.phase: (m.wall_seconds, m.rss_peak_bytes) for m in instrumentation.phases}
+
+
+def source_rows(data_dir, start_date, end_date):
+    """Rows in the month files covering the date range, read from the parquet footers."""
+    months = pd.date_range(start_date, end_date, freq='MS').strftime('%Y-%m')
+    return sum(pq.ParquetFile(os.path.join(data_dir, f'yellow_tripdata_{m}.parquet')).metadata.num_rows
+               for m in months)
+
+
+def summarize(samples, rows):
+    """Median, p95, throughput and peak RSS of the (seconds, rss) samples of one phase."""
+    seconds = np.array([s for s, _ in samples])
+    median = float(np.median(seconds))
+    return {
+        'median': median,
+        'p95': float(np.percentile(seconds, 95)),
+        'rows_per_second': rows / median if median > 0 else None,
+        'peak_rss_mb': max(rss for _, rss in samples) / 2 ** 20,
+        'samples': seconds.tolist(),
+    }
+
+
+def run_suite(data_dir, engines=None, repeat=5, warmup=1, start_date='2022-01-01', end_date='2022-03-31'):
+    """Benchmark the engines, returning the JSON-serializable results."""
+    rows = source_rows(data_dir, start_date, end_date)
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'data_dir': os.path.abspath(data_dir),
+            'start_date': start_date,
+            'end_date': end_date,
+            'rows': rows,
+            'repeat': repeat,
+            'warmup': warmup,
+        },
+        'engines': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    for label in engines or ENGINES:
+        print(f'Benchmarking {label} ...')
+        runs = []
+        for i in range(warmup + repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                timings = pool.submit(run_once, ENGINES[label], data_dir, start_date, end_date).result()
+            if i >= warmup:
+                runs.append(timings)
+
+        phases = {phase: summarize([run[phase] for run in runs], rows) for phase in runs[0]}
+        phases['total'] = summarize(
+            [(sum(s for s, _ in run.values()), max(rss for _, rss in run.values())) for run in runs], rows
+        )
+        results['engines'][label] = phases
+    return results
+
+
+def compare_results(baseline, current, threshold=0.10):
+    """Phases whose median time or peak RSS grew by more than ``threshold`` (a fraction) over the baseline."""
+    regressions = []
+    for label, phases in current['engines'].items():
+        for phase, stats in phases.items():
+            base = baseline['engines'].get(label, {}).get(phase)
+            if base is None:
+                continue
+            for metric in ['median', 'peak_rss_mb']:
+                if base[metric] > 0 and stats[metric] > base[metric] * (1 + threshold):
+                    regressions.append({'engine': label, 'phase': phase, 'metric': metric,
+                                        'baseline': base[metric], 'current': stats[metric],
+                                        'change': stats[metric] / base[metric] - 1})
+    return regressions
+
+
+def print_results(results):
+    for label, phases in results['engines'].items():
+        print(f'\n{label}')
+        print(f"{'Phase':<25} | {'median':>9} | {'p95':>9} | {'rows/s':>12} | {'peak RSS':>10}")
+        for phase, stats in phases.items():
+            rows_per_second = stats['rows_per_second'] or 0
+            print(f"{phase:<25} | {stats['median']:>8.3f}s | {stats['p95']:>8.3f}s | {rows_per_second:>12,.0f} | "
+                  f"{stats['peak_rss_mb']:>7.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='benchmark the engines')
+    run.add_argument('--data-dir', required=True, help='directory with yellow_tripdata_YYYY-MM.parquet files')
+    run.add_argument('--engines', nargs='+', choices=list(ENGINES), default=None)
+    run.add_argument('--repeat', type=int, default=5)
+    run.add_argument('--warmup', type=int, default=1)
+    run.add_argument('--start-date', default='2022-01-01')
+    run.add_argument('--end-date', default='2022-03-31')
+    run.add_argument('--output', default='benchmark_results.json')
+    run.add_argument('--generate-rows', type=int, default=None,
+                     help='first write this many synthetic rows over the date range into --data-dir')
+
+    compare = commands.add_parser('compare', help='fail if a run regressed against a baseline')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.10, help='allowed growth, as a fraction')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        if args.generate_rows is not None:
+            trip_generator.generate_months(args.start_date[:7], args.end_date[:7], args.generate_rows, args.data_dir)
+        results = run_suite(args.data_dir, args.engines, args.repeat, args.warmup, args.start_date, args.end_date)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print_results(results)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare_results(baseline, current, args.threshold)
+    for r in regressions:
+        print('REGRESSION {engine} / {phase} / {metric}: {baseline:.3f} -> {current:.3f} ({change:+.1%})'.format(**r))
+    if not regressions:
+        print(f'No regressions above {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
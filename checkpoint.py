@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from aggregate_store import source_fingerprint
+from cleaning import RULES_VERSION
+
+KEY_METADATA = b'checkpoint_key'
+REJECTIONS_METADATA = b'rejections'
+
+
+def restored_rejections(table):
+    """Rejection counts (see cleaning.rejection_counts) saved with ``table``, or an empty frame."""
+    payload = (table.schema.metadata or {}).get(REJECTIONS_METADATA)
+    if payload is None:
+        return pd.DataFrame()
+    counts = json.loads(payload)
+    return pd.DataFrame(counts['data'], columns=counts['columns'], dtype=np.int64,
+                        index=pd.Index(counts['index'], dtype=object, name='year_month'))
+
+
+class CleanCheckpoint:
+    """Cleaned, key-enriched tables persisted as uncompressed Arrow IPC files and memory-mapped back.
+
+    There is one file per engine and date range. Its schema metadata holds a key built from
+    the date range, cleaning.RULES_VERSION, the fingerprint of every source and the engine
+    options that change the cleaned table, so a file whose sources, rules or options changed
+    is deleted on the next load instead of being reused. The rejection counts of clean_data
+    can be saved in the metadata too, see restored_rejections.
+    """
+
+    def __init__(self, path='.clean_checkpoint'):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(start_date, end_date, sources, options=None):
+        """``options`` is a JSON-serialisable dict of the engine options the cleaned table depends on."""
+        payload = {
+            'options': options or {},
+            'start_date': str(start_date),
+            'end_date': str(end_date),
+            'rules_version': RULES_VERSION,
+            'sources': [source_fingerprint(source) for source in sources],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def _file_path(self, name, start_date, end_date):
+        return os.path.join(self.path, f'{name}_{start_date}_{end_date}.arrow')
+
+    def load(self, name, start_date, end_date, key):
+        """Memory-mapped table stored under ``key``, or None; a stale file is removed."""
+        path = self._file_path(name, start_date, end_date)
+        try:
+            source = pa.memory_map(path)
+        except FileNotFoundError:
+            return None
+
+        reader = pa.ipc.open_file(source)
+        if (reader.schema.metadata or {}).get(KEY_METADATA) != key.encode():
+            source.close()
+            os.remove(path)
+            return None
+        return reader.read_all()
+
+    def save(self, name, start_date, end_date, key, table, rejections=None):
+        path = self._file_path(name, start_date, end_date)
+        metadata = {**(table.schema.metadata or {}), KEY_METADATA: key}
+        if rejections is not None:
+            metadata[REJECTIONS_METADATA] = json.dumps({
+                'columns': list(rejections.columns), 'index': list(rejections.index),
+                'data': rejections.to_numpy().tolist(),
+            })
+        table = table.replace_schema_metadata(metadata)
+        tmp_path = f'{path}.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
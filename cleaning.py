@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+# Bump whenever a rule changes, so persisted aggregates built with older rules are recomputed.
+RULES_VERSION = 1
+
+NOT_NULL_COLUMNS = ['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count']
+
+
+# Rejection reasons, in the order they are attributed: a row breaking several rules counts for the first one
+RULES = ['duplicate', 'missing_value', 'outside_window', 'non_positive_duration', 'short_trip', 'speeding',
+         'zero_distance', 'invalid_amount', 'zero_passengers']
+
+
+def passes(condition):
+    """Boolean array of a rule's passing condition; a null (Arrow-backed) result breaks the rule like NaN does."""
+    return condition.to_numpy(dtype=bool, na_value=False)
+
+
+def rejection_reasons(df, start_date, end_date, duplicated=None):
+    """Evaluate every clean_data rule in one pass over the columns of ``df``.
+
+    Returns, per row, 0 if it is kept or 1 + the index in RULES of the first rule it
+    breaks, and the trip duration in seconds. ``duplicated`` flags the rows to reject as
+    duplicates; a ``None`` start_date / end_date leaves that side of the date window open.
+    NumPy and Arrow-backed (ArrowDtype) columns give the same result.
+    """
+    pickup, dropoff = df['tpep_pickup_datetime'], df['tpep_dropoff_datetime']
+    duration = (dropoff - pickup).dt.total_seconds()
+    speed = df['trip_distance'] / (duration / 3600)
+
+    in_window = np.ones(len(df), dtype=bool)
+    if start_date is not None:
+        in_window &= passes(pickup >= pd.Timestamp(start_date))
+    if end_date is not None:
+        in_window &= passes(dropoff <= pd.Timestamp(end_date))
+
+    # Every rule is written as its passing condition, so a NaN operand breaks it
+    failures = [
+        np.zeros(len(df), dtype=bool) if duplicated is None else duplicated,
+        df[NOT_NULL_COLUMNS].isna().any(axis=1).to_numpy(),
+        ~in_window,
+        ~passes(duration > 0),
+        ~passes(duration >= 60),
+        ~passes(speed <= 100),
+        ~passes(df['trip_distance'] > 0),
+        ~passes((df['total_amount'] > 0) & (df['total_amount'] <= 5000)),
+        ~passes(df['passenger_count'] > 0),
+    ]
+    reasons = np.select(failures, np.arange(1, len(RULES) + 1, dtype=np.int8), 0).astype(np.int8)
+    return reasons, duration.to_numpy(dtype=float, na_value=np.nan)
+
+
+def rejection_counts(dropoff, reasons):
+    """Rows rejected by each rule, per month of ``dropoff``; a frame indexed by year_month with RULES columns.
+
+    Months without any rejected row are left out.
+    """
+    rejected = reasons != 0
+    dropoff = dropoff.to_numpy(dtype='datetime64[ns]', na_value=np.datetime64('NaT'))
+    months, codes = np.unique(dropoff[rejected].astype('datetime64[M]'), return_inverse=True)
+    counts = np.bincount(codes * len(RULES) + reasons[rejected] - 1, minlength=len(months) * len(RULES))
+    counts = counts.reshape(len(months), len(RULES))
+    return pd.DataFrame(counts, columns=RULES,
+                        index=pd.Index(np.datetime_as_string(months, unit='M'), name='year_month'))
+
+
+def merge_rejections(left, right):
+    """Sum two rejection_counts frames, e.g. of different batches."""
+    merged = left.add(right, fill_value=0).reindex(columns=RULES, fill_value=0).astype(np.int64)
+    merged.index.name = 'year_month'
+    return merged
+
+
+def clean_selection(df, start_date, end_date, duplicated=None):
+    """Apply every clean_data rule with a single selection, so the kept rows are copied once.
+
+    Returns the kept rows, their duration in seconds and the rejection_counts of ``df``.
+    A RatecodeID read as float64 because the scanned rows had nulls is cast back to int64
+    here, on the kept rows only; it stays as read if some of those are null.
+    """
+    reasons, duration = rejection_reasons(df, start_date, end_date, duplicated)
+    keep = np.flatnonzero(reasons == 0)
+    kept = df.take(keep)
+    if 'RatecodeID' in kept and pd.api.types.is_float_dtype(kept['RatecodeID']) and kept['RatecodeID'].notna().all():
+        kept['RatecodeID'] = kept['RatecodeID'].astype(np.int64)
+    return kept, duration[keep], rejection_counts(df['tpep_dropoff_datetime'], reasons)
+
+
+def clean_frame(df, start_date, end_date, deduplicate=True):
+    """Apply the clean_data rules to a single frame (a month, a batch, ...).
+
+    Duplicates are only removed within ``df``.
+    """
+    return clean_selection(df, start_date, end_date, duplicated_rows(df) if deduplicate else None)[0]
+
+
+def duplicated_rows(df):
+    """Exact equivalent of ``df.duplicated()`` built on a 64-bit fingerprint per row.
+
+    Only rows whose fingerprint repeats are compared value by value, so a hash collision
+    can never drop a distinct row.
+    """
+    fingerprints = pd.util.hash_pandas_object(df, index=False)
+    candidates = fingerprints.duplicated(keep=False).to_numpy()
+    duplicated = np.zeros(len(df), dtype=bool)
+    if candidates.any():
+        duplicated[candidates] = df[candidates].duplicated().to_numpy()
+    return duplicated
+
+
+def drop_duplicate_rows(df):
+    return df[~duplicated_rows(df)]
+
+
+class SeenRows:
+    """Exact duplicate detection across the batches of a scan, in a single pass over the rows.
+
+    A 64-bit fingerprint and the position of the first row are kept per distinct row.
+    add() flags the rows of a batch whose fingerprint was already seen; the caller sets
+    them aside, and resolve() compares only those with the first row of their fingerprint,
+    value by value, so a hash collision can never drop a distinct row.
+    """
+
+    def __init__(self):
+        # Sorted fingerprints of the rows seen and the position of the first row of each
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.positions = np.empty(0, dtype=np.int64)
+        self.candidates = []
+        # Fingerprints and positions of the candidates resolve() found to be distinct rows
+        self.distinct = []
+        # First rows of a candidate fingerprint that were still in memory when the candidate was seen
+        self.firsts = []
+
+    def add(self, df, positions):
+        """Record a batch whose rows are at ``positions``; returns the flags of its candidate rows."""
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        # Sorted lookups and a stable sort, which merges the two sorted runs, keep this linear in the rows seen
+        order = np.argsort(hashes, kind='stable')
+        sorted_hashes = hashes[order]
+        first = np.ones(len(df), dtype=bool)
+        first[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+        index = np.searchsorted(self.hashes, sorted_hashes)
+        known = index < len(self.hashes)
+        known[known] = self.hashes[index[known]] == sorted_hashes[known]
+        added = order[first & ~known]
+        new = np.zeros(len(df), dtype=bool)
+        new[added] = True
+
+        hashes_seen = np.concatenate([self.hashes, hashes[added]])
+        merge_order = np.argsort(hashes_seen, kind='stable')
+        self.hashes = hashes_seen[merge_order]
+        self.positions = np.concatenate([self.positions, positions[added]])[merge_order]
+
+        candidates = ~new
+        if candidates.any():
+            self.candidates.append((hashes[candidates], positions[candidates], df[candidates]))
+            firsts = new & np.isin(hashes, hashes[candidates])
+            self.firsts.append((positions[firsts], df[firsts]))
+        return candidates
+
+    def resolve(self, read_rows):
+        """The candidate rows, in the order they were added, and the flags of those that are duplicates.
+
+        ``read_rows(positions)`` returns the rows at the sorted ``positions``, for the first
+        rows that are no longer in memory.
+        """
+        hashes = np.concatenate([hashes for hashes, _, _ in self.candidates])
+        positions = np.concatenate([positions for _, positions, _ in self.candidates])
+        rows = pd.concat([rows for _, _, rows in self.candidates], ignore_index=True)
+        kept_positions = np.concatenate([positions for positions, _ in self.firsts])
+        firsts = [rows for _, rows in self.firsts if len(rows)]
+        needed = np.unique(self.positions[np.searchsorted(self.hashes, hashes)])
+        missing = np.setdiff1d(needed, kept_positions)
+        if len(missing):
+            firsts.append(read_rows(missing))
+        # The first rows have distinct fingerprints, so only the candidates can be flagged
+        compared = pd.concat(firsts + [rows], ignore_index=True)
+        duplicated = compared.duplicated().to_numpy()[len(compared) - len(rows):]
+        self.distinct.append((hashes[~duplicated], positions[~duplicated]))
+        return rows, duplicated
+
+    def fingerprints(self):
+        """Fingerprints and positions of every distinct row seen, once the candidates are resolved."""
+        return (np.concatenate([self.hashes, *(hashes for hashes, _ in self.distinct)]),
+                np.concatenate([self.positions, *(positions for _, positions in self.distinct)]))
@@ -0,0 +1,77 @@
+import functools
+import http.server
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+
+def make_trips(month, rows, seed=0):
+    """Small yellow-taxi-like table for ``month`` ('YYYY-MM') with the dirty cases clean_data rejects."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(f'{month}-01')
+    seconds = int((start + pd.offsets.MonthBegin(1) - start).total_seconds())
+
+    pickup = start + pd.to_timedelta(rng.integers(-3600, seconds, rows), unit='s')
+    duration = rng.integers(-120, 3600, rows)
+    distance = np.round(rng.gamma(1.5, 2.0, rows), 2)
+    distance[rng.random(rows) < 0.02] = 0
+    amount = np.round(3 + distance * 3 + rng.normal(0, 2, rows), 2)
+    passengers = rng.choice([0.0, 1.0, 2.0, 3.0], rows, p=[0.05, 0.6, 0.25, 0.1])
+    missing = rng.random(rows) < 0.03
+
+    table = pa.table({
+        'VendorID': pa.array(rng.integers(1, 3, rows)),
+        'tpep_pickup_datetime': pa.array(pickup.values.astype('datetime64[us]')),
+        'tpep_dropoff_datetime': pa.array((pickup + pd.to_timedelta(duration, unit='s')).values.astype('datetime64[us]')),
+        'passenger_count': pa.array(passengers, mask=missing),
+        'trip_distance': pa.array(distance),
+        'RatecodeID': pa.array(rng.choice([1.0, 2.0, 3.0, 5.0, 99.0], rows), mask=missing),
+        'store_and_fwd_flag': pa.array(np.where(rng.random(rows) < 0.5, 'N', 'Y')),
+        'total_amount': pa.array(amount),
+    })
+    return pa.concat_tables([table, table.slice(0, rows // 50)])
+
+
+@pytest.fixture
+def trip_files(tmp_path):
+    """Write synthetic monthly files; returns {month: path}."""
+    def write(months, rows=2000, row_group_size=500):
+        paths = {}
+        for i, month in enumerate(months):
+            paths[month] = tmp_path / f'yellow_tripdata_{month}.parquet'
+            pq.write_table(make_trips(month, rows, seed=i), paths[month], row_group_size=row_group_size)
+        return paths
+    return write
+
+
+class FlakyHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves a directory, answering the first request of every path with a 503."""
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            first = self.server.requests.count(self.path) == 1
+        if first:
+            self.send_error(503)
+        else:
+            super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def flaky_server(tmp_path):
+    """Local stand-in for the trip-data CDN, serving tmp_path; yields the server, see FlakyHandler."""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                             functools.partial(FlakyHandler, directory=str(tmp_path)))
+    server.lock, server.requests = threading.Lock(), []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
@@ -0,0 +1,64 @@
+import http.client
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
+
+RETRIES = 3
+BACKOFF = 0.5
+# Seconds a connection or a read may stall before the download fails (and is retried)
+TIMEOUT = 60
+
+
+def is_transient(error):
+    """Whether a failed download is worth retrying: network errors, timeouts, 429 and 5xx responses."""
+    if isinstance(error, HTTPError):
+        return error.code == 429 or error.code >= 500
+    # socket.timeout, raised by a stalled read, is only an alias of TimeoutError from Python 3.10
+    return isinstance(error, (URLError, ConnectionError, TimeoutError, socket.timeout, http.client.HTTPException))
+
+
+def with_retries(func, *args, retries=RETRIES, backoff=BACKOFF):
+    """Call ``func(*args)``, retrying transient errors up to ``retries`` times with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def read_url(url, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+    def read():
+        with urlopen(url, timeout=timeout) as response:
+            return response.read()
+    return with_retries(read, retries=retries, backoff=backoff)
+
+
+def prefetch(items, fetch, depth=2):
+    """Yield ``(item, fetch(item))`` in order while the next ``depth`` items are fetched in background threads.
+
+    At most ``depth`` fetched results wait for the consumer, which bounds memory whatever
+    the number of items. Pending fetches are cancelled if the consumer stops early.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+        queue = deque()
+        try:
+            for item in items:
+                queue.append((item, pool.submit(fetch, item)))
+                if len(queue) == depth:
+                    break
+            while queue:
+                item, future = queue.popleft()
+                result = future.result()
+                for next_item in items:
+                    queue.append((next_item, pool.submit(fetch, next_item)))
+                    break
+                yield item, result
+        finally:
+            for _, future in queue:
+                future.cancel()
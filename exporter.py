@@ -0,0 +1,91 @@
+"""Output writers shared by the engines.
+
+Every writer takes pandas, Polars or Arrow tables and goes through Arrow, so no engine
+has to convert its results to pandas. Excel uses an openpyxl write-only workbook,
+which streams rows to disk instead of keeping every cell in memory, and the CSV,
+Excel, Parquet and Arrow IPC outputs are written concurrently by export_results.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+from pyarrow import feather
+
+SHEET_COLUMNS = ['year_month', 'day_type', 'services', 'distances', 'passengers']
+# Sheet of each rate category, in workbook order
+SHEETS = {'jfk': 'JFK', 'regular': 'Regular', 'other': 'Others'}
+FORMATS = ('csv', 'xlsx', 'parquet', 'arrow')
+
+
+def to_arrow(frame):
+    """Arrow table of a pandas/Polars/Arrow frame, with dictionary (categorical) columns decoded."""
+    if isinstance(frame, pd.DataFrame):
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+    elif isinstance(frame, pa.Table):
+        table = frame
+    else:
+        table = frame.to_arrow()
+    return pa.table(
+        [column.cast(column.type.value_type) if pa.types.is_dictionary(column.type) else column
+         for column in table.columns],
+        names=table.column_names
+    )
+
+
+def months_table(sheets):
+    """The per-category month metrics as one table, with the category in a rate_category column."""
+    tables = []
+    for category, frame in sheets.items():
+        table = to_arrow(frame).select(SHEET_COLUMNS)
+        tables.append(table.add_column(0, 'rate_category', pa.array([category] * len(table), pa.string())))
+    return pa.concat_tables(tables, promote_options='permissive')
+
+
+def write_excel(path, sheets, columns=SHEET_COLUMNS):
+    """Write ``sheets`` ({rate category: frame}) as the JFK/Regular/Others sheets of a write-only workbook."""
+    workbook = Workbook(write_only=True)
+    for category, frame in sheets.items():
+        sheet = workbook.create_sheet(SHEETS[category])
+        sheet.append(columns)
+        for batch in to_arrow(frame).select(columns).to_batches():
+            for row in zip(*(column.to_pylist() for column in batch.columns)):
+                sheet.append(row)
+    workbook.save(path)
+
+
+def write_parquet(path, table):
+    pq.write_table(table, path)
+
+
+def write_ipc(path, table):
+    feather.write_feather(table, path, compression='uncompressed')
+
+
+def export_results(name, write_csv, csv_df, sheets, formats=FORMATS):
+    """Write the outputs of one engine concurrently.
+
+    ``write_csv`` is the engine's own CSV writer, kept so that each engine's CSV stays
+    formatted as it always was. Parquet and Arrow IPC outputs hold the week metrics in
+    ``{name}.parquet``/``{name}.arrow`` and the month metrics in ``{name}_months.*``.
+    """
+    # Frames are converted here, as Polars frames must not be read from several threads at once
+    sheets = {category: to_arrow(frame) for category, frame in sheets.items()}
+    outputs = {}
+    if 'parquet' in formats or 'arrow' in formats:
+        outputs = {name: to_arrow(csv_df), f'{name}_months': months_table(sheets)}
+
+    tasks = []
+    if 'csv' in formats:
+        tasks.append(write_csv)
+    if 'xlsx' in formats:
+        tasks.append(lambda: write_excel(f'{name}.xlsx', sheets))
+    for fmt, writer in [('parquet', write_parquet), ('arrow', write_ipc)]:
+        if fmt in formats:
+            tasks += [lambda writer=writer, path=f'{stem}.{fmt}', table=table: writer(path, table)
+                      for stem, table in outputs.items()]
+
+    with ThreadPoolExecutor(max_workers=len(tasks) or 1) as pool:
+        for future in [pool.submit(task) for task in tasks]:
+            future.result()
@@ -0,0 +1,219 @@
+"""Per-phase metrics for the YellowTaxiData engines.
+
+Instrumentation runs the phase methods of an engine and records, for each one, wall
+and CPU time, rows of ``data`` before and after, and peak and delta RSS. cProfile and
+tracemalloc can be switched on for chosen phases. The records are available as
+PhaseMetrics objects, as JSON and as a Prometheus textfile for node_exporter.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import psutil
+
+PHASES = ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics', 'generate_month_metrics',
+          'format_data', 'export_data']
+PHASE_LABELS = {
+    'init': 'Init objects',
+    'import_data': 'Importing data',
+    'clean_data': 'Cleaning data',
+    'add_more_columns': 'Adding more columns',
+    'process_batches': 'Streaming batches',
+    'generate_week_metrics': 'Generating week metrics',
+    'generate_month_metrics': 'Generating month metrics',
+    'collect_data': 'Collecting results',
+    'format_data': 'Formatting results',
+    'export_data': 'Exporting results',
+}
+PROMETHEUS_METRICS = [
+    ('wall_seconds', 'Wall-clock time of the phase.'),
+    ('cpu_seconds', 'CPU time of the process during the phase, all threads included.'),
+    ('rows_in', 'Rows of the engine data before the phase.'),
+    ('rows_out', 'Rows of the engine data after the phase.'),
+    ('rss_peak_bytes', 'Peak resident set size sampled during the phase.'),
+    ('rss_delta_bytes', 'Resident set size after the phase minus before it.'),
+    ('traced_peak_bytes', 'Peak Python allocations traced by tracemalloc during the phase.'),
+]
+
+
+def engine_phases(taxi_data):
+    """Phase methods of an engine in execution order."""
+    phases = list(PHASES)
+    if hasattr(taxi_data, 'process_batches'):
+        phases[1:3] = ['process_batches']
+    if hasattr(taxi_data, 'collect_data'):
+        phases.insert(phases.index('format_data'), 'collect_data')
+    return phases
+
+
+def row_count(data):
+    """Rows of a pandas/Polars/Arrow table, None for lazy plans and other objects without a length."""
+    if hasattr(data, '__dask_graph__'):
+        # len() of a dask collection would run its whole graph
+        return None
+    try:
+        return len(data)
+    except TypeError:
+        return None
+
+
+class PeakRss:
+    """Context manager that samples the RSS of this process in a thread and keeps the peak."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.start = self.end = self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start = self.peak = self.process.memory_info().rss
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.end = self.process.memory_info().rss
+        self.peak = max(self.peak, self.end)
+
+
+class PhaseMetrics:
+    """What was measured for one phase; ``profile`` holds the pstats.Stats when cProfile was on."""
+
+    def __init__(self, phase, wall_seconds, cpu_seconds, rss_peak_bytes, rss_delta_bytes, rows_in=None,
+                 rows_out=None, traced_peak_bytes=None, profile=None):
+        self.phase = phase
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds
+        self.rss_peak_bytes = rss_peak_bytes
+        self.rss_delta_bytes = rss_delta_bytes
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+        self.traced_peak_bytes = traced_peak_bytes
+        self.profile = profile
+
+    def to_dict(self):
+        metrics = {name: getattr(self, name) for name, _ in PROMETHEUS_METRICS}
+        return {'phase': self.phase, **metrics}
+
+    def __repr__(self):
+        return f'PhaseMetrics({self.phase!r}, wall_seconds={self.wall_seconds:.3f}, rows_out={self.rows_out})'
+
+
+class Instrumentation:
+    """Runs and measures engine phases.
+
+    ``profile`` and ``trace_memory`` are collections of phase names to run under cProfile
+    or tracemalloc, or True for every phase. With ``verbose`` each phase is announced and
+    its wall time printed in the '*** N seconds ***' format the scripts always used.
+    """
+
+    def __init__(self, profile=(), trace_memory=(), verbose=False, rss_interval=0.005):
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.verbose = verbose
+        self.rss_interval = rss_interval
+        self.phases = []
+
+    @staticmethod
+    def _enabled(option, phase):
+        return option is True or phase in option
+
+    @contextmanager
+    def measure(self, phase, data=None):
+        """Measure the ``with`` block as ``phase``; ``data`` is a callable returning the rows to count."""
+        label = PHASE_LABELS.get(phase, phase)
+        if self.verbose:
+            print(f'{label} ...')
+        rows_in = row_count(data()) if data is not None else None
+        profiler = cProfile.Profile() if self._enabled(self.profile, phase) else None
+        tracing = self._enabled(self.trace_memory, phase) and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+
+        traced_peak = None
+        try:
+            with PeakRss(self.rss_interval) as rss:
+                cpu_start, wall_start = time.process_time(), time.perf_counter()
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    yield
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                    wall_seconds = time.perf_counter() - wall_start
+                    cpu_seconds = time.process_time() - cpu_start
+        finally:
+            if tracing:
+                traced_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+        self.phases.append(PhaseMetrics(
+            phase, wall_seconds, cpu_seconds, rss.peak, rss.end - rss.start,
+            rows_in=rows_in, rows_out=row_count(data()) if data is not None else None,
+            traced_peak_bytes=traced_peak,
+            profile=pstats.Stats(profiler, stream=io.StringIO()) if profiler is not None else None,
+        ))
+        if self.verbose:
+            print(f'*** {wall_seconds} seconds ***')
+
+    def run_phase(self, taxi_data, phase):
+        with self.measure(phase, data=lambda: getattr(taxi_data, 'data', None)):
+            getattr(taxi_data, phase)()
+        return self.phases[-1]
+
+    def run(self, taxi_data, phases=None):
+        """Run ``phases`` (by default every phase of the engine) in order; returns their metrics."""
+        return [self.run_phase(taxi_data, phase) for phase in phases or engine_phases(taxi_data)]
+
+    @property
+    def total_seconds(self):
+        return sum(m.wall_seconds for m in self.phases)
+
+    def to_dict(self):
+        return {'phases': [m.to_dict() for m in self.phases], 'total_seconds': self.total_seconds}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_profiles(self, directory):
+        """Dump the cProfile stats of each profiled phase to ``directory/<phase>.prof``."""
+        os.makedirs(directory, exist_ok=True)
+        for m in self.phases:
+            if m.profile is not None:
+                m.profile.dump_stats(os.path.join(directory, f'{m.phase}.prof'))
+
+    def to_prometheus(self, labels=None):
+        """Prometheus text exposition of every phase, with ``labels`` (e.g. the engine) added to each sample."""
+        lines = []
+        for name, help_text in PROMETHEUS_METRICS:
+            lines += [f'# HELP yellow_taxi_phase_{name} {help_text}', f'# TYPE yellow_taxi_phase_{name} gauge']
+            for m in self.phases:
+                value = getattr(m, name)
+                if value is None:
+                    continue
+                sample_labels = ','.join(f'{k}="{v}"' for k, v in {**(labels or {}), 'phase': m.phase}.items())
+                lines.append(f'yellow_taxi_phase_{name}{{{sample_labels}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, labels=None):
+        """Write the textfile atomically, as node_exporter may read it at any time."""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus(labels))
+        os.replace(tmp_path, path)
@@ -0,0 +1,150 @@
+"""Memory-aware scheduling of the month loads of the in-memory engines.
+
+The in-memory size of a month is estimated from its parquet footer: row count times
+the width of every fixed-width column, or the uncompressed size of the others, times
+LOAD_OVERHEAD for the decode buffers, the Arrow table and the frame converted from it,
+which are alive at the same time. LoadScheduler starts the loads in order on a thread
+pool sized to the machine, and only while the estimates of the running loads fit in the
+memory budget; a month larger than the whole budget runs alone.
+"""
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import psutil
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from trip_reader import REQUIRED_COLUMNS
+
+# Peak bytes of a load per byte of its Arrow table, measured on a 1.9M-row month
+LOAD_OVERHEAD = 3
+# Share of the available memory used as budget when none is given
+AVAILABLE_FRACTION = 0.5
+# Threads fetching the next months besides the running loads, as in ThreadPoolExecutor's default
+FETCH_THREADS = 4
+
+
+def read_metadata(source):
+    if isinstance(source, pa.Buffer):
+        return pq.read_metadata(pa.BufferReader(source))
+    return pq.read_metadata(str(source))
+
+
+def estimate_month_bytes(source, columns=REQUIRED_COLUMNS):
+    """Estimated peak bytes of loading ``columns`` of a monthly file, from its footer only.
+
+    None for remote files, whose footer cannot be read without downloading them.
+    """
+    if not isinstance(source, pa.Buffer) and urlparse(str(source)).scheme in ('http', 'https'):
+        return None
+    metadata = read_metadata(source)
+    schema = metadata.schema.to_arrow_schema()
+    paths = [metadata.schema.column(i).path for i in range(metadata.num_columns)]
+    table_bytes = 0
+    for column in columns:
+        field = schema.field(column)
+        if pa.types.is_primitive(field.type) and not pa.types.is_boolean(field.type):
+            table_bytes += metadata.num_rows * field.type.bit_width // 8
+        else:
+            index = paths.index(column)
+            table_bytes += sum(metadata.row_group(i).column(index).total_uncompressed_size
+                               for i in range(metadata.num_row_groups))
+        # Validity bitmap
+        table_bytes += metadata.num_rows // 8
+    return table_bytes * LOAD_OVERHEAD
+
+
+def available_budget(fraction=AVAILABLE_FRACTION):
+    return int(psutil.virtual_memory().available * fraction)
+
+
+class LoadScheduler:
+    """Thread pool whose tasks only start while their estimated bytes fit in ``budget``.
+
+    ``budget`` defaults to AVAILABLE_FRACTION of the memory available when the scheduler
+    is created. At most ``max_workers`` loads, by default the CPU count, run at once; the
+    pool has FETCH_THREADS more threads so that following months are fetched meanwhile.
+    Loads start in submission order; the seconds each one waited for the budget are in
+    ``waits`` after map. Once a task fails, the loads that have not started are cancelled.
+    """
+
+    def __init__(self, budget=None, max_workers=None):
+        self.budget = available_budget() if budget is None else budget
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.in_use = 0
+        self.peak = 0
+        self.running = 0
+        self.waits = []
+        self.error = None
+        self._turn = 0
+        self._condition = threading.Condition()
+
+    def _admit(self, ticket, size):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.error is not None or (self._turn == ticket and self.running < self.max_workers
+                                                   and (self.in_use == 0 or self.in_use + size <= self.budget)))
+            if self.error is not None:
+                raise CancelledError
+            self._turn += 1
+            self.running += 1
+            self.in_use += size
+            self.peak = max(self.peak, self.in_use)
+            self._condition.notify_all()
+
+    def _release(self, size):
+        with self._condition:
+            self.running -= 1
+            self.in_use -= size
+            self._condition.notify_all()
+
+    def _fail(self, error):
+        with self._condition:
+            if self.error is None:
+                self.error = error
+            self._condition.notify_all()
+
+    def map(self, load, items, prepare):
+        """``[load(...) for item in items]``, run concurrently within the budget.
+
+        ``prepare(item)`` runs first, outside the budget (e.g. to download the file), and
+        returns the bytes the load needs, or None if unknown, in which case the load takes
+        the whole budget, and the argument of ``load``. The first exception is raised as
+        soon as the running loads finish, without starting the others.
+        """
+        items = list(items)
+        self.waits = [0.0] * len(items)
+
+        def run(ticket, item):
+            if self.error is not None:
+                raise CancelledError
+            try:
+                size, argument = prepare(item)
+            except BaseException as error:
+                self._fail(error)
+                raise
+            size = self.budget if size is None else size
+            started = time.perf_counter()
+            self._admit(ticket, size)
+            self.waits[ticket] = time.perf_counter() - started
+            try:
+                return load(argument)
+            except BaseException as error:
+                self._fail(error)
+                raise
+            finally:
+                self._release(size)
+
+        with ThreadPoolExecutor(max(1, min(self.max_workers + FETCH_THREADS, len(items)))) as pool:
+            try:
+                return list(pool.map(run, range(len(items)), items))
+            except CancelledError:
+                # An earlier task was cancelled because of a later one's failure
+                raise self.error
+
+    def stats(self):
+        return {'budget_bytes': self.budget, 'max_workers': self.max_workers, 'peak_bytes': self.peak,
+                'wait_seconds': sum(self.waits)}
@@ -1,11 +1,32 @@
 import pandas as pd
 import numpy as np
-import time
+import pyarrow as pa
+from aggregates import labelled_codes
+from checkpoint import CleanCheckpoint, restored_rejections
+from cleaning import clean_selection, drop_duplicate_rows, duplicated_rows
+from exporter import export_results, write_excel
+from instrumentation import Instrumentation
+from parquet_cache import ParquetCache
+from trip_reader import compact_table, scan_month_checked, to_pandas
 
 class YellowTaxiData:
-    def __init__(self, start_date, end_date):
+    def __init__(self, start_date, end_date, cache=None, compact=False, duplicates_cross_files=True, checkpoint=None,
+                 dtype_backend=None, count_rejections=False):
         self.start_date = start_date
         self.end_date = end_date
+        self.cache = cache
+        # 'pyarrow' keeps every column Arrow-backed (pandas ArrowDtype), see trip_reader.to_pandas
+        self.dtype_backend = dtype_backend
+        self.checkpoint = checkpoint
+        self.checkpoint_key = None
+        self.restored = False
+        self.compact = compact
+        self.duplicates_cross_files = duplicates_cross_files
+        # Counting rejections is a diagnostic: it turns off the trip_reader.pushdown_filter scan, so it is opt-in
+        self.count_rejections = count_rejections
+        self.bytes_saved = 0
+        # Columns cast to trip_reader.CANONICAL_SCHEMA while reading, {url: {column: (stored, canonical type)}}
+        self.schema_mismatches = {}
         self.dates_list = pd.date_range(self.start_date, self.end_date, freq='MS').strftime("%Y-%m").tolist()
         self.end_date_weeks = pd.date_range(start=self.start_date, end=self.end_date, freq='W-SUN')
         self.urls_list = [
@@ -19,63 +40,104 @@ class YellowTaxiData:
         self.regular_df = pd.DataFrame()
         self.other_df = pd.DataFrame()
         self.csv_df = pd.DataFrame()
+        # Rows dropped by clean_data, per month and rule (see cleaning.RULES)
+        self.rejections = pd.DataFrame()
+
+
+    def source_path(self, url):
+        return self.cache.fetch(url) if self.cache is not None else url
+
+
+    def restore_checkpoint(self):
+        """Load the cleaned, key-enriched data of an earlier run; clean_data and add_more_columns then do nothing."""
+        if self.checkpoint is None:
+            return False
+        # Options the cleaned table, and the rejection counts saved with it, depend on
+        options = {'compact': self.compact, 'duplicates_cross_files': self.duplicates_cross_files,
+                   'dtype_backend': self.dtype_backend, 'count_rejections': self.count_rejections}
+        self.checkpoint_key = self.checkpoint.key(self.start_date, self.end_date,
+                                                  [self.source_path(url) for url in self.urls_list], options)
+        table = self.checkpoint.load('original', self.start_date, self.end_date, self.checkpoint_key)
+        if table is not None:
+            self.data = to_pandas(table, self.dtype_backend)
+            self.rejections = restored_rejections(table)
+            self.restored = True
+        return self.restored
+
+
+    def save_checkpoint(self):
+        if self.checkpoint is not None and not self.restored:
+            self.checkpoint.save('original', self.start_date, self.end_date, self.checkpoint_key,
+                                 pa.Table.from_pandas(self.data, preserve_index=False),
+                                 self.rejections if self.count_rejections else None)
+
+
+    def read_month(self, url):
+        # Only necessary columns are read, and only the rows passing trip_reader.pushdown_filter
+        # unless rejections are counted
+        table, mismatches = scan_month_checked(self.source_path(url), self.start_date, self.end_date,
+                                               pushdown=not self.count_rejections)
+        bytes_saved = 0
+        if self.compact:
+            table, bytes_saved = compact_table(table)
+        df = to_pandas(table, self.dtype_backend)
+        if not self.duplicates_cross_files:
+            df = drop_duplicate_rows(df)
+        return df, bytes_saved, mismatches
 
 
     def import_data(self):
-        dataframes_list = [
-            pd.read_parquet(
-                path=url,
-                engine='pyarrow'
-            ) for url in self.urls_list
-        ]
+        if self.restore_checkpoint():
+            return
+
+        months = [self.read_month(url) for url in self.urls_list]
 
-        self.data = pd.concat(dataframes_list, ignore_index=True)
-        self.data = self.data[['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count', 'trip_distance',
-                               'RatecodeID','total_amount']] # Filter columns, only necessary columns
+        self.bytes_saved = sum(bytes_saved for _, bytes_saved, _ in months)
+        self.schema_mismatches = {
+            url: mismatches for url, (_, _, mismatches) in zip(self.urls_list, months) if mismatches
+        }
+        self.data = pd.concat([df for df, _, _ in months], ignore_index=True)
         self.data.set_index(['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'RatecodeID'],
                             inplace=True, drop=False)
 
 
     def clean_data(self):
-        self.data.drop_duplicates(inplace=True)
-        self.data.dropna(subset=['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count'], inplace=True)
-
-        self.data = self.data[
-            (self.data['tpep_pickup_datetime'] >= self.start_date) &
-            (self.data['tpep_dropoff_datetime'] <= self.end_date)
-        ]
-
-        self.data = self.data[self.data['tpep_dropoff_datetime'] > self.data['tpep_pickup_datetime']]
-
-        self.data = self.data[
-            (self.data['tpep_dropoff_datetime'] - self.data['tpep_pickup_datetime']).dt.total_seconds() >= 60
-        ]
-
-        #100mph = 160km/h
-        self.data = self.data[
-            (self.data['trip_distance']) /
-            ((self.data['tpep_dropoff_datetime'] - self.data['tpep_pickup_datetime']).dt.total_seconds() / 3600) <= 100
-        ]
-
-        self.data = self.data[self.data['trip_distance'] > 0]
-        self.data = self.data[(self.data['total_amount'] > 0) & (self.data['total_amount'] <= 5000)]
-
-        self.data = self.data[self.data['passenger_count'] > 0]
+        if self.restored:
+            return
+        duplicated = duplicated_rows(self.data) if self.duplicates_cross_files else None
+        self.data, _, rejections = clean_selection(self.data, self.start_date, self.end_date, duplicated)
+        # Without count_rejections the scan already dropped rows these counts would miss
+        if self.count_rejections:
+            self.rejections = rejections
 
 
     def add_more_columns(self):
-        self.data['year_month'] = self.data['tpep_dropoff_datetime'].dt.strftime('%Y-%m')
-        self.data['year_dt'] = self.data['tpep_dropoff_datetime'].dt.year.astype(str)
-        self.data['week_dt'] = self.data['tpep_dropoff_datetime'].dt.isocalendar().week.astype(str).str.zfill(3)
-        self.data['year_week'] = self.data['year_dt'].str.cat(self.data['week_dt'], sep='-')
-        self.data['year_month_day'] = self.data['tpep_dropoff_datetime'].dt.strftime('%Y-%m-%d')
+        if self.restored:
+            return
+        # Integer calendar codes, only the distinct values are formatted as labels
+        dt = self.data['tpep_dropoff_datetime']
+        year = dt.dt.year.to_numpy(dtype=np.int64)
+        week = dt.dt.isocalendar().week.to_numpy(dtype=np.int64)
+        year_month = year * 100 + dt.dt.month.to_numpy(dtype=np.int64)
+
+        self.data['year_month'] = labelled_codes(year_month, lambda c: '{y}-{m:02d}'.format(y=c // 100, m=c % 100),
+                                                 self.dtype_backend)
+        self.data['year_week'] = labelled_codes(year * 1000 + week,
+                                                lambda c: '{y}-{w:03d}'.format(y=c // 1000, w=c % 1000),
+                                                self.dtype_backend)
+        self.data['year_month_day'] = labelled_codes(
+            year_month * 100 + dt.dt.day.to_numpy(dtype=np.int64),
+            lambda c: '{y}-{m:02d}-{d:02d}'.format(y=c // 10000, m=c // 100 % 100, d=c % 100),
+            self.dtype_backend
+        )
+        self.save_checkpoint()
 
 
     def generate_week_metrics(self):
         self.data['trip_time'] = self.data['tpep_dropoff_datetime'] - self.data['tpep_pickup_datetime']
         self.data['trip_time_in_seconds'] = self.data['trip_time'].dt.total_seconds()
 
-        self.csv_df = self.data.groupby('year_week').agg(
+        self.csv_df = self.data.groupby('year_week', observed=True).agg(
             min_trip_time=('trip_time_in_seconds', 'min'),
             max_trip_time=('trip_time_in_seconds', 'max'),
             mean_trip_time=('trip_time_in_seconds', 'mean'),
@@ -100,8 +162,7 @@ class YellowTaxiData:
             'other_df': -1
         }
 
-        self.data['day_type'] = np.where(self.data['tpep_dropoff_datetime'].dt.dayofweek >= 5, 2, 1)
-        self.data['RatecodeID'] = self.data['RatecodeID'].astype(int)
+        self.data['day_type'] = np.where(self.data['tpep_dropoff_datetime'].dt.dayofweek >= 5, np.int8(2), np.int8(1))
 
         for rc_id in rate_code_id_dict.keys():
             attr = getattr(self, rc_id)
@@ -113,7 +174,7 @@ class YellowTaxiData:
 
             df = df[['year_month', 'day_type', 'trip_distance', 'passenger_count']]
 
-            df = df.groupby(['year_month', 'day_type']).agg(
+            df = df.groupby(['year_month', 'day_type'], observed=True).agg(
                 services=('trip_distance', 'count'),
                 distances=('trip_distance', 'sum'),
                 passengers=('passenger_count', 'sum')
@@ -135,65 +196,31 @@ class YellowTaxiData:
         self.csv_df.to_csv('processed_data.csv', sep='|', index=False)
 
 
+    def month_sheets(self):
+        return {'jfk': self.jfk_df, 'regular': self.regular_df, 'other': self.other_df}
+
+
     def export_excel_data(self):
-        common_columns = ['year_month', 'day_type', 'services', 'distances', 'passengers']
-        with pd.ExcelWriter("processed_data.xlsx", engine="openpyxl") as writer:
-            self.jfk_df[common_columns].to_excel(writer, sheet_name="JFK", index=False)
-            self.regular_df[common_columns].to_excel(writer, sheet_name="Regular", index=False)
-            self.other_df[common_columns].to_excel(writer, sheet_name="Others", index=False)
+        write_excel('processed_data.xlsx', self.month_sheets())
 
 
     def export_data(self):
-        self.export_csv_data()
-        self.export_excel_data()
+        export_results('processed_data', self.export_csv_data, self.csv_df, self.month_sheets())
 
 
 if __name__ == '__main__':
-    global_start_time = time.perf_counter()
-
-    print('Init objects ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data = YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31')
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Importing data ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.import_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Cleaning data ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.clean_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Adding more columns ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.add_more_columns()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Generating week metrics ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.generate_week_metrics()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Generating month metrics ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.generate_month_metrics()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Formatting results ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.format_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Exporting results ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.export_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print("Execution time: {t} seconds".format(t=time.perf_counter() - global_start_time))
-
-
+    instrumentation = Instrumentation(verbose=True)
 
+    with instrumentation.measure('init'):
+        yellow_taxi_data = YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31', cache=ParquetCache(),
+                                          checkpoint=CleanCheckpoint())
 
+    instrumentation.run(yellow_taxi_data)
+    instrumentation.write_json('phase_metrics.json')
+    instrumentation.write_prometheus('phase_metrics.prom', labels={'engine': 'original'})
+    if yellow_taxi_data.count_rejections:
+        yellow_taxi_data.rejections.to_csv('rejections.csv', sep='|')
 
+    for url, mismatches in yellow_taxi_data.schema_mismatches.items():
+        print("Cast {url}: {mismatches}".format(url=url, mismatches=mismatches))
+    print("Execution time: {t} seconds".format(t=instrumentation.total_seconds))
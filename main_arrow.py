@@ -0,0 +1,197 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from concurrent.futures import ThreadPoolExecutor
+from aggregates import format_year_month, format_year_week
+from checkpoint import CleanCheckpoint
+from cleaning import NOT_NULL_COLUMNS
+from exporter import export_results, write_excel
+from instrumentation import Instrumentation
+from parquet_cache import ParquetCache
+from trip_reader import REQUIRED_COLUMNS, scan_month
+
+SECONDS_PER_UNIT = {'s': 1, 'ms': 1e-3, 'us': 1e-6, 'ns': 1e-9}
+
+
+class YellowTaxiData:
+    """Engine written only against pyarrow.compute and Table.group_by.
+
+    The data stays in Arrow buffers from the parquet scan to the CSV writer; only the
+    few dozen aggregated rows go through Python, to format their labels.
+    """
+
+    def __init__(self, start_date, end_date, cache=None, checkpoint=None):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.cache = cache
+        self.checkpoint = checkpoint
+        self.checkpoint_key = None
+        self.restored = False
+        self.dates_list = pd.date_range(self.start_date, self.end_date, freq='MS').strftime("%Y-%m").tolist()
+        self.urls_list = [
+            'https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{dt}.parquet'.format(dt=dt)
+            for dt in self.dates_list
+        ]
+        self.data = pa.table({})
+        self.jfk_df = pa.table({})
+        self.regular_df = pa.table({})
+        self.other_df = pa.table({})
+        self.csv_df = pa.table({})
+
+    def source_path(self, url):
+        return self.cache.fetch(url) if self.cache is not None else url
+
+    def restore_checkpoint(self):
+        """Load the cleaned, key-enriched data of an earlier run; clean_data and add_more_columns then do nothing."""
+        if self.checkpoint is None:
+            return False
+        self.checkpoint_key = self.checkpoint.key(self.start_date, self.end_date,
+                                                  [self.source_path(url) for url in self.urls_list])
+        table = self.checkpoint.load('arrow', self.start_date, self.end_date, self.checkpoint_key)
+        if table is not None:
+            self.data = table
+            self.restored = True
+        return self.restored
+
+    def save_checkpoint(self):
+        if self.checkpoint is not None and not self.restored:
+            self.checkpoint.save('arrow', self.start_date, self.end_date, self.checkpoint_key, self.data)
+
+    def read_month(self, url):
+        return scan_month(self.source_path(url), self.start_date, self.end_date)
+
+    def import_data(self):
+        if self.restore_checkpoint():
+            return
+
+        with ThreadPoolExecutor() as pool:
+            months = list(pool.map(self.read_month, self.urls_list))
+
+        # scan_month reads every month with trip_reader.CANONICAL_SCHEMA, so the chunks are only appended
+        self.data = pa.concat_tables(months)
+
+    def clean_data(self):
+        if self.restored:
+            return
+        # A group_by over every column without aggregations keeps each distinct row once; like
+        # DataFrame.duplicated, rows whose only differences are nulls in the same columns are duplicates
+        data = self.data.group_by(REQUIRED_COLUMNS).aggregate([])
+
+        pickup, dropoff = data['tpep_pickup_datetime'], data['tpep_dropoff_datetime']
+        duration = pc.multiply(pc.cast(pc.subtract(dropoff, pickup), pa.int64()),
+                               SECONDS_PER_UNIT[dropoff.type.unit])
+        speed = pc.divide(data['trip_distance'], pc.divide(duration, 3600))
+        start = pa.scalar(pd.Timestamp(self.start_date).to_pydatetime(), pickup.type)
+        end = pa.scalar(pd.Timestamp(self.end_date).to_pydatetime(), dropoff.type)
+
+        conditions = [
+            *(pc.is_valid(data[column]) for column in NOT_NULL_COLUMNS),
+            pc.greater_equal(pickup, start),
+            pc.less_equal(dropoff, end),
+            pc.greater_equal(duration, 60),
+            pc.less_equal(speed, 100),
+            pc.greater(data['trip_distance'], 0),
+            pc.greater(data['total_amount'], 0),
+            pc.less_equal(data['total_amount'], 5000),
+            pc.greater(data['passenger_count'], 0),
+        ]
+        mask = conditions[0]
+        for condition in conditions[1:]:
+            mask = pc.and_(mask, condition)
+
+        self.data = data.append_column('trip_time_in_seconds', duration).filter(mask)
+
+    def add_more_columns(self):
+        if self.restored:
+            return
+        # Integer calendar codes, formatted as labels only once the metrics are aggregated
+        dropoff = self.data['tpep_dropoff_datetime']
+        year_week = pc.add(pc.multiply(pc.iso_year(dropoff), 100), pc.iso_week(dropoff))
+        year_month = pc.add(pc.multiply(pc.year(dropoff), 100), pc.month(dropoff))
+
+        self.data = self.data.append_column('year_week', year_week).append_column('year_month', year_month)
+        self.save_checkpoint()
+
+    def generate_week_metrics(self):
+        aggregations = [
+            ('trip_time_in_seconds', 'min'), ('trip_time_in_seconds', 'max'), ('trip_time_in_seconds', 'mean'),
+            ('trip_distance', 'min'), ('trip_distance', 'max'), ('trip_distance', 'mean'),
+            ('total_amount', 'min'), ('total_amount', 'max'), ('total_amount', 'mean'),
+            ('total_amount', 'count'),
+        ]
+        names = ['min_trip_time', 'max_trip_time', 'mean_trip_time',
+                 'min_trip_distance', 'max_trip_distance', 'mean_trip_distance',
+                 'min_trip_amount', 'max_trip_amount', 'mean_trip_amount',
+                 'total_services']
+        grouped = self.data.group_by('year_week').aggregate(aggregations).sort_by('year_week')
+
+        services = grouped['total_amount_count'].cast(pa.float64())
+        previous = pa.concat_arrays([pa.nulls(1, pa.float64()), services.combine_chunks()[:-1]])
+        percentage_variation = pc.multiply(pc.divide(pc.subtract(services, previous), previous), 100)
+
+        labels = pa.array(format_year_week(grouped['year_week'].to_numpy()))
+        self.csv_df = pa.table(
+            [labels] + [grouped['{c}_{f}'.format(c=c, f=f)] for c, f in aggregations] + [percentage_variation],
+            names=['year_week'] + names + ['percentage_variation']
+        )
+
+    def generate_month_metrics(self):
+        day_type = pc.if_else(pc.greater_equal(pc.day_of_week(self.data['tpep_dropoff_datetime']), 5),
+                              pa.scalar(2, pa.int8()), pa.scalar(1, pa.int8()))
+        rate_category = pc.case_when(
+            pc.make_struct(pc.equal(self.data['RatecodeID'], 1), pc.equal(self.data['RatecodeID'], 2)),
+            'regular', 'jfk', 'other'
+        )
+
+        grouped = self.data.append_column('day_type', day_type).append_column(
+            'rate_category', rate_category
+        ).group_by(['rate_category', 'year_month', 'day_type']).aggregate([
+            ('trip_distance', 'count'), ('trip_distance', 'sum'), ('passenger_count', 'sum'),
+        ]).sort_by([('year_month', 'ascending'), ('day_type', 'ascending')])
+
+        labels = pa.array(format_year_month(grouped['year_month'].to_numpy()))
+        grouped = pa.table(
+            [grouped['rate_category'], labels, grouped['day_type'], grouped['trip_distance_count'],
+             grouped['trip_distance_sum'], grouped['passenger_count_sum']],
+            names=['rate_category', 'year_month', 'day_type', 'services', 'distances', 'passengers']
+        )
+
+        self.regular_df = grouped.filter(pc.equal(grouped['rate_category'], 'regular')).drop_columns('rate_category')
+        self.jfk_df = grouped.filter(pc.equal(grouped['rate_category'], 'jfk')).drop_columns('rate_category')
+        self.other_df = grouped.filter(pc.equal(grouped['rate_category'], 'other')).drop_columns('rate_category')
+
+    def format_data(self):
+        self.csv_df = pa.table(
+            [pc.round(column, 2) if pa.types.is_floating(column.type) else column for column in self.csv_df.columns],
+            names=self.csv_df.column_names
+        )
+
+    def export_csv_data(self):
+        with open('processed_data_arrow.csv', 'wb') as f:
+            f.write(('|'.join(self.csv_df.column_names) + '\n').encode())
+            pa_csv.write_csv(self.csv_df, f, pa_csv.WriteOptions(include_header=False, delimiter='|',
+                                                                  quoting_style='none'))
+
+    def month_sheets(self):
+        return {'jfk': self.jfk_df, 'regular': self.regular_df, 'other': self.other_df}
+
+    def export_excel_data(self):
+        write_excel('processed_data_arrow.xlsx', self.month_sheets())
+
+    def export_data(self):
+        export_results('processed_data_arrow', self.export_csv_data, self.csv_df, self.month_sheets())
+
+
+if __name__ == '__main__':
+    instrumentation = Instrumentation(verbose=True)
+
+    with instrumentation.measure('init'):
+        yellow_taxi_data = YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31', cache=ParquetCache(),
+                                          checkpoint=CleanCheckpoint())
+
+    instrumentation.run(yellow_taxi_data)
+    instrumentation.write_json('phase_metrics_arrow.json')
+    instrumentation.write_prometheus('phase_metrics_arrow.prom', labels={'engine': 'arrow'})
+
+    print("Execution time: {t} seconds".format(t=instrumentation.total_seconds))
@@ -0,0 +1,179 @@
+import dask
+import dask.dataframe as dd
+import pandas as pd
+from aggregates import (MONTH_AGGS, MONTH_KEYS, OTHER_RATE_CATEGORY, RATE_CATEGORIES, WEEK_AGGS, WEEK_KEYS,
+                        PartialAggregate, derive_keys, month_metrics, week_metrics)
+from cleaning import clean_selection, duplicated_rows, merge_rejections
+from distributed import Client, LocalCluster, wait
+from exporter import export_results, write_excel
+from instrumentation import Instrumentation
+from parquet_cache import ParquetCache
+from trip_reader import CANONICAL_SCHEMA, scan_month
+
+# Partials combined per task in the groupby reduction trees
+SPLIT_EVERY = 8
+# Arrow buffers freed after a scan stay in the process with mimalloc, where spilling cannot
+# reclaim them; the system allocator returns them (dask sets MALLOC_TRIM_THRESHOLD_ for workers).
+WORKER_ENV = {'ARROW_DEFAULT_MEMORY_POOL': 'system'}
+# Grouping keys and aggregated columns, the only ones kept once the keys are derived
+METRIC_COLUMNS = list(dict.fromkeys(
+    WEEK_KEYS + MONTH_KEYS + [column for column, _ in [*WEEK_AGGS.values(), *MONTH_AGGS.values()]]
+))
+RATE_CATEGORY = pd.CategoricalDtype([*RATE_CATEGORIES.values(), OTHER_RATE_CATEGORY])
+
+
+def read_partition(source, start_date, end_date, deduplicate, pushdown):
+    df = scan_month(source, start_date, end_date, pushdown=pushdown).to_pandas()
+    return df[~duplicated_rows(df)] if deduplicate else df
+
+
+def clean_partition(df, start_date, end_date, deduplicate):
+    """clean_selection of one partition: (kept rows with trip_time_in_seconds, rejection counts)."""
+    df, duration, rejections = clean_selection(df, start_date, end_date, duplicated_rows(df) if deduplicate else None)
+    df = df.assign(trip_time_in_seconds=duration)
+    return df, rejections
+
+
+def partition_keys(df):
+    # The date window was applied by clean_data, so the window keys are not needed
+    df = derive_keys(df)[METRIC_COLUMNS]
+    return df.assign(rate_category=df['rate_category'].astype(RATE_CATEGORY))
+
+
+def sum_rejections(parts):
+    rejections = pd.DataFrame()
+    for part in parts:
+        rejections = merge_rejections(rejections, part)
+    return rejections
+
+
+class YellowTaxiData:
+    """Dask DataFrame engine, run on a distributed cluster with one partition per month.
+
+    Without a ``client`` a LocalCluster is started on import_data (and stopped by close),
+    whose workers spill partitions to ``local_directory`` once they use more than the
+    dask ``distributed.worker.memory`` fractions of ``memory_limit``, so a range larger
+    than memory is processed out of core; a worker still needs room for one month while
+    it is read and cleaned. The cleaned partitions, reduced to the metric columns, are
+    persisted on the workers; both metrics are groupbys reduced as trees of
+    ``split_every`` partials, so the driver only receives the aggregated rows.
+
+    With ``duplicates_cross_files`` the months are shuffled by dropoff time before
+    cleaning, so copies of a row in different monthly files end up in the same partition.
+    """
+
+    def __init__(self, start_date, end_date, cache=None, client=None, n_workers=None, memory_limit='auto',
+                 local_directory=None, split_every=SPLIT_EVERY, duplicates_cross_files=True, count_rejections=False):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.cache = cache
+        self.client = client
+        self.cluster = None
+        self.n_workers = n_workers
+        self.memory_limit = memory_limit
+        self.local_directory = local_directory
+        self.split_every = split_every
+        self.duplicates_cross_files = duplicates_cross_files
+        # Counting rejections is a diagnostic: it turns off the trip_reader.pushdown_filter scan, so it is opt-in
+        self.count_rejections = count_rejections
+        self.dates_list = pd.date_range(self.start_date, self.end_date, freq='MS').strftime("%Y-%m").tolist()
+        self.urls_list = [
+            'https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{dt}.parquet'.format(dt=dt)
+            for dt in self.dates_list
+        ]
+        self.data = None
+        self.jfk_df = pd.DataFrame()
+        self.regular_df = pd.DataFrame()
+        self.other_df = pd.DataFrame()
+        self.csv_df = pd.DataFrame()
+        # Rows dropped by clean_data, per month and rule (see cleaning.RULES)
+        self.rejections = pd.DataFrame()
+
+    def connect(self):
+        if self.client is None:
+            self.cluster = LocalCluster(n_workers=self.n_workers, memory_limit=self.memory_limit,
+                                        local_directory=self.local_directory, env=WORKER_ENV)
+            self.client = Client(self.cluster)
+        return self.client
+
+    def close(self):
+        """Stop the cluster started by connect; a client passed in is left open."""
+        if self.cluster is not None:
+            self.client.close()
+            self.cluster.close()
+            self.client = self.cluster = None
+
+    def source_path(self, url):
+        return self.cache.fetch(url) if self.cache is not None else url
+
+    def import_data(self):
+        self.connect()
+        sources = [self.source_path(url) for url in self.urls_list]
+        # Partitions are read with the canonical types, whatever types each file stores
+        meta = CANONICAL_SCHEMA.empty_table().to_pandas()
+        self.data = dd.from_map(read_partition, sources, args=[self.start_date, self.end_date,
+                                                                not self.duplicates_cross_files,
+                                                                not self.count_rejections], meta=meta)
+
+    def clean_data(self):
+        data = self.data
+        if self.duplicates_cross_files:
+            data = data.shuffle(on='tpep_dropoff_datetime', npartitions=data.npartitions)
+
+        parts = [dask.delayed(clean_partition, nout=2)(part, self.start_date, self.end_date,
+                                                        self.duplicates_cross_files)
+                 for part in data.to_delayed()]
+        meta, _ = clean_partition(data._meta, self.start_date, self.end_date, False)
+        data = dd.from_delayed([part[0] for part in parts], meta=meta, verify_meta=False)
+        rejections = dask.delayed(sum_rejections)([part[1] for part in parts])
+
+        self.data, rejections = self.client.persist([data, rejections])
+        wait([self.data, rejections])
+        if self.count_rejections:
+            self.rejections = rejections.compute()
+
+    def add_more_columns(self):
+        data = self.data.map_partitions(partition_keys, meta=partition_keys(self.data._meta))
+        self.data = self.client.persist(data)
+        wait(self.data)
+
+    def generate_week_metrics(self):
+        frame = self.data.groupby(WEEK_KEYS, observed=True).agg(**WEEK_AGGS, split_every=self.split_every).compute()
+        self.csv_df = week_metrics(PartialAggregate(WEEK_KEYS, WEEK_AGGS, frame))
+
+    def generate_month_metrics(self):
+        frame = self.data.groupby(MONTH_KEYS, observed=True).agg(**MONTH_AGGS, split_every=self.split_every).compute()
+        self.regular_df, self.jfk_df, self.other_df = month_metrics(PartialAggregate(MONTH_KEYS, MONTH_AGGS, frame))
+
+    def format_data(self):
+        self.csv_df = self.csv_df.round(2)
+
+    def export_csv_data(self):
+        self.csv_df.to_csv('processed_data_dask.csv', sep='|', index=False)
+
+    def month_sheets(self):
+        return {'jfk': self.jfk_df, 'regular': self.regular_df, 'other': self.other_df}
+
+    def export_excel_data(self):
+        write_excel('processed_data_dask.xlsx', self.month_sheets())
+
+    def export_data(self):
+        export_results('processed_data_dask', self.export_csv_data, self.csv_df, self.month_sheets())
+
+
+if __name__ == '__main__':
+    instrumentation = Instrumentation(verbose=True)
+
+    with instrumentation.measure('init'):
+        yellow_taxi_data = YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31', cache=ParquetCache())
+
+    try:
+        instrumentation.run(yellow_taxi_data)
+    finally:
+        yellow_taxi_data.close()
+    instrumentation.write_json('phase_metrics_dask.json')
+    instrumentation.write_prometheus('phase_metrics_dask.prom', labels={'engine': 'dask'})
+    if yellow_taxi_data.count_rejections:
+        yellow_taxi_data.rejections.to_csv('rejections_dask.csv', sep='|')
+
+    print("Execution time: {t} seconds".format(t=instrumentation.total_seconds))
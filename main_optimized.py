@@ -1,16 +1,43 @@
 import pandas as pd
 import numpy as np
-import time
-from concurrent.futures import ThreadPoolExecutor
-
-REQUIRED_COLUMNS = ['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count',
-                    'trip_distance', 'RatecodeID', 'total_amount']
+import pyarrow as pa
+from aggregates import cube_month_partial, cube_week_partial, daily_cube, labelled_codes, month_metrics, week_metrics
+from checkpoint import CleanCheckpoint, restored_rejections
+from cleaning import clean_selection, drop_duplicate_rows, duplicated_rows
+from exporter import export_results, write_excel
+from instrumentation import Instrumentation
+from load_scheduler import LoadScheduler, estimate_month_bytes
+from parquet_cache import ParquetCache
+from sketches import quantile_columns, week_sketches, write_sketches
+from trip_reader import compact_table, scan_month_checked, to_pandas
 
 
 class YellowTaxiData:
-    def __init__(self, start_date, end_date):
+    def __init__(self, start_date, end_date, cache=None, compact=False, duplicates_cross_files=True, checkpoint=None,
+                 sketches=False, dtype_backend=None, memory_budget=None, max_workers=None, count_rejections=False):
         self.start_date = start_date
         self.end_date = end_date
+        self.cache = cache
+        self.checkpoint = checkpoint
+        self.checkpoint_key = None
+        self.restored = False
+        self.compact = compact
+        self.duplicates_cross_files = duplicates_cross_files
+        # Counting rejections is a diagnostic: it turns off the trip_reader.pushdown_filter scan, so it is opt-in
+        self.count_rejections = count_rejections
+        # 'pyarrow' keeps every column Arrow-backed (pandas ArrowDtype), see trip_reader.to_pandas
+        self.dtype_backend = dtype_backend
+        # Adds p50/p90/p99 columns to csv_df, estimated from quantile sketches (see sketches.py)
+        self.sketches = sketches
+        self.week_sketches = None
+        self.daily_cube = None
+        self.bytes_saved = 0
+        # Columns cast to trip_reader.CANONICAL_SCHEMA while reading, {url: {column: (stored, canonical type)}}
+        self.schema_mismatches = {}
+        # Months are loaded concurrently within memory_budget bytes (default: from the available memory)
+        self.memory_budget = memory_budget
+        self.max_workers = max_workers
+        self.load_stats = {}
         self.dates_list = pd.date_range(self.start_date, self.end_date, freq='MS').strftime("%Y-%m").tolist()
         self.end_date_weeks = pd.date_range(start=self.start_date, end=self.end_date, freq='W-SUN')
         self.urls_list = [
@@ -24,88 +51,122 @@ class YellowTaxiData:
         self.regular_df = pd.DataFrame()
         self.other_df = pd.DataFrame()
         self.csv_df = pd.DataFrame()
+        # Rows dropped by clean_data, per month and rule (see cleaning.RULES)
+        self.rejections = pd.DataFrame()
+
+    def source_path(self, url):
+        return self.cache.fetch(url) if self.cache is not None else url
+
+    def restore_checkpoint(self):
+        """Load the cleaned, key-enriched data of an earlier run; clean_data and add_more_columns then do nothing."""
+        if self.checkpoint is None:
+            return False
+        # Options the cleaned table, and the rejection counts saved with it, depend on
+        options = {'compact': self.compact, 'duplicates_cross_files': self.duplicates_cross_files,
+                   'dtype_backend': self.dtype_backend, 'count_rejections': self.count_rejections}
+        self.checkpoint_key = self.checkpoint.key(self.start_date, self.end_date,
+                                                  [self.source_path(url) for url in self.urls_list], options)
+        table = self.checkpoint.load('optimized', self.start_date, self.end_date, self.checkpoint_key)
+        if table is not None:
+            self.data = to_pandas(table, self.dtype_backend)
+            self.rejections = restored_rejections(table)
+            self.restored = True
+        return self.restored
+
+    def save_checkpoint(self):
+        if self.checkpoint is not None and not self.restored:
+            self.checkpoint.save('optimized', self.start_date, self.end_date, self.checkpoint_key,
+                                 pa.Table.from_pandas(self.data, preserve_index=False),
+                                 self.rejections if self.count_rejections else None)
+
+    def read_month(self, source):
+        """Pushdown scan of one month, compacted and deduplicated if requested.
+
+        Returns the DataFrame, the bytes saved by compacting and the schema mismatches.
+        """
+        table, mismatches = scan_month_checked(source, self.start_date, self.end_date,
+                                               pushdown=not self.count_rejections)
+        bytes_saved = 0
+        if self.compact:
+            table, bytes_saved = compact_table(table)
+        df = to_pandas(table, self.dtype_backend)
+        if not self.duplicates_cross_files:
+            df = drop_duplicate_rows(df)
+        return df, bytes_saved, mismatches
+
+    def prepare_month(self, url):
+        """Fetch a month; returns (estimated bytes of reading it, source), see LoadScheduler.map."""
+        source = self.source_path(url)
+        return estimate_month_bytes(source), source
 
     def import_data(self):
-        def _read(url):
-            return pd.read_parquet(path=url, engine='pyarrow', columns=REQUIRED_COLUMNS)
+        if self.restore_checkpoint():
+            return
 
-        with ThreadPoolExecutor() as pool:
-            dataframes_list = list(pool.map(_read, self.urls_list))
+        scheduler = LoadScheduler(self.memory_budget, self.max_workers)
+        months = scheduler.map(self.read_month, self.urls_list, self.prepare_month)
+        self.load_stats = scheduler.stats()
 
-        self.data = pd.concat(dataframes_list, ignore_index=True)
+        self.bytes_saved = sum(bytes_saved for _, bytes_saved, _ in months)
+        self.schema_mismatches = {
+            url: mismatches for url, (_, _, mismatches) in zip(self.urls_list, months) if mismatches
+        }
+        self.data = pd.concat([df for df, _, _ in months], ignore_index=True)
 
     def clean_data(self):
-        self.data.drop_duplicates(inplace=True)
-        self.data.dropna(subset=['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count'], inplace=True)
-
-        duration = (self.data['tpep_dropoff_datetime'] - self.data['tpep_pickup_datetime']).dt.total_seconds()
-        speed = self.data['trip_distance'] / (duration / 3600)
-
-        mask = (
-            (self.data['tpep_pickup_datetime'] >= self.start_date) &
-            (self.data['tpep_dropoff_datetime'] <= self.end_date) &
-            (duration > 0) &
-            (duration >= 60) &
-            (speed <= 100) &
-            (self.data['trip_distance'] > 0) &
-            (self.data['total_amount'] > 0) &
-            (self.data['total_amount'] <= 5000) &
-            (self.data['passenger_count'] > 0)
-        )
-
-        self.data = self.data.loc[mask].copy()
-        self.data['trip_time_in_seconds'] = (self.data['tpep_dropoff_datetime'] - self.data['tpep_pickup_datetime']).dt.total_seconds()
-        self.data['RatecodeID'] = self.data['RatecodeID'].astype(int)
+        if self.restored:
+            return
+        duplicated = duplicated_rows(self.data) if self.duplicates_cross_files else None
+        self.data, duration, rejections = clean_selection(self.data, self.start_date, self.end_date, duplicated)
+        # Without count_rejections the scan already dropped rows these counts would miss
+        if self.count_rejections:
+            self.rejections = rejections
+        if self.dtype_backend == 'pyarrow':
+            self.data['trip_time_in_seconds'] = pd.array(duration, dtype=pd.ArrowDtype(pa.float64()))
+        else:
+            self.data['trip_time_in_seconds'] = duration
 
     def add_more_columns(self):
+        if self.restored:
+            return
+        # Integer calendar codes, only the distinct values are formatted as labels
         dt = self.data['tpep_dropoff_datetime']
-        self.data['year_month'] = dt.dt.to_period('M')
         iso = dt.dt.isocalendar()
-        year_arr = iso.year.values
-        week_arr = iso.week.values
-        self.data['year_week'] = np.char.add(
-            np.char.add(year_arr.astype('U4'), np.full(len(year_arr), '-', dtype='U1')),
-            np.char.zfill(week_arr.astype('U2'), 2)
-        )
-        self.data['year_month_day'] = dt.dt.date
+        year_month = dt.dt.year.to_numpy(dtype=np.int64) * 100 + dt.dt.month.to_numpy(dtype=np.int64)
+        year_week = iso.year.to_numpy(dtype=np.int64) * 100 + iso.week.to_numpy(dtype=np.int64)
+
+        self.data['year_month'] = labelled_codes(year_month, lambda c: f'{c // 100}-{c % 100:02d}', self.dtype_backend)
+        self.data['year_week'] = labelled_codes(year_week, lambda c: f'{c // 100}-{c % 100:02d}', self.dtype_backend)
+        # Only grouped on by the daily cube, which rebuilds the calendar from the integer day codes
+        self.data['year_month_day'] = (year_month * 100 + dt.dt.day.to_numpy(dtype=np.int64)).astype(np.int32)
+        self.save_checkpoint()
+
+    def build_daily_cube(self):
+        """Group the trips once, by dropoff day and rate category; both reports are rolled up from this cube."""
+        if self.daily_cube is None:
+            conditions = [
+                self.data['RatecodeID'] == 1,
+                self.data['RatecodeID'] == 2,
+            ]
+            categories = pd.Index(['regular', 'jfk', 'other'],
+                                  dtype=pd.ArrowDtype(pa.string()) if self.dtype_backend == 'pyarrow' else None)
+            self.data['rate_category'] = pd.Categorical.from_codes(
+                np.select(conditions, [0, 1], default=2), categories=categories
+            )
+            self.daily_cube = daily_cube(self.data)
+        return self.daily_cube
 
     def generate_week_metrics(self):
-        self.csv_df = self.data.groupby('year_week').agg(
-            min_trip_time=('trip_time_in_seconds', 'min'),
-            max_trip_time=('trip_time_in_seconds', 'max'),
-            mean_trip_time=('trip_time_in_seconds', 'mean'),
-            min_trip_distance=('trip_distance', 'min'),
-            max_trip_distance=('trip_distance', 'max'),
-            mean_trip_distance=('trip_distance', 'mean'),
-            min_trip_amount=('total_amount', 'min'),
-            max_trip_amount=('total_amount', 'max'),
-            mean_trip_amount=('total_amount', 'mean'),
-            total_services=('total_amount', 'count')
-        ).reset_index()
-
-        self.csv_df['percentage_variation'] = (
-            self.csv_df['total_services'] - self.csv_df['total_services'].shift(1)
-        ) / self.csv_df['total_services'].shift(1) * 100
-
-    def generate_month_metrics(self):
-        self.data['day_type'] = np.where(self.data['tpep_dropoff_datetime'].dt.dayofweek >= 5, 2, 1)
+        self.csv_df = week_metrics(cube_week_partial(self.build_daily_cube()))
 
-        conditions = [
-            self.data['RatecodeID'] == 1,
-            self.data['RatecodeID'] == 2,
-        ]
-        choices = ['regular', 'jfk']
-        self.data['rate_category'] = np.select(conditions, choices, default='other')
+        if self.sketches:
+            self.week_sketches = week_sketches(self.data)
+            quantiles = quantile_columns(self.week_sketches)
+            quantiles.index = quantiles.index.astype(str)
+            self.csv_df = self.csv_df.join(quantiles, on='year_week')
 
-        grouped = self.data.groupby(['rate_category', 'year_month', 'day_type']).agg(
-            services=('trip_distance', 'count'),
-            distances=('trip_distance', 'sum'),
-            passengers=('passenger_count', 'sum')
-        ).reset_index()
-
-        self.regular_df = grouped[grouped['rate_category'] == 'regular'].drop(columns='rate_category')
-        self.jfk_df = grouped[grouped['rate_category'] == 'jfk'].drop(columns='rate_category')
-        self.other_df = grouped[grouped['rate_category'] == 'other'].drop(columns='rate_category')
+    def generate_month_metrics(self):
+        self.regular_df, self.jfk_df, self.other_df = month_metrics(cube_month_partial(self.build_daily_cube()))
 
     def format_data(self):
         self.csv_df = self.csv_df.round(2)
@@ -116,59 +177,34 @@ class YellowTaxiData:
     def export_csv_data(self):
         self.csv_df.to_csv('processed_data_optimized.csv', sep='|', index=False)
 
+    def month_sheets(self):
+        return {'jfk': self.jfk_df, 'regular': self.regular_df, 'other': self.other_df}
+
     def export_excel_data(self):
-        common_columns = ['year_month', 'day_type', 'services', 'distances', 'passengers']
-        with pd.ExcelWriter("processed_data_optimized.xlsx", engine="openpyxl") as writer:
-            self.jfk_df[common_columns].to_excel(writer, sheet_name="JFK", index=False)
-            self.regular_df[common_columns].to_excel(writer, sheet_name="Regular", index=False)
-            self.other_df[common_columns].to_excel(writer, sheet_name="Others", index=False)
+        write_excel('processed_data_optimized.xlsx', self.month_sheets())
 
     def export_data(self):
-        self.export_csv_data()
-        self.export_excel_data()
+        export_results('processed_data_optimized', self.export_csv_data, self.csv_df, self.month_sheets())
+        self.daily_cube.frame.reset_index().to_parquet('processed_data_optimized_daily.parquet', index=False)
+        if self.week_sketches is not None:
+            write_sketches('processed_data_optimized_sketches.parquet', self.week_sketches)
 
 
 if __name__ == '__main__':
-    global_start_time = time.perf_counter()
-
-    print('Init objects ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data = YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31')
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Importing data ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.import_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Cleaning data ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.clean_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Adding more columns ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.add_more_columns()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Generating week metrics ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.generate_week_metrics()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Generating month metrics ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.generate_month_metrics()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Formatting results ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.format_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Exporting results ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.export_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print("Execution time: {t} seconds".format(t=time.perf_counter() - global_start_time))
+    instrumentation = Instrumentation(verbose=True)
+
+    with instrumentation.measure('init'):
+        yellow_taxi_data = YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31', cache=ParquetCache(),
+                                          checkpoint=CleanCheckpoint())
+
+    instrumentation.run(yellow_taxi_data)
+    instrumentation.write_json('phase_metrics_optimized.json')
+    instrumentation.write_prometheus('phase_metrics_optimized.prom', labels={'engine': 'optimized'})
+    if yellow_taxi_data.count_rejections:
+        yellow_taxi_data.rejections.to_csv('rejections_optimized.csv', sep='|')
+
+    print("Waited {t} seconds for the memory budget while loading months".format(
+        t=yellow_taxi_data.load_stats['wait_seconds']))
+    for url, mismatches in yellow_taxi_data.schema_mismatches.items():
+        print("Cast {url}: {mismatches}".format(url=url, mismatches=mismatches))
+    print("Execution time: {t} seconds".format(t=instrumentation.total_seconds))
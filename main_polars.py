@@ -1,15 +1,30 @@
 import polars as pl
-import time
-from concurrent.futures import ThreadPoolExecutor
-
-REQUIRED_COLUMNS = ['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count',
-                    'trip_distance', 'RatecodeID', 'total_amount']
+from checkpoint import CleanCheckpoint
+from exporter import export_results, write_excel
+from instrumentation import Instrumentation
+from load_scheduler import LoadScheduler, estimate_month_bytes
+from parquet_cache import ParquetCache
+from trip_reader import compact_table, scan_month_checked
 
 
 class YellowTaxiData:
-    def __init__(self, start_date, end_date):
+    def __init__(self, start_date, end_date, cache=None, compact=False, duplicates_cross_files=True, checkpoint=None,
+                 memory_budget=None, max_workers=None):
         self.start_date = start_date
         self.end_date = end_date
+        self.cache = cache
+        self.checkpoint = checkpoint
+        self.checkpoint_key = None
+        self.restored = False
+        self.compact = compact
+        self.duplicates_cross_files = duplicates_cross_files
+        self.bytes_saved = 0
+        # Columns cast to trip_reader.CANONICAL_SCHEMA while reading, {url: {column: (stored, canonical type)}}
+        self.schema_mismatches = {}
+        # Months are loaded concurrently within memory_budget bytes (default: from the available memory)
+        self.memory_budget = memory_budget
+        self.max_workers = max_workers
+        self.load_stats = {}
         self.dates_list = pl.date_range(
             pl.Series([start_date]).cast(pl.Date).item(),
             pl.Series([end_date]).cast(pl.Date).item(),
@@ -26,24 +41,68 @@ class YellowTaxiData:
         self.other_df = pl.DataFrame()
         self.csv_df = pl.DataFrame()
 
+    def source_path(self, url):
+        return self.cache.fetch(url) if self.cache is not None else url
+
+    def restore_checkpoint(self):
+        """Load the cleaned, key-enriched data of an earlier run; clean_data and add_more_columns then do nothing."""
+        if self.checkpoint is None:
+            return False
+        # Options the cleaned table depends on
+        options = {'compact': self.compact, 'duplicates_cross_files': self.duplicates_cross_files}
+        self.checkpoint_key = self.checkpoint.key(self.start_date, self.end_date,
+                                                  [self.source_path(url) for url in self.urls_list], options)
+        table = self.checkpoint.load('polars', self.start_date, self.end_date, self.checkpoint_key)
+        if table is not None:
+            self.data = pl.from_arrow(table)
+            self.restored = True
+        return self.restored
+
+    def save_checkpoint(self):
+        if self.checkpoint is not None and not self.restored:
+            self.checkpoint.save('polars', self.start_date, self.end_date, self.checkpoint_key, self.data.to_arrow())
+
+    def read_month(self, source):
+        """Pushdown scan of one month, compacted and deduplicated if requested.
+
+        Returns the DataFrame, the bytes saved by compacting and the schema mismatches.
+        """
+        (table, mismatches), bytes_saved = scan_month_checked(source, self.start_date, self.end_date), 0
+        if self.compact:
+            table, bytes_saved = compact_table(table)
+        df = pl.from_arrow(table)
+        if not self.duplicates_cross_files:
+            df = df.unique()
+        return df, bytes_saved, mismatches
+
+    def prepare_month(self, url):
+        """Fetch a month; returns (estimated bytes of reading it, source), see LoadScheduler.map."""
+        source = self.source_path(url)
+        return estimate_month_bytes(source), source
+
     def import_data(self):
-        def _read(url):
-            import pandas as pd
-            df = pd.read_parquet(path=url, engine='pyarrow', columns=REQUIRED_COLUMNS)
-            return pl.from_pandas(df)
+        if self.restore_checkpoint():
+            return
 
-        with ThreadPoolExecutor() as pool:
-            dataframes_list = list(pool.map(_read, self.urls_list))
+        scheduler = LoadScheduler(self.memory_budget, self.max_workers)
+        months = scheduler.map(self.read_month, self.urls_list, self.prepare_month)
+        self.load_stats = scheduler.stats()
 
-        self.data = pl.concat(dataframes_list)
+        self.bytes_saved = sum(bytes_saved for _, bytes_saved, _ in months)
+        self.schema_mismatches = {
+            url: mismatches for url, (_, _, mismatches) in zip(self.urls_list, months) if mismatches
+        }
+        self.data = pl.concat([df for df, _, _ in months])
 
     def clean_data(self):
-        self.data = self.data.unique()
+        if self.restored:
+            return
+        if self.duplicates_cross_files:
+            self.data = self.data.unique()
         self.data = self.data.drop_nulls(subset=['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count'])
 
         self.data = self.data.with_columns(
             ((pl.col('tpep_dropoff_datetime') - pl.col('tpep_pickup_datetime')).dt.total_seconds()).alias('trip_time_in_seconds'),
-            pl.col('RatecodeID').cast(pl.Int32),
         ).filter(
             (pl.col('tpep_pickup_datetime') >= pl.lit(self.start_date).str.to_datetime('%Y-%m-%d')) &
             (pl.col('tpep_dropoff_datetime') <= pl.lit(self.end_date).str.to_datetime('%Y-%m-%d')) &
@@ -56,12 +115,15 @@ class YellowTaxiData:
         )
 
     def add_more_columns(self):
+        if self.restored:
+            return
         self.data = self.data.with_columns(
             pl.col('tpep_dropoff_datetime').dt.strftime('%Y-%m').alias('year_month'),
             (pl.col('tpep_dropoff_datetime').dt.iso_year().cast(pl.Utf8) + '-' +
              pl.col('tpep_dropoff_datetime').dt.week().cast(pl.Utf8).str.pad_start(2, '0')).alias('year_week'),
             pl.col('tpep_dropoff_datetime').dt.date().cast(pl.Utf8).alias('year_month_day'),
         )
+        self.save_checkpoint()
 
     def generate_week_metrics(self):
         self.csv_df = self.data.group_by('year_week').agg(
@@ -109,60 +171,29 @@ class YellowTaxiData:
     def export_csv_data(self):
         self.csv_df.write_csv('processed_data_polars.csv', separator='|')
 
+    def month_sheets(self):
+        return {'jfk': self.jfk_df, 'regular': self.regular_df, 'other': self.other_df}
+
     def export_excel_data(self):
-        import pandas as pd
-        common_columns = ['year_month', 'day_type', 'services', 'distances', 'passengers']
-        with pd.ExcelWriter("processed_data_polars.xlsx", engine="openpyxl") as writer:
-            self.jfk_df.select(common_columns).to_pandas().to_excel(writer, sheet_name="JFK", index=False)
-            self.regular_df.select(common_columns).to_pandas().to_excel(writer, sheet_name="Regular", index=False)
-            self.other_df.select(common_columns).to_pandas().to_excel(writer, sheet_name="Others", index=False)
+        write_excel('processed_data_polars.xlsx', self.month_sheets())
 
     def export_data(self):
-        self.export_csv_data()
-        self.export_excel_data()
+        export_results('processed_data_polars', self.export_csv_data, self.csv_df, self.month_sheets())
 
 
 if __name__ == '__main__':
-    global_start_time = time.perf_counter()
-
-    print('Init objects ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data = YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31')
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Importing data ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.import_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Cleaning data ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.clean_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Adding more columns ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.add_more_columns()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Generating week metrics ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.generate_week_metrics()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Generating month metrics ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.generate_month_metrics()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Formatting results ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.format_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print('Exporting results ...')
-    start_time = time.perf_counter()
-    yellow_taxi_data.export_data()
-    print("*** {t} seconds ***".format(t=time.perf_counter() - start_time))
-
-    print("Execution time: {t} seconds".format(t=time.perf_counter() - global_start_time))
+    instrumentation = Instrumentation(verbose=True)
+
+    with instrumentation.measure('init'):
+        yellow_taxi_data = YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31', cache=ParquetCache(),
+                                          checkpoint=CleanCheckpoint())
+
+    instrumentation.run(yellow_taxi_data)
+    instrumentation.write_json('phase_metrics_polars.json')
+    instrumentation.write_prometheus('phase_metrics_polars.prom', labels={'engine': 'polars'})
+
+    print("Waited {t} seconds for the memory budget while loading months".format(
+        t=yellow_taxi_data.load_stats['wait_seconds']))
+    for url, mismatches in yellow_taxi_data.schema_mismatches.items():
+        print("Cast {url}: {mismatches}".format(url=url, mismatches=mismatches))
+    print("Execution time: {t} seconds".format(t=instrumentation.total_seconds))
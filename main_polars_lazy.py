@@ -0,0 +1,136 @@
+import polars as pl
+from exporter import export_results, write_excel
+from instrumentation import Instrumentation
+from parquet_cache import ParquetCache
+from trip_reader import CANONICAL_SCHEMA, REQUIRED_COLUMNS
+
+# trip_reader.CANONICAL_SCHEMA as polars types
+CANONICAL_TYPES = pl.from_arrow(CANONICAL_SCHEMA.empty_table()).schema
+
+
+class YellowTaxiData:
+    """Polars engine that builds a single LazyFrame plan and runs it with the streaming engine.
+
+    import_data, clean_data, add_more_columns and both metrics phases only extend the plan,
+    collect_data executes it, and nothing is ever converted to pandas.
+    """
+
+    def __init__(self, start_date, end_date, cache=None):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.cache = cache
+        self.dates_list = pl.date_range(
+            pl.Series([start_date]).cast(pl.Date).item(),
+            pl.Series([end_date]).cast(pl.Date).item(),
+            interval='1mo', eager=True
+        ).to_list()
+        self.urls_list = [
+            'https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{y}-{m}.parquet'.format(
+                y=dt.year, m=str(dt.month).zfill(2))
+            for dt in self.dates_list
+        ]
+        self.data = pl.LazyFrame()
+        self.month_df = pl.LazyFrame()
+        self.jfk_df = pl.DataFrame()
+        self.regular_df = pl.DataFrame()
+        self.other_df = pl.DataFrame()
+        self.csv_df = pl.LazyFrame()
+
+    def source_path(self, url):
+        return self.cache.fetch(url) if self.cache is not None else url
+
+    def import_data(self):
+        # Each file is cast to the canonical types within its own scan, whatever types it stores
+        self.data = pl.concat([
+            pl.scan_parquet(self.source_path(url)).select(REQUIRED_COLUMNS).cast(CANONICAL_TYPES)
+            for url in self.urls_list
+        ])
+
+    def clean_data(self):
+        self.data = self.data.unique().drop_nulls(
+            subset=['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count']
+        ).with_columns(
+            ((pl.col('tpep_dropoff_datetime') - pl.col('tpep_pickup_datetime')).dt.total_seconds()).alias('trip_time_in_seconds'),
+        ).filter(
+            (pl.col('tpep_pickup_datetime') >= pl.lit(self.start_date).str.to_datetime('%Y-%m-%d')) &
+            (pl.col('tpep_dropoff_datetime') <= pl.lit(self.end_date).str.to_datetime('%Y-%m-%d')) &
+            (pl.col('trip_time_in_seconds') >= 60) &
+            ((pl.col('trip_distance') / (pl.col('trip_time_in_seconds') / 3600)) <= 100) &
+            (pl.col('trip_distance') > 0) &
+            (pl.col('total_amount') > 0) &
+            (pl.col('total_amount') <= 5000) &
+            (pl.col('passenger_count') > 0)
+        )
+
+    def add_more_columns(self):
+        self.data = self.data.with_columns(
+            pl.col('tpep_dropoff_datetime').dt.strftime('%Y-%m').alias('year_month'),
+            (pl.col('tpep_dropoff_datetime').dt.iso_year().cast(pl.Utf8) + '-' +
+             pl.col('tpep_dropoff_datetime').dt.week().cast(pl.Utf8).str.pad_start(2, '0')).alias('year_week'),
+        )
+
+    def generate_week_metrics(self):
+        self.csv_df = self.data.group_by('year_week').agg(
+            pl.col('trip_time_in_seconds').min().alias('min_trip_time'),
+            pl.col('trip_time_in_seconds').max().alias('max_trip_time'),
+            pl.col('trip_time_in_seconds').mean().alias('mean_trip_time'),
+            pl.col('trip_distance').min().alias('min_trip_distance'),
+            pl.col('trip_distance').max().alias('max_trip_distance'),
+            pl.col('trip_distance').mean().alias('mean_trip_distance'),
+            pl.col('total_amount').min().alias('min_trip_amount'),
+            pl.col('total_amount').max().alias('max_trip_amount'),
+            pl.col('total_amount').mean().alias('mean_trip_amount'),
+            pl.col('total_amount').count().alias('total_services'),
+        ).sort('year_week').with_columns(
+            ((pl.col('total_services').cast(pl.Float64) - pl.col('total_services').shift(1).cast(pl.Float64)) /
+             pl.col('total_services').shift(1).cast(pl.Float64) * 100).alias('percentage_variation')
+        )
+
+    def generate_month_metrics(self):
+        self.month_df = self.data.with_columns(
+            pl.when(pl.col('tpep_dropoff_datetime').dt.weekday() >= 6)
+            .then(pl.lit(2)).otherwise(pl.lit(1)).alias('day_type'),
+            pl.when(pl.col('RatecodeID') == 1).then(pl.lit('regular'))
+            .when(pl.col('RatecodeID') == 2).then(pl.lit('jfk'))
+            .otherwise(pl.lit('other')).alias('rate_category'),
+        ).group_by(['rate_category', 'year_month', 'day_type']).agg(
+            pl.col('trip_distance').count().alias('services'),
+            pl.col('trip_distance').sum().alias('distances'),
+            pl.col('passenger_count').sum().alias('passengers'),
+        ).sort(['rate_category', 'year_month', 'day_type'])
+
+    def collect_data(self):
+        self.csv_df, grouped = pl.collect_all([self.csv_df, self.month_df], streaming=True)
+
+        self.regular_df = grouped.filter(pl.col('rate_category') == 'regular').drop('rate_category')
+        self.jfk_df = grouped.filter(pl.col('rate_category') == 'jfk').drop('rate_category')
+        self.other_df = grouped.filter(pl.col('rate_category') == 'other').drop('rate_category')
+
+    def format_data(self):
+        numeric_cols = [c for c in self.csv_df.columns if self.csv_df[c].dtype in (pl.Float64, pl.Float32)]
+        self.csv_df = self.csv_df.with_columns([pl.col(c).round(2) for c in numeric_cols])
+
+    def export_csv_data(self):
+        self.csv_df.write_csv('processed_data_polars_lazy.csv', separator='|')
+
+    def month_sheets(self):
+        return {'jfk': self.jfk_df, 'regular': self.regular_df, 'other': self.other_df}
+
+    def export_excel_data(self):
+        write_excel('processed_data_polars_lazy.xlsx', self.month_sheets())
+
+    def export_data(self):
+        export_results('processed_data_polars_lazy', self.export_csv_data, self.csv_df, self.month_sheets())
+
+
+if __name__ == '__main__':
+    instrumentation = Instrumentation(verbose=True)
+
+    with instrumentation.measure('init'):
+        yellow_taxi_data = YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31', cache=ParquetCache())
+
+    instrumentation.run(yellow_taxi_data)
+    instrumentation.write_json('phase_metrics_polars_lazy.json')
+    instrumentation.write_prometheus('phase_metrics_polars_lazy.prom', labels={'engine': 'polars_lazy'})
+
+    print("Execution time: {t} seconds".format(t=instrumentation.total_seconds))
@@ -0,0 +1,369 @@
+import numpy as np
+import os
+import pandas as pd
+import pyarrow as pa
+from aggregate_store import AggregateStore, source_fingerprint
+from aggregates import (MONTH_AGGS, MONTH_KEYS, WEEK_AGGS, WEEK_KEYS, WINDOW_KEYS, PartialAggregate, derive_keys,
+                        format_year_week, month_metrics, month_partial, week_metrics, week_partial)
+from cleaning import SeenRows, clean_selection, merge_rejections
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from download import prefetch, read_url
+from exporter import export_results, write_excel
+from instrumentation import Instrumentation
+from parquet_cache import ParquetCache
+from sketches import (merge_sketches, quantile_columns, rollup_sketches, sketches_from_ipc, sketches_to_ipc,
+                      week_sketches, write_sketches)
+from trip_reader import CANONICAL_SCHEMA, open_fragment, pushdown_filter, scan_fragment
+from urllib.parse import urlparse
+
+DEFAULT_BATCH_SIZE = 1_000_000
+# Row positions of scan_row_groups: row group << POSITION_BITS | offset of the row in the scan of its row group
+POSITION_BITS = 32
+OFFSET_MASK = (1 << POSITION_BITS) - 1
+
+
+# CANONICAL_SCHEMA with RatecodeID as float64, as a batch with null RatecodeIDs converts to pandas, so that
+# every batch has the same dtypes and equal rows of different batches the same fingerprint (see cleaning.SeenRows)
+BATCH_SCHEMA = CANONICAL_SCHEMA.set(CANONICAL_SCHEMA.get_field_index('RatecodeID'),
+                                    pa.field('RatecodeID', pa.float64()))
+
+
+def scan_row_groups(fragment, row_groups, scan_filter, batch_size=DEFAULT_BATCH_SIZE):
+    """(position of the first row, batch) of every batch of ``fragment``, scanned one row group at a time.
+
+    A position is the row group << POSITION_BITS plus the offset of the row in the scan of
+    that row group, so it does not depend on which row groups are scanned together.
+    """
+    for row_group in row_groups:
+        scanner = scan_fragment(fragment.subset(row_group_ids=[row_group]), filter=scan_filter, schema=BATCH_SCHEMA,
+                                batch_size=batch_size)
+        offset = 0
+        for batch in scanner.to_batches():
+            yield (row_group << POSITION_BITS) + offset, batch
+            offset += batch.num_rows
+
+
+def read_rows(fragment, positions, scan_filter):
+    """The rows at the sorted scan_row_groups ``positions``, only reading the row groups they are in."""
+    row_groups = positions >> POSITION_BITS
+    tables = [
+        scan_fragment(fragment.subset(row_group_ids=[int(row_group)]), filter=scan_filter,
+                      schema=BATCH_SCHEMA).to_table().take(positions[row_groups == row_group] & OFFSET_MASK)
+        for row_group in np.unique(row_groups)
+    ]
+    return pa.concat_tables(tables).to_pandas()
+
+
+def scan_partials(source, start_date, end_date, batch_size=DEFAULT_BATCH_SIZE, row_groups=None, sketches=False,
+                  count_rejections=False, seen=None):
+    """Windowed (week, month) partials, number of rows read, rejection counts and week sketches for one monthly file.
+
+    ``row_groups`` restricts the scan to those row groups of the file. The sketches are
+    None unless ``sketches`` is set. Unless ``count_rejections`` is set the rules of
+    trip_reader.pushdown_filter are pushed into the scan and the rows they drop are not
+    counted. ``seen`` is the cleaning.SeenRows duplicates are removed with (a new one by
+    default), e.g. to get the fingerprints of the rows scanned.
+    """
+    fragment = open_fragment(source)
+    if row_groups is None:
+        row_groups = range(fragment.num_row_groups)
+
+    week, month = week_partial(windowed=True), month_partial(windowed=True)
+    sketch = week_sketches(windowed=True) if sketches else None
+    rows_read, rejections = 0, pd.DataFrame()
+    scan_filter = None if count_rejections else pushdown_filter(start_date, end_date)
+
+    def fold(batch, duplicated=None):
+        nonlocal rejections, sketch
+        batch, _, batch_rejections = clean_selection(batch, start_date, end_date, duplicated)
+        rejections = merge_rejections(rejections, batch_rejections)
+        batch = derive_keys(batch)
+        week.update(batch)
+        month.update(batch)
+        if sketch is not None:
+            sketch = merge_sketches(sketch, week_sketches(batch, windowed=True))
+
+    seen = SeenRows() if seen is None else seen
+    for position, batch in scan_row_groups(fragment, row_groups, scan_filter, batch_size):
+        batch = batch.to_pandas()
+        rows_read += len(batch)
+        # Rows whose fingerprint was already seen are set aside until they are compared by value
+        candidates = seen.add(batch, position + np.arange(len(batch)))
+        fold(batch[~candidates])
+    if seen.candidates:
+        fold(*seen.resolve(lambda positions: read_rows(fragment, positions, scan_filter)))
+    return week, month, rows_read, rejections, sketch
+
+
+def scan_shard(source, start_date, end_date, batch_size, row_groups, sketches, count_rejections, fingerprints):
+    """scan_partials of a shard of a month, plus the fingerprints of its distinct rows if ``fingerprints`` is set."""
+    seen = SeenRows()
+    partials = scan_partials(source, start_date, end_date, batch_size, row_groups, sketches, count_rejections, seen)
+    return (*partials, seen.fingerprints() if fingerprints else None)
+
+
+def shard_duplicates(source, fingerprints, scan_filter):
+    """Rows of a month equal to a row of an earlier shard, given the fingerprints of each shard in row group order.
+
+    Every shard is already deduplicated, so only the rows whose fingerprint is found in
+    several shards are read again and compared by value.
+    """
+    hashes = np.concatenate([hashes for hashes, _ in fingerprints])
+    positions = np.concatenate([positions for _, positions in fingerprints])
+    shards = np.repeat(np.arange(len(fingerprints)), [len(hashes) for hashes, _ in fingerprints])
+    order = np.lexsort((shards, hashes))
+    hashes_sorted, shards_sorted = hashes[order], shards[order]
+    # One fingerprint per (fingerprint, shard) pair, then those left more than once
+    pairs = np.ones(len(order), dtype=bool)
+    pairs[1:] = (hashes_sorted[1:] != hashes_sorted[:-1]) | (shards_sorted[1:] != shards_sorted[:-1])
+    pair_hashes = hashes_sorted[pairs]
+    shared = pair_hashes[1:][pair_hashes[1:] == pair_hashes[:-1]]
+    if not len(shared):
+        return None
+    rows = read_rows(open_fragment(source), np.sort(positions[np.isin(hashes, shared)]), scan_filter)
+    return rows[rows.duplicated().to_numpy()]
+
+
+def _scan_partials_task(args):
+    # Runs in a worker process: only the small partials (and fingerprints) go back, as Arrow IPC bytes.
+    week, month, rows_read, rejections, sketch, fingerprints = scan_shard(*args)
+    return week.to_ipc(), month.to_ipc(), rows_read, rejections, sketch and sketches_to_ipc(sketch), fingerprints
+
+
+class YellowTaxiData:
+    """Bounded-memory engine: months are read batch by batch and folded into mergeable partials.
+
+    Peak memory depends on ``batch_size`` (and the parquet row group size), not on the
+    number of months. Duplicated rows are removed within each monthly file, keeping a
+    64-bit fingerprint per distinct row (see cleaning.SeenRows): only the rows whose
+    fingerprint repeats are compared by value, after re-reading the row groups of their
+    first occurrence if those are no longer in memory.
+
+    With an AggregateStore, each month's partials are persisted and only new or changed
+    months are read again; the date window is applied when rolling the partials up.
+
+    With ``workers`` > 1 the months are mapped onto a process pool and the parent only
+    reduces their partials. ``shard_by='row_group'`` splits every month into one task per
+    row group for more parallelism; the tasks also return the fingerprints of their rows,
+    and the rows found in several row groups of a month are removed from its merged
+    partials (see shard_duplicates). Months downloaded to memory are sent as a single task.
+
+    With ``sketches`` set, weekly quantile sketches are built, merged and stored like the
+    partials and csv_df gets p50/p90/p99 columns of trip time, distance and amount.
+
+    With ``prefetch`` > 0 downloads are pipelined with processing: import_data fetches
+    nothing and process_batches scans each month as soon as it arrives while up to
+    ``prefetch`` following months download in the background, so at most that many
+    downloaded files wait in memory or on disk.
+    """
+
+    def __init__(self, start_date, end_date, cache=None, batch_size=DEFAULT_BATCH_SIZE, store=None,
+                 workers=1, shard_by='month', prefetch=0, sketches=False, count_rejections=False):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.cache = cache
+        self.batch_size = batch_size
+        self.store = store
+        self.workers = workers
+        self.shard_by = shard_by
+        self.prefetch = prefetch
+        self.sketches = sketches
+        # Counting rejections is a diagnostic: it turns off the trip_reader.pushdown_filter scan, so it is opt-in
+        self.count_rejections = count_rejections
+        self.dates_list = pd.date_range(self.start_date, self.end_date, freq='MS').strftime("%Y-%m").tolist()
+        self.urls_list = [
+            'https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{dt}.parquet'.format(dt=dt)
+            for dt in self.dates_list
+        ]
+        self.sources = []
+        self.rows_read = 0
+        self.months_processed = []
+        # Rows dropped while scanning, per month and rule (see cleaning.RULES); stored months are not rescanned
+        self.rejections = pd.DataFrame()
+        self.week_partial = week_partial()
+        self.month_partial = month_partial()
+        self.week_sketches = week_sketches() if sketches else None
+        self.jfk_df = pd.DataFrame()
+        self.regular_df = pd.DataFrame()
+        self.other_df = pd.DataFrame()
+        self.csv_df = pd.DataFrame()
+
+    def source_path(self, url):
+        return self.cache.fetch(url) if self.cache is not None else url
+
+    def fetch_source(self, url):
+        """Like source_path, but without a cache remote files are downloaded to memory up front."""
+        if self.cache is None and urlparse(url).scheme in ('http', 'https'):
+            return pa.py_buffer(read_url(url))
+        return self.source_path(url)
+
+    def import_data(self):
+        if not self.prefetch:
+            self.sources = [self.source_path(url) for url in self.urls_list]
+
+    def fetched_sources(self):
+        """(dt, url, source) of every month, fetched ahead in the background when pipelined."""
+        if not self.prefetch:
+            return zip(self.dates_list, self.urls_list, self.sources)
+        return ((dt, url, source) for (dt, url), source in
+                prefetch(zip(self.dates_list, self.urls_list), lambda month: self.fetch_source(month[1]),
+                         depth=self.prefetch))
+
+    def shards(self, source):
+        # An in-memory download is pickled with every task, so it is sent to a worker once, as a single task
+        if self.shard_by == 'row_group' and not isinstance(source, pa.Buffer):
+            return [[i] for i in range(open_fragment(source).num_row_groups)]
+        return [None]
+
+    def remove_shard_duplicates(self, source, fingerprints, week, month, sketch, start_date, end_date):
+        """Take the rows of a month found in several of its shards out of its merged partials.
+
+        Each such row was counted in its shard as if it was not a duplicate: it is
+        subtracted from the partials it was kept in and its rejection moves to 'duplicate'.
+        """
+        scan_filter = None if self.count_rejections else pushdown_filter(start_date, end_date)
+        duplicates = shard_duplicates(source, fingerprints, scan_filter)
+        if duplicates is None or not len(duplicates):
+            return week, month, sketch
+        kept, _, counted = clean_selection(duplicates, start_date, end_date)
+        if self.count_rejections:
+            _, _, as_duplicates = clean_selection(duplicates, start_date, end_date,
+                                                  np.ones(len(duplicates), dtype=bool))
+            self.rejections = merge_rejections(self.rejections, as_duplicates.sub(counted, fill_value=0))
+        if not len(kept):
+            return week, month, sketch
+        kept = derive_keys(kept)
+        week = week.subtract(week_partial(kept, windowed=True))
+        month = month.subtract(month_partial(kept, windowed=True))
+        if sketch is not None:
+            kept_sketch = week_sketches(kept, windowed=True)
+            sketch = {stat: partial.subtract(kept_sketch[stat]) for stat, partial in sketch.items()}
+        return week, month, sketch
+
+    def map_partials(self, pending):
+        """Yield (dt, week, month, sketches) windowed partials for each pending (dt, source).
+
+        ``pending`` is consumed lazily: each month is scanned, or submitted to the pool,
+        as soon as it is produced, which lets a pipelined download overlap the scans. At
+        most ``workers + prefetch`` tasks are in flight, so the pool does not pull
+        ``pending`` (and the downloads behind it) further ahead than that.
+        """
+        # Stored partials must not depend on the date window, see AggregateStore
+        start_date, end_date = (None, None) if self.store is not None else (self.start_date, self.end_date)
+        pool = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        try:
+            results, in_flight, sharded = [], set(), {}
+            for dt, source in pending:
+                shards = self.shards(source)
+                if len(shards) > 1:
+                    sharded[dt] = (source, [])
+                for row_groups in shards:
+                    args = (source, start_date, end_date, self.batch_size, row_groups, self.sketches,
+                            self.count_rejections, len(shards) > 1)
+                    if pool is None:
+                        results.append((dt, scan_shard(*args)))
+                        continue
+                    if len(in_flight) >= self.workers + self.prefetch:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            # Fail fast instead of after submitting every remaining month
+                            future.result()
+                    future = pool.submit(_scan_partials_task, args)
+                    in_flight.add(future)
+                    results.append((dt, future))
+
+            by_month = {}
+            for dt, result in results:
+                if pool:
+                    week_data, month_data, rows_read, rejections, sketch_data, fingerprints = result.result()
+                    result = (PartialAggregate.from_ipc(WINDOW_KEYS + WEEK_KEYS, WEEK_AGGS, week_data),
+                              PartialAggregate.from_ipc(WINDOW_KEYS + MONTH_KEYS, MONTH_AGGS, month_data), rows_read,
+                              rejections, sketch_data and sketches_from_ipc(sketch_data, windowed=True), fingerprints)
+                week, month, rows_read, rejections, sketch, fingerprints = result
+                self.rows_read += rows_read
+                if self.count_rejections:
+                    self.rejections = merge_rejections(self.rejections, rejections)
+                if fingerprints is not None:
+                    sharded[dt][1].append(fingerprints)
+                if dt in by_month:
+                    previous_week, previous_month, previous_sketch = by_month[dt]
+                    week, month = previous_week.merge(week), previous_month.merge(month)
+                    sketch = sketch and merge_sketches(previous_sketch, sketch)
+                by_month[dt] = (week, month, sketch)
+        finally:
+            if pool:
+                pool.shutdown()
+        for dt, (source, fingerprints) in sharded.items():
+            by_month[dt] = self.remove_shard_duplicates(source, fingerprints, *by_month[dt], start_date, end_date)
+        for dt, (week, month, sketch) in by_month.items():
+            yield dt, week, month, sketch
+
+    def process_batches(self):
+        partials, fingerprints = [], {}
+
+        def pending():
+            for dt, url, source in self.fetched_sources():
+                if self.store is not None:
+                    # In-memory downloads are fingerprinted through their URL
+                    fingerprints[dt] = source_fingerprint(url if isinstance(source, pa.Buffer) else source)
+                    stored = self.store.load(dt, fingerprints[dt], sketches=self.sketches)
+                    if stored is not None:
+                        partials.append(stored)
+                        continue
+                yield dt, source
+
+        for dt, week, month, sketch in self.map_partials(pending()):
+            if self.store is not None:
+                self.store.save(dt, fingerprints[dt], week, month, sketch)
+            self.months_processed.append(dt)
+            partials.append((week, month, sketch))
+
+        for week, month, sketch in partials:
+            self.week_partial = self.week_partial.merge(week.rollup(WEEK_KEYS, self.start_date, self.end_date))
+            self.month_partial = self.month_partial.merge(month.rollup(MONTH_KEYS, self.start_date, self.end_date))
+            if sketch is not None:
+                self.week_sketches = merge_sketches(self.week_sketches,
+                                                    rollup_sketches(sketch, self.start_date, self.end_date))
+
+    def generate_week_metrics(self):
+        self.csv_df = week_metrics(self.week_partial)
+        if self.week_sketches is not None:
+            quantiles = quantile_columns(self.week_sketches)
+            quantiles.index = format_year_week(quantiles.index)
+            self.csv_df = self.csv_df.join(quantiles, on='year_week')
+
+    def generate_month_metrics(self):
+        self.regular_df, self.jfk_df, self.other_df = month_metrics(self.month_partial)
+
+    def format_data(self):
+        self.csv_df = self.csv_df.round(2)
+
+    def export_csv_data(self):
+        self.csv_df.to_csv('processed_data_streaming.csv', sep='|', index=False)
+
+    def month_sheets(self):
+        return {'jfk': self.jfk_df, 'regular': self.regular_df, 'other': self.other_df}
+
+    def export_excel_data(self):
+        write_excel('processed_data_streaming.xlsx', self.month_sheets())
+
+    def export_data(self):
+        export_results('processed_data_streaming', self.export_csv_data, self.csv_df, self.month_sheets())
+        if self.week_sketches is not None:
+            write_sketches('processed_data_streaming_sketches.parquet', self.week_sketches)
+
+
+if __name__ == '__main__':
+    instrumentation = Instrumentation(verbose=True)
+
+    with instrumentation.measure('init'):
+        yellow_taxi_data = YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31', cache=ParquetCache(),
+                                          store=AggregateStore(), workers=os.cpu_count(), prefetch=2)
+
+    instrumentation.run(yellow_taxi_data)
+    instrumentation.write_json('phase_metrics_streaming.json')
+    instrumentation.write_prometheus('phase_metrics_streaming.prom', labels={'engine': 'streaming'})
+    if yellow_taxi_data.count_rejections:
+        yellow_taxi_data.rejections.to_csv('rejections_streaming.csv', sep='|')
+
+    print("Execution time: {t} seconds".format(t=instrumentation.total_seconds))
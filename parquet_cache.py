@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import urllib.request
+from collections import Counter
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+from download import BACKOFF, RETRIES, TIMEOUT, with_retries
+
+CHUNK_SIZE = 1 << 20
+
+
+class CacheMissError(LookupError):
+    pass
+
+
+class ParquetCache:
+    """Content-addressed disk cache for the monthly trip parquet files.
+
+    Entries are keyed by URL and point to a blob named after the sha256 of its content,
+    together with the validator (ETag / Last-Modified, or size and mtime for local
+    mirrors) seen when it was stored. Cached URLs are served without any network I/O
+    unless ``revalidate`` is set, in which case a conditional request is made. HTTP
+    downloads time out after ``timeout`` seconds without progress and are retried
+    ``retries`` times on transient errors, see download.is_transient. With ``max_bytes``
+    the least recently used entries are evicted, except those a fetch in progress returns.
+    """
+
+    def __init__(self, cache_dir='.trip_cache', max_bytes=None, offline=False, base_url=None, revalidate=False,
+                 retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.base_url = base_url
+        self.revalidate = revalidate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self._lock = threading.Lock()
+        # Digests of the blobs that fetches in progress are returning, which _evict keeps
+        self._pinned = Counter()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self):
+        tmp_path = f'{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.objects_dir, f'{digest}.parquet')
+
+    def source_for(self, url):
+        """Map a trip data URL onto the configured mirror, if any."""
+        if self.base_url is None:
+            return url
+        return self.base_url.rstrip('/') + '/' + url.rsplit('/', 1)[-1]
+
+    def total_bytes(self):
+        return sum({e['sha256']: e['size'] for e in self.index.values()}.values())
+
+    def __contains__(self, url):
+        entry = self.index.get(url)
+        return entry is not None and os.path.exists(self._blob_path(entry['sha256']))
+
+    def fetch(self, url):
+        """Return a local path holding the content of ``url``."""
+        pinned = []
+        with self._lock:
+            entry = self.index.get(url) if url in self else None
+            if entry is not None and (self.offline or not self.revalidate):
+                return self._touch(url)
+            if entry is not None:
+                # Kept while it is revalidated, as it is returned if it is still current
+                pinned.append(self._pin(entry['sha256']))
+        if self.offline:
+            raise CacheMissError(f'{url} is not cached and the cache is offline')
+
+        source = self.source_for(url)
+        validator = entry['validator'] if entry is not None else None
+        tmp_path = os.path.join(self.cache_dir, f'download.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            new_validator = with_retries(self._download, source, tmp_path, validator,
+                                         retries=self.retries, backoff=self.backoff)
+            digest = self._hash_file(tmp_path) if new_validator is not None else None
+            with self._lock:
+                if new_validator is None:
+                    return self._touch(url)
+                if not os.path.exists(self._blob_path(digest)):
+                    os.replace(tmp_path, self._blob_path(digest))
+                self.index[url] = {
+                    'sha256': digest,
+                    'size': os.path.getsize(self._blob_path(digest)),
+                    'validator': new_validator,
+                    'last_access': time.time(),
+                }
+                self._evict(keep=url)
+                self._save_index()
+                return self._blob_path(digest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self._pinned.subtract(pinned)
+
+    def _pin(self, digest):
+        # Callers hold self._lock
+        self._pinned[digest] += 1
+        return digest
+
+    def _touch(self, url):
+        # Callers hold self._lock, so the entry cannot be evicted in between
+        self.index[url]['last_access'] = time.time()
+        self._save_index()
+        return self._blob_path(self.index[url]['sha256'])
+
+    def _download(self, source, dest, validator):
+        """Copy ``source`` into ``dest``; return its validator, or None if ``validator`` is still current."""
+        parsed = urlparse(source)
+        if parsed.scheme in ('http', 'https'):
+            request = urllib.request.Request(source)
+            if validator:
+                if validator.get('etag'):
+                    request.add_header('If-None-Match', validator['etag'])
+                if validator.get('last_modified'):
+                    request.add_header('If-Modified-Since', validator['last_modified'])
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response, open(dest, 'wb') as f:
+                    shutil.copyfileobj(response, f, CHUNK_SIZE)
+                    return {'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified')}
+            except HTTPError as e:
+                if e.code == 304:
+                    return None
+                raise
+
+        path = url2pathname(parsed.path) if parsed.scheme == 'file' else source
+        stat = os.stat(path)
+        new_validator = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        if validator == new_validator:
+            return None
+        shutil.copyfile(path, dest)
+        return new_validator
+
+    @staticmethod
+    def _hash_file(path):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        by_age = sorted((e['last_access'], url) for url, e in self.index.items()
+                        if url != keep and not self._pinned[e['sha256']])
+        while self.total_bytes() > self.max_bytes and by_age:
+            _, url = by_age.pop(0)
+            digest = self.index.pop(url)['sha256']
+            if all(e['sha256'] != digest for e in self.index.values()):
+                os.remove(self._blob_path(digest))
@@ -0,0 +1,199 @@
+"""Resident report service: week and month metrics for any date range from warm aggregates.
+
+    python report_service.py --port 8050
+    curl 'http://127.0.0.1:8050/report?start_date=2022-01-01&end_date=2022-03-31'
+    curl 'http://127.0.0.1:8050/stats'
+
+The windowed partials of every month (see main_streaming.scan_partials) are kept in
+memory in an LRU of ``--max-months`` entries. A range only loads the months that are
+not cached yet, from the AggregateStore or by scanning their file, and is answered by
+rolling up the cached partials onto the requested window. ReportService is also usable
+in-process.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pyarrow as pa
+
+from aggregate_store import AggregateStore, source_fingerprint
+from aggregates import (
+    MONTH_KEYS,
+    WEEK_KEYS,
+    month_metrics,
+    month_partial,
+    week_metrics,
+    week_partial,
+    window_bound,
+)
+from main_streaming import DEFAULT_BATCH_SIZE, scan_partials
+from parquet_cache import ParquetCache
+
+URL_TEMPLATE = 'https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{dt}.parquet'
+MAX_MONTHS = 36
+REPORT_TABLES = ['csv_df', 'regular_df', 'jfk_df', 'other_df']
+
+
+class ReportService:
+    """Week and month metrics for arbitrary date ranges, from an LRU of per-month windowed partials.
+
+    Concurrent requests needing the same uncached month wait for a single load of it.
+    """
+
+    def __init__(self, cache=None, store=None, max_months=MAX_MONTHS, url_template=URL_TEMPLATE,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        self.cache = cache
+        self.store = store
+        self.max_months = max_months
+        self.url_template = url_template
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._partials = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def months(start_date, end_date):
+        """Months ('YYYY-MM') overlapping the range, including a partially covered first month."""
+        return pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq='M').strftime('%Y-%m').tolist()
+
+    def load_month(self, month):
+        """Windowed (week, month) partials of ``month``, from the store or by scanning its file."""
+        url = self.url_template.format(dt=month)
+        source = self.cache.fetch(url) if self.cache is not None else url
+        if self.store is not None:
+            fingerprint = source_fingerprint(source)
+            stored = self.store.load(month, fingerprint)
+            if stored is not None:
+                return stored[:2]
+        week, month_part, _, _, _ = scan_partials(source, None, None, self.batch_size)
+        if self.store is not None:
+            self.store.save(month, fingerprint, week, month_part)
+        return week, month_part
+
+    def partials(self, month):
+        with self._lock:
+            if month in self._partials:
+                self.hits += 1
+                self._partials.move_to_end(month)
+                return self._partials[month]
+            self.misses += 1
+            loading = self._loading.setdefault(month, threading.Lock())
+
+        with loading:
+            with self._lock:
+                if month in self._partials:
+                    return self._partials[month]
+            partials = self.load_month(month)
+            with self._lock:
+                self._partials[month] = partials
+                while len(self._partials) > self.max_months:
+                    self._partials.popitem(last=False)
+                self._loading.pop(month, None)
+        return partials
+
+    def report(self, start_date, end_date):
+        """{csv_df, regular_df, jfk_df, other_df} of the range, formatted like the engines' outputs.
+
+        The bounds must be midnights (see aggregates.window_bound), otherwise ValueError is raised.
+        """
+        window_bound(start_date)
+        window_bound(end_date)
+        week, month = week_partial(), month_partial()
+        for dt in self.months(start_date, end_date):
+            week_part, month_part = self.partials(dt)
+            week = week.merge(week_part.rollup(WEEK_KEYS, start_date, end_date))
+            month = month.merge(month_part.rollup(MONTH_KEYS, start_date, end_date))
+
+        regular_df, jfk_df, other_df = month_metrics(month)
+        return {'csv_df': week_metrics(week).round(2), 'regular_df': regular_df, 'jfk_df': jfk_df, 'other_df': other_df}
+
+    def stats(self):
+        with self._lock:
+            return {'cached_months': list(self._partials), 'max_months': self.max_months,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self.send_json(200, self.server.service.stats())
+        if url.path != '/report':
+            return self.send_json(404, {'error': f'unknown path {url.path}'})
+
+        params = parse_qs(url.query)
+        try:
+            start_date, end_date = params['start_date'][0], params['end_date'][0]
+            if window_bound(start_date) > window_bound(end_date):
+                raise ValueError('start_date is after end_date')
+        except (KeyError, ValueError) as e:
+            return self.send_json(400, {'error': f'start_date and end_date must be a valid date range: {e}'})
+
+        started = time.perf_counter()
+        try:
+            report = self.server.service.report(start_date, end_date)
+        except (OSError, LookupError, pa.ArrowException) as e:
+            # Months that cannot be fetched (network, offline cache miss) or read
+            return self.send_json(502, {'error': f'{type(e).__name__}: {e}'})
+        except Exception as e:  # noqa: BLE001 - the client gets a 500 instead of a dropped connection
+            # Anything else is a bug in the engine code, logged with its traceback
+            self.log_error('%s failed:\n%s', self.path, traceback.format_exc())
+            return self.send_json(500, {'error': f'{type(e).__name__}: {e}'})
+        body = {name: json.loads(report[name].to_json(orient='records')) for name in REPORT_TABLES}
+        body['seconds'] = time.perf_counter() - started
+        self.send_json(200, body)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(service, host='127.0.0.1', port=8050, verbose=False):
+    server = ThreadingHTTPServer((host, port), ReportHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--max-months', type=int, default=MAX_MONTHS, help='months of partials kept in memory')
+    parser.add_argument('--base-url', default=None, help='local directory or HTTP mirror of the trip files')
+    parser.add_argument('--offline', action='store_true', help='only serve months already in the local cache')
+    parser.add_argument('--no-store', action='store_true', help='do not persist partials in .aggregate_store/')
+    args = parser.parse_args(argv)
+
+    service = ReportService(cache=ParquetCache(base_url=args.base_url, offline=args.offline),
+                            store=None if args.no_store else AggregateStore(), max_months=args.max_months)
+    server = make_server(service, args.host, args.port, verbose=True)
+    print(f'Serving reports on http://{args.host}:{server.server_address[1]}/report?start_date=...&end_date=...')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Mergeable approximate-quantile sketches for the week metrics.
+
+Values are counted in logarithmic buckets, as in DDSketch: bucket i holds the values in
+(gamma ** (i - 1), gamma ** i] with gamma = (1 + a) / (1 - a), and is estimated as
+2 * gamma ** i / (gamma + 1), which is within a relative error a of every value in it.
+The counts per (group keys, bucket) are a PartialAggregate, so sketches are built per
+batch, month or worker, merged, rolled up over the date window and serialized exactly
+like the other partials, and any quantile keeps the error bound whatever the row count.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from aggregates import WEEK_KEYS, WINDOW_KEYS, PartialAggregate
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+QUANTILES = (0.5, 0.9, 0.99)
+# Statistic of the week metrics -> column it is computed on
+SKETCH_COLUMNS = {'trip_time': 'trip_time_in_seconds', 'trip_distance': 'trip_distance', 'trip_amount': 'total_amount'}
+# Bucket of zero and negative values, which are estimated as 0
+ZERO_BUCKET = np.iinfo(np.int32).min
+
+
+def bucket_index(values):
+    values = np.asarray(values, dtype=float)
+    positive = values > 0
+    buckets = np.full(len(values), ZERO_BUCKET, dtype=np.int32)
+    buckets[positive] = np.ceil(np.log(values[positive]) / np.log(GAMMA))
+    return buckets
+
+
+def bucket_value(buckets):
+    buckets = np.asarray(buckets)
+    return np.where(buckets == ZERO_BUCKET, 0.0, 2 * GAMMA ** buckets.astype(float) / (GAMMA + 1))
+
+
+def sketch_partial(df, column, keys=WEEK_KEYS):
+    """Sketch of ``column`` per ``keys``: a PartialAggregate counting rows per (keys, bucket)."""
+    aggs = {'count': (column, 'count')}
+    if df is None:
+        return PartialAggregate(keys + ['bucket'], aggs)
+    buckets = df[keys + [column]].assign(bucket=bucket_index(df[column].to_numpy()))
+    return PartialAggregate.from_frame(buckets, keys + ['bucket'], aggs)
+
+
+def week_sketches(df=None, windowed=False):
+    """{statistic: sketch} for every SKETCH_COLUMNS statistic, per year_week (and WINDOW_KEYS if windowed)."""
+    keys = WINDOW_KEYS + WEEK_KEYS if windowed else WEEK_KEYS
+    return {stat: sketch_partial(df, column, keys) for stat, column in SKETCH_COLUMNS.items()}
+
+
+def merge_sketches(left, right):
+    return {stat: left[stat].merge(right[stat]) for stat in left}
+
+
+def rollup_sketches(sketches, start_date=None, end_date=None):
+    """Windowed sketches rolled up onto year_week, keeping only the date window."""
+    return {stat: sketch.rollup(WEEK_KEYS + ['bucket'], start_date, end_date) for stat, sketch in sketches.items()}
+
+
+def sketch_quantiles(sketch, quantiles=QUANTILES):
+    """Estimated ``quantiles`` per group of ``sketch``: a frame indexed by its keys, one column per quantile.
+
+    The estimate of quantile q is the value of rank floor(q * (n - 1)) in the sorted group,
+    up to RELATIVE_ACCURACY.
+    """
+    frame = sketch.frame.sort_index()
+    if frame.empty:
+        return pd.DataFrame(columns=list(quantiles), index=frame.index.droplevel('bucket'), dtype=float)
+    counts = frame['count'].to_numpy(dtype=np.int64)
+    cumulative = counts.cumsum()
+    groups = frame.index.droplevel('bucket')
+    starts = np.flatnonzero(~groups.duplicated())
+    totals = np.add.reduceat(counts, starts)
+    offsets = cumulative[starts] - counts[starts]
+
+    buckets = frame.index.get_level_values('bucket').to_numpy()
+    result = pd.DataFrame(index=groups[starts])
+    for q in quantiles:
+        ranks = offsets + np.floor(q * (totals - 1)).astype(np.int64)
+        result[q] = bucket_value(buckets[np.searchsorted(cumulative, ranks, side='right')])
+    return result
+
+
+def quantile_columns(sketches, quantiles=QUANTILES):
+    """Week metrics columns p50_trip_time, p90_trip_time, ... per year_week, from week sketches."""
+    columns = {}
+    for stat, sketch in sketches.items():
+        for q, values in sketch_quantiles(sketch, quantiles).items():
+            columns[f'p{q * 100:g}_{stat}'] = values
+    return pd.DataFrame(columns)
+
+
+def sketches_to_ipc(sketches):
+    return {stat: sketch.to_ipc() for stat, sketch in sketches.items()}
+
+
+def sketches_from_ipc(data, windowed=False):
+    return {stat: PartialAggregate.from_ipc(empty.keys, empty.aggs, data[stat])
+            for stat, empty in week_sketches(windowed=windowed).items()}
+
+
+def sketches_table(sketches):
+    """All sketches as one Arrow table with a statistic column, e.g. to store them next to the week metrics."""
+    tables = []
+    for stat, sketch in sketches.items():
+        table = pa.Table.from_pandas(sketch.frame.reset_index(), preserve_index=False)
+        tables.append(table.add_column(0, 'statistic', pa.array([stat] * len(table), pa.string())))
+    return pa.concat_tables(tables, promote_options='permissive')
+
+
+def write_sketches(path, sketches):
+    pq.write_table(sketches_table(sketches), path)
+
+
+def read_sketches(path, windowed=False):
+    frame = pq.read_table(path).to_pandas()
+    sketches = week_sketches(windowed=windowed)
+    for stat, sketch in sketches.items():
+        rows = frame[frame['statistic'] == stat].drop(columns='statistic')
+        if len(rows):
+            sketch.frame = rows.set_index(sketch.keys)
+    return sketches
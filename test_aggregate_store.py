@@ -0,0 +1,42 @@
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+import main_streaming
+from aggregate_store import AggregateStore
+from conftest import make_trips
+
+
+def run(paths, start_date, end_date, store=None):
+    taxi_data = main_streaming.YellowTaxiData(start_date=start_date, end_date=end_date, store=store)
+    taxi_data.urls_list = [str(paths[dt]) for dt in taxi_data.dates_list]
+    for phase in ['import_data', 'process_batches', 'generate_week_metrics', 'generate_month_metrics']:
+        getattr(taxi_data, phase)()
+    return taxi_data
+
+
+def test_extending_range_only_processes_new_month(tmp_path, trip_files):
+    paths = trip_files(['2022-01', '2022-02', '2022-03'])
+    store = AggregateStore(tmp_path / 'store')
+
+    assert run(paths, '2022-01-01', '2022-02-28', store).months_processed == ['2022-01', '2022-02']
+    incremental = run(paths, '2022-01-01', '2022-03-31', AggregateStore(tmp_path / 'store'))
+    full = run(paths, '2022-01-01', '2022-03-31')
+
+    assert incremental.months_processed == ['2022-03']
+    pd.testing.assert_frame_equal(incremental.csv_df, full.csv_df)
+    for name in ['jfk_df', 'regular_df', 'other_df']:
+        pd.testing.assert_frame_equal(getattr(incremental, name), getattr(full, name))
+
+
+def test_changed_month_is_processed_again(tmp_path, trip_files):
+    paths = trip_files(['2022-01', '2022-02'])
+    run(paths, '2022-01-01', '2022-02-28', AggregateStore(tmp_path / 'store'))
+
+    pq.write_table(make_trips('2022-02', 1500, seed=42), paths['2022-02'])
+    os.utime(paths['2022-02'], ns=(2 * 10**18, 2 * 10**18))
+    rerun = run(paths, '2022-01-01', '2022-02-28', AggregateStore(tmp_path / 'store'))
+
+    assert rerun.months_processed == ['2022-02']
+    pd.testing.assert_frame_equal(rerun.csv_df, run(paths, '2022-01-01', '2022-02-28').csv_df)
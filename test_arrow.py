@@ -0,0 +1,68 @@
+import pandas as pd
+import pyarrow as pa
+
+import main_arrow
+import main_optimized
+from cleaning import clean_selection, duplicated_rows
+
+PHASES = ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics', 'generate_month_metrics',
+          'format_data']
+
+
+def run(module, paths):
+    taxi_data = module.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28')
+    taxi_data.urls_list = [str(p) for p in paths]
+    for phase in PHASES:
+        getattr(taxi_data, phase)()
+    return taxi_data
+
+
+def test_arrow_matches_optimized(trip_files):
+    paths = list(trip_files(['2022-01', '2022-02']).values())
+    expected = run(main_optimized, paths)
+    arrow = run(main_arrow, paths)
+
+    assert isinstance(arrow.csv_df, pa.Table)
+    expected_csv_df = expected.csv_df.assign(year_week=lambda df: df['year_week'].astype(str))
+    pd.testing.assert_frame_equal(arrow.csv_df.to_pandas(), expected_csv_df, check_dtype=False)
+    for name in ['jfk_df', 'regular_df', 'other_df']:
+        expected_df = getattr(expected, name).assign(year_month=lambda df: df['year_month'].astype(str))
+        pd.testing.assert_frame_equal(getattr(arrow, name).to_pandas(), expected_df, check_dtype=False)
+
+
+def test_arrow_csv_export(tmp_path, monkeypatch, trip_files):
+    arrow = run(main_arrow, trip_files(['2022-01']).values())
+    monkeypatch.chdir(tmp_path)
+    arrow.export_csv_data()
+
+    exported = pd.read_csv('processed_data_arrow.csv', sep='|')
+    assert exported.columns.tolist() == arrow.csv_df.column_names
+    assert exported['total_services'].tolist() == arrow.csv_df['total_services'].to_pylist()
+
+
+def test_arrow_clean_data_nulls_like_pandas():
+    pickup = pd.Timestamp('2022-01-10 10:00')
+    rows = [
+        # Exact duplicates
+        (pickup, 1.0, 1), (pickup, 1.0, 1),
+        # Duplicates whose RatecodeID is null: one is kept, as with DataFrame.duplicated
+        (pickup + pd.Timedelta(hours=1), 1.0, None), (pickup + pd.Timedelta(hours=1), 1.0, None),
+        # A null in a NOT_NULL column breaks the rule
+        (pickup + pd.Timedelta(hours=2), None, 1),
+    ]
+    table = pa.table({
+        'tpep_pickup_datetime': pa.array([row[0] for row in rows], pa.timestamp('us')),
+        'tpep_dropoff_datetime': pa.array([row[0] + pd.Timedelta(minutes=10) for row in rows], pa.timestamp('us')),
+        'passenger_count': pa.array([row[1] for row in rows], pa.float64()),
+        'trip_distance': pa.array([2.0] * len(rows)),
+        'RatecodeID': pa.array([row[2] for row in rows], pa.int64()),
+        'total_amount': pa.array([10.0] * len(rows)),
+    })
+    arrow = main_arrow.YellowTaxiData(start_date='2022-01-01', end_date='2022-01-31')
+    arrow.data = table
+    arrow.clean_data()
+
+    df = table.to_pandas()
+    expected, _, _ = clean_selection(df, '2022-01-01', '2022-01-31', duplicated_rows(df))
+    assert arrow.data.num_rows == len(expected) == 2
+    assert sorted(arrow.data['RatecodeID'].to_pylist(), key=str) == [1, None]
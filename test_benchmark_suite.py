@@ -0,0 +1,35 @@
+import json
+
+import benchmark_suite
+import instrumentation
+
+
+def test_run_suite_reports_every_phase(trip_files):
+    paths = trip_files(['2022-01', '2022-02'])
+    data_dir = next(iter(paths.values())).parent
+
+    results = benchmark_suite.run_suite(data_dir, engines=['PyArrow', 'Streaming (Pandas)'], repeat=2, warmup=1,
+                                        start_date='2022-01-01', end_date='2022-02-28')
+
+    assert results['meta']['rows'] == sum(2000 + 40 for _ in paths)
+    assert list(results['engines']['PyArrow']) == instrumentation.PHASES + ['total']
+    assert 'process_batches' in results['engines']['Streaming (Pandas)']
+    total = results['engines']['PyArrow']['total']
+    assert len(total['samples']) == 2
+    assert total['median'] <= total['p95']
+    assert total['rows_per_second'] > 0 and total['peak_rss_mb'] > 0
+    json.dumps(results)
+
+
+def test_compare_flags_regressions(tmp_path):
+    def results(median, rss):
+        return {'engines': {'PyArrow': {'total': {'median': median, 'peak_rss_mb': rss}}}}
+
+    assert benchmark_suite.compare_results(results(1.0, 100), results(1.05, 100), threshold=0.10) == []
+    regressions = benchmark_suite.compare_results(results(1.0, 100), results(1.5, 100), threshold=0.10)
+    assert [(r['phase'], r['metric']) for r in regressions] == [('total', 'median')]
+
+    for name, data in [('base.json', results(1.0, 100)), ('new.json', results(1.0, 150))]:
+        (tmp_path / name).write_text(json.dumps(data))
+    assert benchmark_suite.main(['compare', str(tmp_path / 'base.json'), str(tmp_path / 'new.json')]) == 1
+    assert benchmark_suite.main(['compare', str(tmp_path / 'base.json'), str(tmp_path / 'base.json')]) == 0
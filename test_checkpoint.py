@@ -0,0 +1,91 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import cleaning
+import main
+import main_arrow
+import main_optimized
+from checkpoint import CleanCheckpoint
+
+PHASES = ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics', 'generate_month_metrics',
+          'format_data']
+
+
+def run(module, paths, checkpoint, **kwargs):
+    taxi_data = module.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28', checkpoint=checkpoint, **kwargs)
+    taxi_data.urls_list = [str(p) for p in paths]
+    for phase in PHASES:
+        getattr(taxi_data, phase)()
+    return taxi_data
+
+
+def test_rerun_restores_cleaned_data(tmp_path, trip_files):
+    paths = list(trip_files(['2022-01', '2022-02']).values())
+    checkpoint = CleanCheckpoint(tmp_path / 'checkpoint')
+
+    first = run(main_optimized, paths, checkpoint)
+    second = run(main_optimized, paths, checkpoint)
+
+    assert not first.restored and second.restored
+    pd.testing.assert_frame_equal(second.csv_df, first.csv_df)
+    for name in ['jfk_df', 'regular_df', 'other_df']:
+        pd.testing.assert_frame_equal(getattr(second, name), getattr(first, name))
+
+
+def test_arrow_checkpoint_is_memory_mapped(tmp_path, trip_files):
+    paths = list(trip_files(['2022-01']).values())
+    checkpoint = CleanCheckpoint(tmp_path / 'checkpoint')
+    taxi_data = run(main_arrow, paths, checkpoint)
+
+    allocated = pa.total_allocated_bytes()
+    table = checkpoint.load('arrow', '2022-01-01', '2022-02-28', taxi_data.checkpoint_key)
+    # Buffers point into the mapped file, nothing the size of the table is allocated
+    assert pa.total_allocated_bytes() - allocated < table.nbytes // 100
+    assert table.equals(taxi_data.data)
+
+
+def test_stale_checkpoint_is_invalidated(tmp_path, monkeypatch, trip_files):
+    paths = list(trip_files(['2022-01', '2022-02']).values())
+    checkpoint = CleanCheckpoint(tmp_path / 'checkpoint')
+    run(main_optimized, paths, checkpoint)
+
+    stat = os.stat(paths[0])
+    os.utime(paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert not run(main_optimized, paths, checkpoint).restored
+    assert run(main_optimized, paths, checkpoint).restored
+
+    monkeypatch.setattr(cleaning, 'RULES_VERSION', cleaning.RULES_VERSION + 1)
+    monkeypatch.setattr('checkpoint.RULES_VERSION', cleaning.RULES_VERSION)
+    assert not run(main_optimized, paths, checkpoint).restored
+    assert len(os.listdir(tmp_path / 'checkpoint')) == 1
+
+
+def test_checkpoint_of_other_options_is_not_restored(tmp_path, trip_files):
+    paths = list(trip_files(['2022-01', '2022-02']).values())
+    checkpoint = CleanCheckpoint(tmp_path / 'checkpoint')
+    expected = run(main_optimized, paths, None)
+
+    for options in [{'duplicates_cross_files': False}, {'compact': True}, {'dtype_backend': 'pyarrow'}]:
+        assert not run(main_optimized, paths, checkpoint, **options).restored
+        taxi_data = run(main_optimized, paths, checkpoint)
+        assert not taxi_data.restored
+        pd.testing.assert_frame_equal(taxi_data.csv_df, expected.csv_df)
+    assert run(main_optimized, paths, checkpoint).restored
+
+
+@pytest.mark.parametrize('module', [main, main_optimized])
+def test_rerun_restores_rejections(tmp_path, trip_files, module):
+    paths = list(trip_files(['2022-01', '2022-02']).values())
+    checkpoint = CleanCheckpoint(tmp_path / 'checkpoint')
+
+    first = run(module, paths, checkpoint, count_rejections=True)
+    second = run(module, paths, checkpoint, count_rejections=True)
+
+    assert second.restored and first.rejections.to_numpy().sum() > 0
+    pd.testing.assert_frame_equal(second.rejections, first.rejections)
+    # A checkpoint saved without the counts is not restored when they are requested
+    assert not run(module, paths, checkpoint, count_rejections=False).restored
+    assert not run(module, paths, checkpoint, count_rejections=True).restored
@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import cleaning
+import main
+import main_optimized
+import main_streaming
+from conftest import make_trips
+from trip_reader import REQUIRED_COLUMNS, to_pandas
+
+
+def test_duplicated_rows_matches_pandas():
+    df = make_trips('2022-01', 3000).to_pandas()
+    assert (cleaning.duplicated_rows(df) == df.duplicated().to_numpy()).all()
+
+
+def test_duplicated_rows_resolves_collisions(monkeypatch):
+    df = pd.DataFrame({'a': [1, 2, 1, 3], 'b': [1.0, 2.0, 1.0, 3.0]})
+    monkeypatch.setattr(pd.util, 'hash_pandas_object', lambda df, index: pd.Series(np.zeros(len(df), dtype=np.uint64)))
+
+    assert cleaning.duplicated_rows(df).tolist() == [False, False, True, False]
+
+
+def seen_across_batches(df, size):
+    seen, candidates = cleaning.SeenRows(), []
+    for start in range(0, len(df), size):
+        positions = np.arange(start, min(start + size, len(df)))
+        candidates.extend(positions[seen.add(df[start:start + size], positions)])
+    flags = np.zeros(len(df), dtype=bool)
+    if candidates:
+        rows, duplicated = seen.resolve(lambda positions: df.iloc[positions])
+        assert len(rows) == len(candidates)
+        flags[candidates] = duplicated
+    return flags.tolist()
+
+
+def test_seen_rows_matches_pandas_across_batches():
+    df = make_trips('2022-01', 3000).to_pandas()
+    assert seen_across_batches(df, 700) == df.duplicated().tolist()
+
+
+def test_seen_rows_resolves_collisions(monkeypatch):
+    df = pd.DataFrame({'a': [1, 2, 1, 3, 2, 4], 'b': [1.0, 2.0, 1.0, 3.0, 2.0, np.nan]})
+    monkeypatch.setattr(pd.util, 'hash_pandas_object', lambda df, index: pd.Series(np.zeros(len(df), dtype=np.uint64)))
+
+    assert seen_across_batches(df, 2) == [False, False, True, False, True, False]
+
+
+def test_month_scoped_deduplication(trip_files):
+    paths = [str(p) for p in trip_files(['2022-01', '2022-02']).values()]
+    results = []
+    for duplicates_cross_files in [True, False]:
+        taxi_data = main_optimized.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28',
+                                                  duplicates_cross_files=duplicates_cross_files)
+        taxi_data.urls_list = paths
+        taxi_data.import_data()
+        taxi_data.clean_data()
+        results.append(taxi_data.data)
+
+    pd.testing.assert_frame_equal(results[0].reset_index(drop=True), results[1].reset_index(drop=True))
+
+
+def sequential_clean(df, start_date, end_date):
+    df = df[~df.duplicated()].dropna(subset=cleaning.NOT_NULL_COLUMNS)
+    duration = (df['tpep_dropoff_datetime'] - df['tpep_pickup_datetime']).dt.total_seconds()
+    df = df[(df['tpep_pickup_datetime'] >= start_date) & (df['tpep_dropoff_datetime'] <= end_date)]
+    duration = duration[df.index]
+    df = df[(duration > 0) & (duration >= 60) & (df['trip_distance'] / (duration / 3600) <= 100)]
+    df = df[df['trip_distance'] > 0]
+    df = df[(df['total_amount'] > 0) & (df['total_amount'] <= 5000)]
+    return df[df['passenger_count'] > 0]
+
+
+def test_clean_selection_matches_sequential_filters():
+    df = make_trips('2022-01', 5000).to_pandas()
+    clean, duration, rejections = cleaning.clean_selection(df, '2022-01-01', '2022-01-31',
+                                                           cleaning.duplicated_rows(df))
+
+    # The nulls of the float RatecodeID are all in rejected rows, so the kept ones are cast back to integers
+    expected = sequential_clean(df, '2022-01-01', '2022-01-31').astype({'RatecodeID': np.int64})
+    pd.testing.assert_frame_equal(clean, expected)
+    expected_duration = (clean['tpep_dropoff_datetime'] - clean['tpep_pickup_datetime']).dt.total_seconds()
+    assert (duration == expected_duration.to_numpy()).all()
+    assert list(rejections.columns) == cleaning.RULES
+    assert rejections.to_numpy().sum() == len(df) - len(clean)
+    assert rejections['duplicate'].sum() == df.duplicated().sum()
+    assert (rejections[['outside_window', 'short_trip', 'speeding', 'zero_passengers']].sum() > 0).all()
+
+
+def test_clean_selection_keeps_null_ratecode_as_read():
+    df = make_trips('2022-01', 1000).to_pandas()
+    kept_row = cleaning.clean_selection(df, None, None)[0].index[0]
+    df.loc[kept_row, 'RatecodeID'] = np.nan
+
+    clean, _, _ = cleaning.clean_selection(df, None, None)
+    assert clean['RatecodeID'].dtype == np.float64
+    assert clean['RatecodeID'].isna().sum() == 1
+
+
+def test_arrow_backed_frame_has_same_rejections():
+    table = make_trips('2022-01', 5000)
+    df, arrow_df = table.to_pandas(), to_pandas(table, 'pyarrow')
+    reasons, duration = cleaning.rejection_reasons(df, '2022-01-01', '2022-01-31', cleaning.duplicated_rows(df))
+    arrow_reasons, arrow_duration = cleaning.rejection_reasons(arrow_df, '2022-01-01', '2022-01-31',
+                                                               cleaning.duplicated_rows(arrow_df))
+
+    assert (arrow_reasons == reasons).all()
+    np.testing.assert_array_equal(arrow_duration, duration)
+    pd.testing.assert_frame_equal(cleaning.rejection_counts(arrow_df['tpep_dropoff_datetime'], arrow_reasons),
+                                  cleaning.rejection_counts(df['tpep_dropoff_datetime'], reasons))
+
+
+def test_rejections_counted_once_per_row():
+    start = pd.Timestamp('2022-01-10 10:00')
+    df = pd.DataFrame({
+        'tpep_pickup_datetime': [start] * 4 + [pd.Timestamp('2022-02-10')],
+        'tpep_dropoff_datetime': [start + pd.Timedelta(seconds=s) for s in [600, 30, -5, 600]]
+                                 + [pd.Timestamp('2022-02-10 00:10')],
+        'passenger_count': [1.0, 1.0, 1.0, np.nan, 0.0],
+        'trip_distance': [1.0, 0.0, 0.0, 1.0, 1.0],
+        'total_amount': [10.0, 10.0, 0.0, 10.0, 10.0],
+    })
+    reasons, _ = cleaning.rejection_reasons(df, None, None)
+    rejections = cleaning.rejection_counts(df['tpep_dropoff_datetime'], reasons)
+
+    assert [cleaning.RULES[r - 1] if r else None for r in reasons] == [
+        None, 'short_trip', 'non_positive_duration', 'missing_value', 'zero_passengers']
+    assert rejections.index.tolist() == ['2022-01', '2022-02']
+    assert rejections.loc['2022-02'].sum() == 1 and rejections.loc['2022-01'].sum() == 3
+
+
+def test_engines_report_same_rejections(trip_files):
+    paths = [str(p) for p in trip_files(['2022-01', '2022-02']).values()]
+    optimized = main_optimized.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28', count_rejections=True)
+    streaming = main_streaming.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28', batch_size=300,
+                                              count_rejections=True)
+    optimized.urls_list = streaming.urls_list = paths
+    optimized.import_data()
+    optimized.clean_data()
+    streaming.import_data()
+    streaming.process_batches()
+
+    pd.testing.assert_frame_equal(streaming.rejections, optimized.rejections)
+    assert optimized.rejections.to_numpy().sum() > 0
+
+
+@pytest.mark.parametrize('module', [main, main_optimized, main_streaming])
+def test_rejections_include_rows_the_pushdown_drops(trip_files, module):
+    paths = [str(p) for p in trip_files(['2022-01', '2022-02']).values()]
+    df = pd.concat([pq.read_table(path, columns=REQUIRED_COLUMNS).to_pandas() for path in paths], ignore_index=True)
+    _, _, expected = cleaning.clean_selection(df, '2022-01-01', '2022-02-28', cleaning.duplicated_rows(df))
+    # Rules that trip_reader.pushdown_filter would apply in the scan
+    assert (expected[['missing_value', 'zero_distance', 'invalid_amount', 'zero_passengers']].sum() > 0).all()
+
+    for count_rejections in [True, False]:
+        taxi_data = module.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28',
+                                          count_rejections=count_rejections)
+        taxi_data.urls_list = paths
+        taxi_data.import_data()
+        if module is main_streaming:
+            taxi_data.process_batches()
+        else:
+            taxi_data.clean_data()
+        if count_rejections:
+            pd.testing.assert_frame_equal(taxi_data.rejections, expected)
+        else:
+            assert taxi_data.rejections.empty
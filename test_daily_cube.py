@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+import main_optimized
+from aggregates import (
+    CUBE_KEYS,
+    cube_calendar,
+    cube_month_partial,
+    cube_week_partial,
+    daily_cube,
+    derive_keys,
+)
+
+
+def run(paths, tmp_path, monkeypatch):
+    taxi_data = main_optimized.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28')
+    taxi_data.urls_list = [str(p) for p in paths]
+    for phase in ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics', 'generate_month_metrics',
+                  'format_data']:
+        getattr(taxi_data, phase)()
+    (tmp_path / 'out').mkdir()
+    monkeypatch.chdir(tmp_path / 'out')
+    taxi_data.export_data()
+    return taxi_data
+
+
+def test_reports_match_trip_groupbys(tmp_path, monkeypatch, trip_files):
+    taxi_data = run(trip_files(['2022-01', '2022-02']).values(), tmp_path, monkeypatch)
+    data = taxi_data.data
+
+    by_week = data.groupby('year_week', observed=True).agg(
+        min_trip_time=('trip_time_in_seconds', 'min'),
+        mean_trip_time=('trip_time_in_seconds', 'mean'),
+        max_trip_amount=('total_amount', 'max'),
+        total_services=('total_amount', 'count'),
+    ).reset_index().round(2)
+    pd.testing.assert_frame_equal(taxi_data.csv_df[by_week.columns], by_week.astype({'year_week': str}))
+
+    jfk = data[data['RatecodeID'] == 2]
+    jfk = jfk.assign(day_type=np.where(jfk['tpep_dropoff_datetime'].dt.dayofweek >= 5, 2, 1))
+    by_month = jfk.groupby(['year_month', 'day_type'], observed=True).agg(
+        services=('trip_distance', 'count'),
+        distances=('trip_distance', 'sum'),
+        passengers=('passenger_count', 'sum'),
+    ).reset_index()
+    pd.testing.assert_frame_equal(taxi_data.jfk_df, by_month.astype({'year_month': str}), check_dtype=False)
+
+
+def test_saved_cube_serves_new_granularities(tmp_path, monkeypatch, trip_files):
+    taxi_data = run(trip_files(['2022-01', '2022-02']).values(), tmp_path, monkeypatch)
+
+    cube = pd.read_parquet('processed_data_optimized_daily.parquet')
+    assert len(cube) == len(taxi_data.daily_cube.frame) <= 59 * 3
+    per_day = cube.groupby('year_month_day', observed=True)['total_services'].sum()
+    expected = taxi_data.data.groupby('year_month_day', observed=True).size()
+    assert per_day.to_dict() == expected.to_dict()
+    passengers = taxi_data.data.groupby(CUBE_KEYS, observed=True)['passenger_count'].agg(['min', 'max'])
+    np.testing.assert_array_equal(taxi_data.daily_cube.frame[['min_passengers', 'max_passengers']], passengers)
+
+    rebuilt = daily_cube(taxi_data.data)
+    pd.testing.assert_frame_equal(cube_week_partial(rebuilt).frame, cube_week_partial(taxi_data.daily_cube).frame)
+    pd.testing.assert_frame_equal(cube_month_partial(rebuilt).frame, cube_month_partial(taxi_data.daily_cube).frame)
+    assert list(cube.columns[:2]) == CUBE_KEYS
+
+
+def test_calendar_is_rebuilt_from_day_codes(tmp_path, monkeypatch, trip_files):
+    taxi_data = run(trip_files(['2022-01', '2022-02']).values(), tmp_path, monkeypatch)
+
+    calendar = cube_calendar(taxi_data.daily_cube).set_index(CUBE_KEYS)
+    trips = derive_keys(taxi_data.data).drop_duplicates(CUBE_KEYS).set_index(CUBE_KEYS)
+    for key in ['year_week', 'year_month', 'day_type']:
+        assert calendar[key].to_dict() == trips.loc[calendar.index, key].to_dict()
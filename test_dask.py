@@ -0,0 +1,56 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from distributed import Client
+
+import main_dask
+import main_optimized
+from conftest import make_trips
+
+PHASES = ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics', 'generate_month_metrics',
+          'format_data']
+
+
+@pytest.fixture(scope='module')
+def client():
+    with Client(processes=False, dashboard_address=None) as client:
+        yield client
+
+
+def run(module, paths, **kwargs):
+    taxi_data = module.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28', count_rejections=True, **kwargs)
+    taxi_data.urls_list = [str(p) for p in paths]
+    for phase in PHASES:
+        getattr(taxi_data, phase)()
+    return taxi_data
+
+
+def assert_same_results(actual, expected):
+    pd.testing.assert_frame_equal(actual.csv_df, expected.csv_df)
+    for name in ['jfk_df', 'regular_df', 'other_df']:
+        pd.testing.assert_frame_equal(getattr(actual, name), getattr(expected, name))
+    pd.testing.assert_frame_equal(actual.rejections, expected.rejections)
+
+
+def test_dask_matches_optimized(client, trip_files):
+    paths = list(trip_files(['2022-01', '2022-02']).values())
+    dask_data = run(main_dask, paths, client=client, split_every=2)
+
+    assert dask_data.data.npartitions == 2
+    assert_same_results(dask_data, run(main_optimized, paths))
+
+
+def test_dask_removes_duplicates_across_files(tmp_path, client):
+    january, february = make_trips('2022-01', 2000), make_trips('2022-02', 2000, seed=1)
+    # February trips that were also published in the January file
+    copied = february.slice(0, 200)
+    paths = [tmp_path / 'yellow_tripdata_2022-01.parquet', tmp_path / 'yellow_tripdata_2022-02.parquet']
+    pq.write_table(pa.concat_tables([january, copied]), paths[0])
+    pq.write_table(february, paths[1])
+
+    dask_data = run(main_dask, paths, client=client)
+    assert_same_results(dask_data, run(main_optimized, paths))
+
+    per_file = run(main_dask, paths, client=client, duplicates_cross_files=False)
+    assert per_file.csv_df['total_services'].sum() > dask_data.csv_df['total_services'].sum()
@@ -0,0 +1,73 @@
+import threading
+import time
+from urllib.error import HTTPError
+
+import pytest
+
+from download import is_transient, prefetch, read_url, with_retries
+
+
+def test_prefetch_keeps_order_and_bounds_queue():
+    lock, fetched, consumed, ahead = threading.Lock(), [], [], []
+
+    def fetch(item):
+        time.sleep(0.01 * (5 - item))
+        with lock:
+            fetched.append(item)
+        return item * 10
+
+    for item, result in prefetch(range(6), fetch, depth=2):
+        consumed.append(item)
+        time.sleep(0.02)
+        with lock:
+            # Fetched but not yet handed to the consumer
+            ahead.append(len(fetched) - len(consumed))
+        assert result == item * 10
+
+    assert consumed == list(range(6))
+    assert max(ahead) <= 2
+
+
+def test_prefetch_overlaps_fetch_and_consume():
+    def fetch(item):
+        time.sleep(0.1)
+        return item
+
+    start = time.perf_counter()
+    for _ in prefetch(range(6), fetch, depth=2):
+        time.sleep(0.1)
+    # Serially this takes 1.2s; pipelined, about max(fetch, consume) per item plus one fetch
+    assert time.perf_counter() - start < 1.0
+
+
+def test_prefetch_stops_early():
+    fetched = []
+    for item, _ in prefetch(range(100), fetched.append, depth=3):
+        if item == 1:
+            break
+    assert len(fetched) <= 5
+
+
+def test_retries_transient_errors_only():
+    calls = []
+
+    def flaky(code):
+        calls.append(code)
+        if len(calls) < 3:
+            raise HTTPError('url', code, 'error', {}, None)
+        return 'ok'
+
+    assert with_retries(flaky, 503, backoff=0) == 'ok' and len(calls) == 3
+    calls.clear()
+    with pytest.raises(HTTPError):
+        with_retries(flaky, 404, backoff=0)
+    assert len(calls) == 1
+    assert is_transient(ConnectionResetError()) and not is_transient(ValueError())
+
+
+def test_read_url_retries_server_errors(tmp_path, flaky_server):
+    (tmp_path / 'month.parquet').write_bytes(b'data')
+    assert read_url(f'{flaky_server.url}/month.parquet', backoff=0) == b'data'
+    assert flaky_server.requests == ['/month.parquet'] * 2
+    with pytest.raises(HTTPError):
+        read_url(f'{flaky_server.url}/missing.parquet', backoff=0)
@@ -0,0 +1,68 @@
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+from pyarrow import feather
+
+import main_polars
+from exporter import SHEET_COLUMNS, export_results, to_arrow, write_excel
+
+
+def month_frame(n):
+    return pd.DataFrame({
+        'year_month': pd.Categorical(['2022-01'] * n),
+        'day_type': [1, 2] * (n // 2),
+        'services': range(n),
+        'distances': [1.5] * n,
+        'passengers': [2.0] * n,
+    })
+
+
+def test_to_arrow_accepts_every_engine_frame():
+    df = month_frame(4)
+    expected = pa.Table.from_pandas(df.astype({'year_month': str}), preserve_index=False)
+
+    assert to_arrow(df).equals(expected)
+    assert to_arrow(pl.from_pandas(df)).cast(expected.schema).equals(expected)
+    assert to_arrow(expected).equals(expected)
+
+
+def test_write_excel_sheets(tmp_path):
+    sheets = {'jfk': month_frame(2), 'regular': pl.from_pandas(month_frame(6)), 'other': to_arrow(month_frame(0))}
+    write_excel(tmp_path / 'out.xlsx', sheets)
+
+    workbook = load_workbook(tmp_path / 'out.xlsx')
+    assert workbook.sheetnames == ['JFK', 'Regular', 'Others']
+    rows = list(workbook['Regular'].values)
+    assert rows[0] == tuple(SHEET_COLUMNS)
+    assert rows[1:] == list(month_frame(6).itertuples(index=False, name=None))
+    assert list(workbook['Others'].values) == [tuple(SHEET_COLUMNS)]
+
+
+def test_export_results_writes_every_format(tmp_path, monkeypatch, trip_files):
+    taxi_data = main_polars.YellowTaxiData(start_date='2022-01-01', end_date='2022-01-31')
+    taxi_data.urls_list = [str(p) for p in trip_files(['2022-01']).values()]
+    for phase in ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics', 'generate_month_metrics',
+                  'format_data']:
+        getattr(taxi_data, phase)()
+    (tmp_path / 'out').mkdir()
+    monkeypatch.chdir(tmp_path / 'out')
+    taxi_data.export_data()
+
+    assert sorted(p.name for p in (tmp_path / 'out').iterdir()) == [
+        'processed_data_polars.arrow', 'processed_data_polars.csv', 'processed_data_polars.parquet',
+        'processed_data_polars.xlsx', 'processed_data_polars_months.arrow', 'processed_data_polars_months.parquet',
+    ]
+    assert pq.read_table('processed_data_polars.parquet').equals(taxi_data.csv_df.to_arrow())
+    months = feather.read_table('processed_data_polars_months.arrow')
+    assert months.column_names == ['rate_category'] + SHEET_COLUMNS
+    assert months.num_rows == len(taxi_data.jfk_df) + len(taxi_data.regular_df) + len(taxi_data.other_df)
+
+
+def test_export_results_selected_formats(tmp_path, monkeypatch):
+    written = []
+    monkeypatch.chdir(tmp_path)
+    export_results('out', lambda: written.append('csv'), month_frame(2), {'jfk': month_frame(2)}, formats=('csv',))
+
+    assert written == ['csv'] and list(tmp_path.iterdir()) == []
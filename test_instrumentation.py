@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import main_optimized
+import main_polars_lazy
+from instrumentation import Instrumentation, engine_phases
+
+
+def engine(module, trip_files):
+    taxi_data = module.YellowTaxiData(start_date='2022-01-01', end_date='2022-01-31')
+    taxi_data.urls_list = [str(p) for p in trip_files(['2022-01']).values()]
+    return taxi_data
+
+
+def test_run_records_every_phase(tmp_path, monkeypatch, trip_files):
+    taxi_data = engine(main_optimized, trip_files)
+    monkeypatch.chdir(tmp_path)
+    metrics = Instrumentation().run(taxi_data)
+
+    assert [m.phase for m in metrics] == engine_phases(taxi_data)
+    clean = metrics[1]
+    assert clean.phase == 'clean_data' and clean.rows_in > clean.rows_out > 0
+    assert metrics[2].rows_in == metrics[2].rows_out == clean.rows_out
+    assert all(m.wall_seconds >= 0 and m.cpu_seconds >= 0 and m.rss_peak_bytes > 0 for m in metrics)
+    assert all(m.profile is None and m.traced_peak_bytes is None for m in metrics)
+
+
+def test_lazy_engine_has_no_row_counts(tmp_path, monkeypatch, trip_files):
+    taxi_data = engine(main_polars_lazy, trip_files)
+    monkeypatch.chdir(tmp_path)
+    metrics = Instrumentation().run(taxi_data)
+
+    assert 'collect_data' in [m.phase for m in metrics]
+    assert metrics[1].rows_in is None and metrics[1].rows_out is None
+
+
+def test_profile_and_trace_selected_phases(tmp_path, trip_files):
+    taxi_data = engine(main_optimized, trip_files)
+    instrumentation = Instrumentation(profile={'clean_data'}, trace_memory={'import_data'})
+    instrumentation.run(taxi_data, ['import_data', 'clean_data'])
+
+    imported, cleaned = instrumentation.phases
+    assert imported.traced_peak_bytes > 0 and imported.profile is None
+    assert cleaned.traced_peak_bytes is None
+    assert any(func[2] == 'clean_data' for func in cleaned.profile.stats)
+
+    instrumentation.write_profiles(tmp_path / 'profiles')
+    assert [p.name for p in (tmp_path / 'profiles').iterdir()] == ['clean_data.prof']
+
+
+def test_failed_phase_is_not_recorded():
+    instrumentation = Instrumentation(trace_memory=True)
+    with pytest.raises(RuntimeError, match='phase failed'), instrumentation.measure('clean_data'):
+        raise RuntimeError('phase failed')
+
+    assert instrumentation.phases == []
+    with instrumentation.measure('clean_data'):
+        pass
+    assert instrumentation.phases[0].traced_peak_bytes is not None
+
+
+def test_json_and_prometheus_outputs(tmp_path, trip_files):
+    taxi_data = engine(main_optimized, trip_files)
+    instrumentation = Instrumentation()
+    instrumentation.run(taxi_data, ['import_data', 'clean_data'])
+
+    instrumentation.write_json(tmp_path / 'metrics.json')
+    exported = json.loads((tmp_path / 'metrics.json').read_text())
+    assert [m['phase'] for m in exported['phases']] == ['import_data', 'clean_data']
+    assert exported['total_seconds'] == pytest.approx(sum(m['wall_seconds'] for m in exported['phases']))
+
+    instrumentation.write_prometheus(tmp_path / 'metrics.prom', labels={'engine': 'optimized'})
+    text = (tmp_path / 'metrics.prom').read_text()
+    assert '# TYPE yellow_taxi_phase_wall_seconds gauge' in text
+    assert f'yellow_taxi_phase_rows_out{{engine="optimized",phase="clean_data"}} {len(taxi_data.data)}' in text
+    assert 'yellow_taxi_phase_traced_peak_bytes{' not in text
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import main_optimized
+import main_polars
+from load_scheduler import LOAD_OVERHEAD, LoadScheduler, estimate_month_bytes
+from trip_reader import REQUIRED_COLUMNS
+
+
+class Tracker:
+    """Load function recording how many loads overlap."""
+
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, item):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.seconds)
+        with self.lock:
+            self.running -= 1
+        return item * 2
+
+
+def test_estimate_month_bytes(trip_files):
+    path = trip_files(['2022-01'])['2022-01']
+    schema = pq.read_schema(path)
+    # Every required column of the synthetic files is 8 bytes wide
+    assert all(schema.field(column).type.bit_width == 64 for column in REQUIRED_COLUMNS)
+    rows = pq.read_metadata(path).num_rows
+    assert estimate_month_bytes(path) == len(REQUIRED_COLUMNS) * (rows * 8 + rows // 8) * LOAD_OVERHEAD
+
+
+def test_estimate_month_bytes_of_remote_files_is_unknown():
+    assert estimate_month_bytes('https://example.com/yellow_tripdata_2022-01.parquet') is None
+
+
+def test_loads_wait_for_the_budget():
+    scheduler = LoadScheduler(budget=100, max_workers=3)
+    load = Tracker()
+    results = scheduler.map(load, [1, 2, 3], lambda item: (60, item))
+
+    assert results == [2, 4, 6]
+    assert load.max_running == 1
+    assert scheduler.peak == 60
+    assert scheduler.stats()['wait_seconds'] > 0
+
+
+def test_loads_run_concurrently_within_the_budget():
+    scheduler = LoadScheduler(budget=100, max_workers=3)
+    load = Tracker()
+    scheduler.map(load, [1, 2, 3, 4], lambda item: (30, item))
+
+    assert load.max_running == 3
+    assert scheduler.peak == 90
+
+
+def test_oversize_and_unknown_loads_run_alone():
+    scheduler = LoadScheduler(budget=100, max_workers=3)
+    load = Tracker()
+    scheduler.map(load, [1, 2, 3], lambda item: ({1: 500, 2: None, 3: 10}[item], item))
+
+    assert load.max_running == 1
+    assert scheduler.peak == 500
+
+
+def test_failed_prepare_cancels_later_loads():
+    scheduler = LoadScheduler(budget=100, max_workers=1)
+    loaded = []
+
+    def prepare(item):
+        if item == 1:
+            raise FileNotFoundError(item)
+        return 10, item
+
+    with pytest.raises(FileNotFoundError):
+        scheduler.map(loaded.append, range(6), prepare)
+    # Later turns never start once a month is missing; the first one may already have run
+    assert set(loaded) <= {0}
+    assert scheduler.in_use == 0
+
+
+def test_failed_load_cancels_later_loads():
+    scheduler = LoadScheduler(budget=100, max_workers=1)
+    loaded = []
+
+    def load(item):
+        if item == 2:
+            raise ValueError(item)
+        loaded.append(item)
+
+    with pytest.raises(ValueError):
+        scheduler.map(load, range(6), lambda item: (10, item))
+    assert loaded == [0, 1]
+
+
+@pytest.mark.parametrize('module', [main_optimized, main_polars])
+def test_engine_within_a_small_budget_same_results(module, trip_files):
+    paths = [str(p) for p in trip_files(['2022-01', '2022-02', '2022-03']).values()]
+    results = []
+    for memory_budget in [None, 1]:
+        taxi_data = module.YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31',
+                                          memory_budget=memory_budget, max_workers=3)
+        taxi_data.urls_list = paths
+        taxi_data.import_data()
+        results.append(taxi_data)
+
+    assert results[1].load_stats['peak_bytes'] == max(estimate_month_bytes(p) for p in paths)
+    default, budgeted = (taxi_data.data.to_pandas() if module is main_polars else taxi_data.data
+                         for taxi_data in results)
+    pd.testing.assert_frame_equal(default, budgeted)
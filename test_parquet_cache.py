@@ -0,0 +1,117 @@
+import functools
+import http.server
+import os
+import socket
+import threading
+import time
+from urllib.error import URLError
+
+import pytest
+
+from parquet_cache import CacheMissError, ParquetCache
+
+URL = 'https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{dt}.parquet'
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    mirror_dir = tmp_path / 'mirror'
+    mirror_dir.mkdir()
+    for dt, size in [('2022-01', 100), ('2022-02', 200), ('2022-03', 300)]:
+        (mirror_dir / f'yellow_tripdata_{dt}.parquet').write_bytes(dt.encode() * size)
+    return mirror_dir
+
+
+@pytest.fixture
+def http_mirror(mirror):
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(mirror))
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+def test_fetch_from_local_mirror(tmp_path, mirror):
+    cache = ParquetCache(tmp_path / 'cache', base_url=str(mirror))
+    path = cache.fetch(URL.format(dt='2022-01'))
+    with open(path, 'rb') as f:
+        assert f.read() == b'2022-01' * 100
+
+
+def test_cached_url_needs_no_source(tmp_path, mirror):
+    cache = ParquetCache(tmp_path / 'cache', base_url=str(mirror))
+    first = cache.fetch(URL.format(dt='2022-01'))
+    os.remove(mirror / 'yellow_tripdata_2022-01.parquet')
+
+    reopened = ParquetCache(tmp_path / 'cache', base_url=str(mirror))
+    assert reopened.fetch(URL.format(dt='2022-01')) == first
+
+
+def test_offline_miss_raises(tmp_path, mirror):
+    cache = ParquetCache(tmp_path / 'cache', base_url=str(mirror), offline=True)
+    with pytest.raises(CacheMissError):
+        cache.fetch(URL.format(dt='2022-01'))
+
+
+def test_identical_content_shares_blob(tmp_path, mirror):
+    (mirror / 'copy.parquet').write_bytes(b'2022-01' * 100)
+    cache = ParquetCache(tmp_path / 'cache')
+    assert cache.fetch(str(mirror / 'yellow_tripdata_2022-01.parquet')) == cache.fetch(str(mirror / 'copy.parquet'))
+    assert cache.total_bytes() == 700
+
+
+def test_lru_eviction(tmp_path, mirror):
+    cache = ParquetCache(tmp_path / 'cache', base_url=str(mirror), max_bytes=4000)
+    cache.fetch(URL.format(dt='2022-01'))
+    cache.fetch(URL.format(dt='2022-02'))
+    cache.fetch(URL.format(dt='2022-01'))
+    cache.fetch(URL.format(dt='2022-03'))
+
+    assert URL.format(dt='2022-01') in cache
+    assert URL.format(dt='2022-02') not in cache
+    assert URL.format(dt='2022-03') in cache
+    assert cache.total_bytes() <= 4000
+
+
+def test_http_mirror_revalidation(tmp_path, mirror, http_mirror):
+    cache = ParquetCache(tmp_path / 'cache', base_url=http_mirror, revalidate=True)
+    first = cache.fetch(URL.format(dt='2022-02'))
+    assert cache.index[URL.format(dt='2022-02')]['validator']['last_modified']
+    assert cache.fetch(URL.format(dt='2022-02')) == first
+
+    (mirror / 'yellow_tripdata_2022-02.parquet').write_bytes(b'changed')
+    os.utime(mirror / 'yellow_tripdata_2022-02.parquet', (2e9, 2e9))
+    with open(cache.fetch(URL.format(dt='2022-02')), 'rb') as f:
+        assert f.read() == b'changed'
+
+
+def test_revalidated_entry_is_not_evicted_meanwhile(tmp_path, mirror):
+    cache = ParquetCache(tmp_path / 'cache', base_url=str(mirror), max_bytes=4000, revalidate=True)
+    first = cache.fetch(URL.format(dt='2022-01'))
+    download = cache._download
+
+    def fill_cache_meanwhile(source, dest, validator):
+        if source.endswith('2022-01.parquet'):
+            # Other fetches need 3500 of the 4000 bytes while 2022-01 is revalidated
+            cache.fetch(URL.format(dt='2022-02'))
+            cache.fetch(URL.format(dt='2022-03'))
+        return download(source, dest, validator)
+
+    cache._download = fill_cache_meanwhile
+    assert cache.fetch(URL.format(dt='2022-01')) == first
+    assert os.path.exists(first)
+    assert URL.format(dt='2022-02') not in cache
+    assert cache.total_bytes() <= 4000
+
+
+def test_stalled_download_times_out(tmp_path):
+    # Accepts connections but never answers
+    server = socket.create_server(('127.0.0.1', 0))
+    cache = ParquetCache(tmp_path / 'cache', base_url=f'http://127.0.0.1:{server.getsockname()[1]}', timeout=0.2,
+                         retries=0)
+    started = time.perf_counter()
+    with server, pytest.raises((TimeoutError, URLError)):
+        cache.fetch(URL.format(dt='2022-01'))
+    assert time.perf_counter() - started < 5
@@ -0,0 +1,40 @@
+import polars as pl
+from openpyxl import load_workbook
+from polars.testing import assert_frame_equal
+
+import main_polars
+import main_polars_lazy
+
+
+def run(module, paths, phases):
+    taxi_data = module.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28')
+    taxi_data.urls_list = [str(p) for p in paths]
+    for phase in phases:
+        getattr(taxi_data, phase)()
+    return taxi_data
+
+
+def test_lazy_matches_eager(trip_files):
+    paths = list(trip_files(['2022-01', '2022-02']).values())
+    eager = run(main_polars, paths, ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics',
+                                     'generate_month_metrics', 'format_data'])
+    lazy = run(main_polars_lazy, paths, ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics',
+                                         'generate_month_metrics', 'collect_data', 'format_data'])
+
+    assert_frame_equal(lazy.csv_df, eager.csv_df)
+    for name in ['jfk_df', 'regular_df', 'other_df']:
+        assert_frame_equal(getattr(lazy, name), getattr(eager, name), check_dtypes=False)
+
+
+def test_lazy_excel_export(tmp_path, monkeypatch, trip_files):
+    paths = list(trip_files(['2022-01']).values())
+    lazy = run(main_polars_lazy, paths, ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics',
+                                         'generate_month_metrics', 'collect_data', 'format_data'])
+    monkeypatch.chdir(tmp_path)
+    lazy.export_excel_data()
+
+    workbook = load_workbook('processed_data_polars_lazy.xlsx')
+    assert workbook.sheetnames == ['JFK', 'Regular', 'Others']
+    rows = list(workbook['JFK'].values)
+    assert rows[0] == ('year_month', 'day_type', 'services', 'distances', 'passengers')
+    assert pl.DataFrame(rows[1:], schema=rows[0], orient='row')['services'].to_list() == lazy.jfk_df['services'].to_list()
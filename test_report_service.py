@@ -0,0 +1,103 @@
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pandas as pd
+import pytest
+
+import main_streaming
+from aggregate_store import AggregateStore
+from report_service import ReportService, make_server
+
+
+def streaming_run(paths, start_date, end_date):
+    taxi_data = main_streaming.YellowTaxiData(start_date=start_date, end_date=end_date)
+    taxi_data.urls_list = [str(paths[dt]) for dt in taxi_data.dates_list]
+    for phase in ['import_data', 'process_batches', 'generate_week_metrics', 'generate_month_metrics', 'format_data']:
+        getattr(taxi_data, phase)()
+    return taxi_data
+
+
+@pytest.fixture
+def service(tmp_path, trip_files):
+    paths = trip_files(['2022-01', '2022-02', '2022-03'])
+    return ReportService(url_template=str(tmp_path / 'yellow_tripdata_{dt}.parquet'), max_months=2), paths
+
+
+def test_report_matches_engine(service):
+    service, paths = service
+    for start_date, end_date in [('2022-01-01', '2022-02-28'), ('2022-02-01', '2022-03-31')]:
+        report = service.report(start_date, end_date)
+        expected = streaming_run(paths, start_date, end_date)
+        for name in ['csv_df', 'regular_df', 'jfk_df', 'other_df']:
+            pd.testing.assert_frame_equal(report[name], getattr(expected, name))
+
+
+def test_overlapping_ranges_only_load_missing_months(service, monkeypatch):
+    service, _ = service
+    loaded = []
+    load_month = service.load_month
+    monkeypatch.setattr(service, 'load_month', lambda month: loaded.append(month) or load_month(month))
+
+    service.report('2022-01-01', '2022-02-28')
+    service.report('2022-01-10', '2022-02-20')
+    service.report('2022-02-01', '2022-03-31')
+    assert loaded == ['2022-01', '2022-02', '2022-03']
+    # LRU of two months: January was evicted
+    assert service.stats()['cached_months'] == ['2022-02', '2022-03']
+    service.report('2022-01-01', '2022-01-31')
+    assert loaded[-1] == '2022-01'
+
+
+def test_partials_survive_restart_through_store(tmp_path, trip_files):
+    trip_files(['2022-01'])
+    template = str(tmp_path / 'yellow_tripdata_{dt}.parquet')
+    first = ReportService(store=AggregateStore(tmp_path / 'store'), url_template=template)
+    second = ReportService(store=AggregateStore(tmp_path / 'store'), url_template=template)
+
+    expected = first.report('2022-01-01', '2022-01-31')['csv_df']
+    pd.testing.assert_frame_equal(second.report('2022-01-01', '2022-01-31')['csv_df'], expected)
+
+
+def test_http_report(service):
+    service, paths = service
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        with urlopen(f'{url}/report?start_date=2022-01-01&end_date=2022-01-31') as response:
+            body = json.load(response)
+        expected = streaming_run(paths, '2022-01-01', '2022-01-31')
+        assert [row['total_services'] for row in body['csv_df']] == expected.csv_df['total_services'].tolist()
+        assert len(body['jfk_df']) == len(expected.jfk_df)
+
+        with pytest.raises(HTTPError) as error:
+            urlopen(f'{url}/report?start_date=2022-02-01&end_date=2022-01-01')
+        assert error.value.code == 400
+        # The windowed partials can only be cut at midnight
+        with pytest.raises(HTTPError) as error:
+            urlopen(f'{url}/report?start_date=2022-01-01T12:00&end_date=2022-01-31')
+        assert error.value.code == 400
+        with urlopen(f'{url}/stats') as response:
+            assert json.load(response)['cached_months'] == ['2022-01']
+    finally:
+        server.shutdown()
+
+
+def test_http_engine_error_is_a_500(service, monkeypatch):
+    service, _ = service
+
+    def load_fails(month):
+        raise RuntimeError('engine bug')
+
+    monkeypatch.setattr(service, 'load_month', load_fails)
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with pytest.raises(HTTPError) as error:
+            urlopen(f'http://127.0.0.1:{server.server_address[1]}/report?start_date=2022-01-01&end_date=2022-01-31')
+        assert error.value.code == 500
+        assert json.load(error.value) == {'error': 'RuntimeError: engine bug'}
+    finally:
+        server.shutdown()
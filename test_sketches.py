@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+import main_optimized
+import main_streaming
+from aggregate_store import AggregateStore
+from sketches import (
+    RELATIVE_ACCURACY,
+    merge_sketches,
+    quantile_columns,
+    read_sketches,
+    sketches_from_ipc,
+    sketches_to_ipc,
+    week_sketches,
+    write_sketches,
+)
+
+PHASES = ['import_data', 'process_batches', 'generate_week_metrics', 'generate_month_metrics', 'format_data']
+
+
+def week_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'year_week': rng.integers(202201, 202206, rows),
+        'trip_time_in_seconds': rng.lognormal(6.5, 0.8, rows),
+        'trip_distance': rng.gamma(1.5, 2.0, rows),
+        'total_amount': rng.normal(20, 8, rows),
+    })
+
+
+def test_merged_sketches_within_relative_error():
+    df = week_frame(50_000)
+    sketches = week_sketches()
+    for chunk in [df.iloc[i::7] for i in range(7)]:
+        sketches = merge_sketches(sketches, week_sketches(chunk))
+    columns = quantile_columns(sketches)
+
+    for q in [0.5, 0.9, 0.99]:
+        exact = df.groupby('year_week')['trip_time_in_seconds'].quantile(q, interpolation='lower')
+        error = (columns[f'p{q * 100:g}_trip_time'] / exact - 1).abs()
+        assert error.max() <= RELATIVE_ACCURACY
+    pd.testing.assert_frame_equal(columns, quantile_columns(week_sketches(df)))
+
+
+def test_sketches_round_trip(tmp_path):
+    sketches = week_sketches(week_frame(1000))
+    write_sketches(tmp_path / 'sketches.parquet', sketches)
+
+    expected = quantile_columns(sketches)
+    pd.testing.assert_frame_equal(quantile_columns(read_sketches(tmp_path / 'sketches.parquet')), expected)
+    pd.testing.assert_frame_equal(quantile_columns(sketches_from_ipc(sketches_to_ipc(sketches))), expected)
+
+
+def test_engines_agree_on_quantile_columns(tmp_path, trip_files):
+    paths = trip_files(['2022-01', '2022-02', '2022-03'])
+    optimized = main_optimized.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28', sketches=True)
+    optimized.urls_list = [str(paths[dt]) for dt in optimized.dates_list]
+    for phase in ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics', 'format_data']:
+        getattr(optimized, phase)()
+
+    # The store is filled with a wider window, then reused for the narrower one
+    store = AggregateStore(tmp_path / 'store')
+    for end_date in ['2022-03-31', '2022-02-28']:
+        streaming = main_streaming.YellowTaxiData(start_date='2022-01-01', end_date=end_date, store=store,
+                                                  workers=2, sketches=True)
+        streaming.urls_list = [str(paths[dt]) for dt in streaming.dates_list]
+        for phase in PHASES:
+            getattr(streaming, phase)()
+
+    assert streaming.months_processed == []
+    columns = [c for c in optimized.csv_df if c.startswith('p') and c != 'percentage_variation']
+    assert len(columns) == 9
+    pd.testing.assert_frame_equal(streaming.csv_df[columns], optimized.csv_df[columns])
@@ -0,0 +1,161 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import main_optimized
+import main_streaming
+from aggregates import derive_keys, week_partial
+
+
+def run_optimized(paths, start_date, end_date):
+    taxi_data = main_optimized.YellowTaxiData(start_date=start_date, end_date=end_date)
+    taxi_data.urls_list = [str(p) for p in paths]
+    for phase in ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics',
+                  'generate_month_metrics', 'format_data']:
+        getattr(taxi_data, phase)()
+    return taxi_data
+
+
+def run_streaming(paths, start_date, end_date, batch_size, **kwargs):
+    taxi_data = main_streaming.YellowTaxiData(start_date=start_date, end_date=end_date, batch_size=batch_size,
+                                              **kwargs)
+    taxi_data.urls_list = [str(p) for p in paths]
+    for phase in ['import_data', 'process_batches', 'generate_week_metrics', 'generate_month_metrics', 'format_data']:
+        getattr(taxi_data, phase)()
+    return taxi_data
+
+
+def test_partials_merge_like_union(trip_files):
+    paths = trip_files(['2022-01', '2022-02'])
+    frames = [derive_keys(pd.read_parquet(p).dropna()) for p in paths.values()]
+
+    merged = week_partial(frames[0]).merge(week_partial(frames[1]))
+    union = week_partial(pd.concat(frames))
+
+    pd.testing.assert_frame_equal(merged.frame, union.frame, check_dtype=False)
+
+
+def test_rollup_rejects_bounds_within_a_day(trip_files):
+    path = trip_files(['2022-01'])['2022-01']
+    partial = week_partial(derive_keys(pd.read_parquet(path).dropna()), windowed=True)
+
+    assert not partial.rollup(['year_week'], '2022-01-01', '2022-01-31').frame.empty
+    with pytest.raises(ValueError, match='midnight'):
+        partial.rollup(['year_week'], '2022-01-01 12:00', '2022-01-31')
+    with pytest.raises(ValueError, match='midnight'):
+        partial.rollup(['year_week'], '2022-01-01', '2022-01-30 23:59:59')
+
+
+def test_streaming_matches_optimized(trip_files):
+    paths = list(trip_files(['2022-01', '2022-02', '2022-03']).values())
+    expected = run_optimized(paths, '2022-01-01', '2022-03-31')
+    streamed = run_streaming(paths, '2022-01-01', '2022-03-31', batch_size=300)
+
+    expected_csv_df = expected.csv_df.assign(year_week=lambda df: df['year_week'].astype(str))
+    pd.testing.assert_frame_equal(streamed.csv_df, expected_csv_df, check_dtype=False)
+    for name in ['jfk_df', 'regular_df', 'other_df']:
+        expected_df = getattr(expected, name).assign(year_month=lambda df: df['year_month'].astype(str))
+        pd.testing.assert_frame_equal(getattr(streamed, name), expected_df, check_dtype=False)
+
+
+@pytest.mark.parametrize('count_rejections', [True, False])
+def test_process_pool_matches_sequential(trip_files, count_rejections):
+    paths = list(trip_files(['2022-01', '2022-02']).values())
+    sequential = run_streaming(paths, '2022-01-01', '2022-02-28', batch_size=300, count_rejections=count_rejections)
+
+    for shard_by in ['month', 'row_group']:
+        taxi_data = main_streaming.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28',
+                                                  workers=2, shard_by=shard_by, count_rejections=count_rejections)
+        taxi_data.urls_list = [str(p) for p in paths]
+        for phase in ['import_data', 'process_batches', 'generate_week_metrics', 'generate_month_metrics',
+                      'format_data']:
+            getattr(taxi_data, phase)()
+
+        assert taxi_data.months_processed == ['2022-01', '2022-02']
+        assert taxi_data.rows_read == sequential.rows_read
+        # Duplicates in different row groups of a month are removed like in the sequential scan
+        pd.testing.assert_frame_equal(taxi_data.csv_df, sequential.csv_df)
+        for name in ['jfk_df', 'regular_df', 'other_df']:
+            pd.testing.assert_frame_equal(getattr(taxi_data, name), getattr(sequential, name))
+        pd.testing.assert_frame_equal(taxi_data.rejections, sequential.rejections)
+
+
+def test_pipelined_download_matches_sequential(trip_files, flaky_server, monkeypatch):
+    monkeypatch.setattr('download.BACKOFF', 0)
+    paths = list(trip_files(['2022-01', '2022-02', '2022-03']).values())
+    sequential = run_streaming(paths, '2022-01-01', '2022-03-31', batch_size=300)
+
+    taxi_data = main_streaming.YellowTaxiData(start_date='2022-01-01', end_date='2022-03-31', batch_size=300,
+                                              prefetch=2)
+    taxi_data.urls_list = [f'{flaky_server.url}/{p.name}' for p in paths]
+    for phase in ['import_data', 'process_batches', 'generate_week_metrics', 'generate_month_metrics', 'format_data']:
+        getattr(taxi_data, phase)()
+
+    # Every month failed once with a 503 and was retried
+    assert sorted(flaky_server.requests) == sorted(f'/{p.name}' for p in paths for _ in range(2))
+    assert taxi_data.months_processed == ['2022-01', '2022-02', '2022-03']
+    pd.testing.assert_frame_equal(taxi_data.csv_df, sequential.csv_df)
+    pd.testing.assert_frame_equal(taxi_data.regular_df, sequential.regular_df)
+
+
+def test_process_pool_bounds_the_tasks_in_flight(trip_files, monkeypatch):
+    path = str(trip_files(['2022-01'])['2022-01'])
+    finished, ahead, lock = [], [], threading.Lock()
+    scan = main_streaming._scan_partials_task
+
+    def slow_scan(args):
+        time.sleep(0.05)
+        result = scan(args)
+        with lock:
+            finished.append(args)
+        return result
+
+    def pending():
+        for i in range(10):
+            with lock:
+                ahead.append(i - len(finished))
+            yield f'2022-01-{i}', path
+
+    monkeypatch.setattr(main_streaming, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(main_streaming, '_scan_partials_task', slow_scan)
+    taxi_data = main_streaming.YellowTaxiData(start_date='2022-01-01', end_date='2022-01-31', workers=2, prefetch=1)
+    months = [dt for dt, _, _, _ in taxi_data.map_partials(pending())]
+
+    assert months == [f'2022-01-{i}' for i in range(10)]
+    # A month is only pulled once fewer than workers + prefetch tasks are in flight
+    assert max(ahead) <= taxi_data.workers + taxi_data.prefetch
+
+
+def test_buffer_months_are_not_sharded(trip_files):
+    path = trip_files(['2022-01'])['2022-01']
+    taxi_data = main_streaming.YellowTaxiData(start_date='2022-01-01', end_date='2022-01-31', shard_by='row_group')
+
+    assert len(taxi_data.shards(str(path))) > 1
+    assert taxi_data.shards(pa.py_buffer(path.read_bytes())) == [None]
+
+
+def test_scan_partials_resolves_collisions(trip_files, monkeypatch):
+    path = str(trip_files(['2022-01'])['2022-01'])
+    expected = main_streaming.scan_partials(path, '2022-01-01', '2022-01-31', batch_size=300)
+
+    # Only 1000 distinct fingerprints: most repeated ones are distinct rows, some first seen in earlier row groups
+    hash_rows = pd.util.hash_pandas_object
+    monkeypatch.setattr(pd.util, 'hash_pandas_object',
+                        lambda df, index: hash_rows(df, index=index) % np.uint64(1000))
+    reads = []
+    read_rows = main_streaming.read_rows
+    monkeypatch.setattr(main_streaming, 'read_rows',
+                        lambda fragment, positions, scan_filter: reads.append(positions) or
+                        read_rows(fragment, positions, scan_filter))
+    collided = main_streaming.scan_partials(path, '2022-01-01', '2022-01-31', batch_size=300)
+
+    assert len(reads) == 1 and 0 < len(reads[0]) < 1000
+    for partial, expected_partial in zip(collided[:2], expected[:2]):
+        pd.testing.assert_frame_equal(partial.frame.sort_index(), expected_partial.frame.sort_index())
+    assert collided[2] == expected[2]
+    pd.testing.assert_frame_equal(collided[3], expected[3])
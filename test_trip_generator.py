@@ -0,0 +1,46 @@
+import pyarrow.parquet as pq
+
+import main_optimized
+import trip_generator
+
+CLEAN_RATES = {name: 0.0 for name in trip_generator.DIRTY_RATES}
+
+
+def test_generate_months_layout(tmp_path):
+    paths = trip_generator.generate_months('2022-01', '2022-02', 5900, tmp_path, row_group_size=1000, workers=2,
+                                           dirty_rates=CLEAN_RATES)
+
+    assert list(paths) == ['2022-01', '2022-02']
+    metadata = [pq.ParquetFile(path).metadata for path in paths.values()]
+    assert [m.num_rows for m in metadata] == [3100, 2800]
+    assert [m.num_row_groups for m in metadata] == [4, 3]
+    assert pq.read_schema(paths['2022-01']) == trip_generator.SCHEMA
+
+
+def test_generate_chunk_is_deterministic():
+    first = trip_generator.generate_chunk('2022-03', 500, [1, 2])
+    assert first.equals(trip_generator.generate_chunk('2022-03', 500, [1, 2]))
+    assert not first.equals(trip_generator.generate_chunk('2022-03', 500, [1, 3]))
+
+
+def test_dirty_rates_drive_cleaning():
+    rows = 20000
+    clean = trip_generator.generate_chunk('2022-03', rows, [0], CLEAN_RATES).to_pandas()
+    assert clean.notna().all().all() and not clean.duplicated().any()
+
+    dirty = trip_generator.generate_chunk('2022-03', rows, [0], {'null': 0.1, 'duplicate': 0.05}).to_pandas()
+    assert len(dirty) == rows * 1.05
+    assert 0.08 < dirty['passenger_count'].isna().mean() < 0.12
+    assert (dirty['total_amount'] <= 0).any()
+    assert (dirty['tpep_pickup_datetime'].dt.year != 2022).any()
+
+
+def test_clean_chunk_survives_clean_data(tmp_path):
+    path = trip_generator.write_month(str(tmp_path / 'yellow_tripdata_2022-03.parquet'), '2022-03', 3000, [0],
+                                      CLEAN_RATES)
+
+    taxi_data = main_optimized.YellowTaxiData(start_date='2022-03-01', end_date='2022-04-01')
+    taxi_data.urls_list = [path]
+    taxi_data.import_data()
+    taxi_data.clean_data()
+    assert len(taxi_data.data) == 3000
@@ -0,0 +1,177 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import main
+import main_optimized
+import main_polars
+from conftest import make_trips
+from trip_reader import (
+    CANONICAL_SCHEMA,
+    REQUIRED_COLUMNS,
+    compact_table,
+    open_fragment,
+    pushdown_filter,
+    scan_month,
+    scan_month_checked,
+    to_pandas,
+)
+
+
+@pytest.fixture
+def month_file(tmp_path):
+    pickup = pd.to_datetime(['2022-02-28 23:00', '2022-03-01 10:00', '2022-03-02 10:00', '2022-03-03 10:00',
+                              '2022-03-10 10:00', '2022-03-11 10:00', '2022-03-30 10:00', '2022-03-31 10:00'])
+    table = pa.table({
+        'VendorID': pa.array([1] * 8),
+        'tpep_pickup_datetime': pa.array(pickup.values, pa.timestamp('ns')),
+        'tpep_dropoff_datetime': pa.array((pickup + pd.Timedelta(minutes=10)).values, pa.timestamp('ns')),
+        'passenger_count': pa.array([1.0, 1.0, None, 0.0, 2.0, 1.0, 1.0, 1.0]),
+        'trip_distance': pa.array([1.0, 1.0, 1.0, 1.0, 0.0, 2.0, 3.0, 1.0]),
+        'RatecodeID': pa.array([1.0, 2.0, 1.0, 1.0, 1.0, 99.0, 1.0, 1.0]),
+        'store_and_fwd_flag': pa.array(['N'] * 8),
+        'total_amount': pa.array([10.0, 10.0, 10.0, 10.0, 10.0, 6000.0, 12.0, 10.0]),
+    })
+    path = tmp_path / 'yellow_tripdata_2022-03.parquet'
+    pq.write_table(table, path, row_group_size=2)
+    return path
+
+
+def test_scan_month_projects_required_columns(month_file):
+    table = scan_month(month_file, '2022-03-01', '2022-03-31')
+    assert table.column_names == REQUIRED_COLUMNS
+
+
+def test_scan_month_applies_predicates(month_file):
+    df = scan_month(month_file, '2022-03-01', '2022-03-31').to_pandas()
+    assert df['tpep_pickup_datetime'].dt.strftime('%m-%d').tolist() == ['03-01', '03-30']
+
+
+def test_row_groups_pruned_by_statistics(month_file):
+    fragment = open_fragment(month_file)
+    assert fragment.num_row_groups == 4
+    assert len(fragment.split_by_row_group(pushdown_filter('2022-03-05', '2022-03-20'))) == 1
+
+
+def test_scan_month_casts_to_canonical_schema(month_file):
+    table, mismatches = scan_month_checked(month_file, '2022-03-01', '2022-03-31')
+
+    assert table.schema == CANONICAL_SCHEMA
+    assert mismatches == {
+        'tpep_pickup_datetime': ('timestamp[ns]', 'timestamp[us]'),
+        'tpep_dropoff_datetime': ('timestamp[ns]', 'timestamp[us]'),
+        'RatecodeID': ('double', 'int64'),
+    }
+    assert table['RatecodeID'].to_pylist() == [2, 1]
+
+
+def test_scan_month_rejects_lossy_casts(tmp_path):
+    table = make_trips('2022-03', 100)
+    ratecode = table.schema.get_field_index('RatecodeID')
+    path = tmp_path / 'yellow_tripdata_2022-03.parquet'
+    pq.write_table(table.set_column(ratecode, 'RatecodeID', pa.array([1.5] * table.num_rows)), path)
+
+    with pytest.raises(pa.ArrowInvalid):
+        scan_month(path, '2022-03-01', '2022-03-31')
+
+
+def test_compact_table_is_lossless():
+    table = pa.table({
+        'passenger_count': pa.array([1.0, 2.0, 6.0]),
+        'RatecodeID': pa.array([1.0, None, 99.0]),
+        'trip_distance': pa.array([1.5, 0.25, 12.0]),
+        'total_amount': pa.array([12.35, 7.1, 20.0]),
+    })
+    compact, bytes_saved = compact_table(table)
+
+    assert compact.schema.types == [pa.uint8(), pa.float32(), pa.float32(), pa.float64()]
+    assert bytes_saved == table.nbytes - compact.nbytes > 0
+    assert compact.to_pandas().astype(float).equals(table.to_pandas())
+
+
+def test_compact_engine_same_results(trip_files):
+    paths = [str(p) for p in trip_files(['2022-01', '2022-02']).values()]
+    results = []
+    for compact in [False, True]:
+        taxi_data = main_optimized.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28', compact=compact)
+        taxi_data.urls_list = paths
+        for phase in ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics',
+                      'generate_month_metrics', 'format_data']:
+            getattr(taxi_data, phase)()
+        results.append(taxi_data)
+
+    assert results[1].bytes_saved > 0
+    pd.testing.assert_frame_equal(results[0].csv_df, results[1].csv_df)
+    for name in ['jfk_df', 'regular_df', 'other_df']:
+        pd.testing.assert_frame_equal(getattr(results[0], name), getattr(results[1], name), check_dtype=False)
+
+
+def test_to_pandas_dtype_backends(month_file):
+    table = scan_month(month_file, '2022-01-01', '2022-01-31')
+
+    assert not any(isinstance(dtype, pd.ArrowDtype) for dtype in to_pandas(table).dtypes)
+    assert all(isinstance(dtype, pd.ArrowDtype) for dtype in to_pandas(table, 'pyarrow').dtypes)
+    with pytest.raises(ValueError):
+        to_pandas(table, 'numpy')
+
+
+@pytest.mark.parametrize('module', [main, main_optimized])
+def test_arrow_backend_engine_same_results(trip_files, module):
+    paths = [str(p) for p in trip_files(['2022-01', '2022-02']).values()]
+    results = []
+    for dtype_backend in [None, 'pyarrow']:
+        taxi_data = module.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28', dtype_backend=dtype_backend)
+        taxi_data.urls_list = paths
+        for phase in ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics',
+                      'generate_month_metrics']:
+            getattr(taxi_data, phase)()
+        results.append(taxi_data)
+
+    data = results[1].data
+    assert data.select_dtypes('object').empty
+    assert isinstance(data['tpep_dropoff_datetime'].dtype, pd.ArrowDtype)
+    assert isinstance(data['year_week'].cat.categories.dtype, pd.ArrowDtype)
+    for name in ['csv_df', 'jfk_df', 'regular_df', 'other_df']:
+        frame = getattr(results[1], name)
+        # Arrow nulls (e.g. the first percentage_variation) become NaN
+        frame = frame.astype({column: dtype.numpy_dtype for column, dtype in frame.dtypes.items()
+                              if isinstance(dtype, pd.ArrowDtype)})
+        pd.testing.assert_frame_equal(frame, getattr(results[0], name), check_dtype=False, check_categorical=False)
+
+
+def drifted(table):
+    """``table`` stored the way older monthly files are: integer counts and nanosecond timestamps."""
+    types = {'tpep_pickup_datetime': pa.timestamp('ns'), 'tpep_dropoff_datetime': pa.timestamp('ns'),
+             'passenger_count': pa.int64(), 'RatecodeID': pa.int64()}
+    return table.cast(pa.schema([pa.field(f.name, types.get(f.name, f.type)) for f in table.schema]))
+
+
+@pytest.mark.parametrize('module', [main_optimized, main_polars])
+def test_drifted_months_engine_same_results(tmp_path, trip_files, module):
+    paths = trip_files(['2022-01', '2022-02'])
+    drifted_path = tmp_path / 'drifted' / 'yellow_tripdata_2022-02.parquet'
+    drifted_path.parent.mkdir()
+    pq.write_table(drifted(pq.read_table(paths['2022-02'])), drifted_path)
+
+    results = []
+    for urls in [[str(paths['2022-01']), str(paths['2022-02'])], [str(paths['2022-01']), str(drifted_path)]]:
+        taxi_data = module.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28')
+        taxi_data.urls_list = urls
+        taxi_data.import_data()
+        taxi_data.clean_data()
+        assert str(taxi_data.data['RatecodeID'].dtype) in ('int64', 'Int64')
+        for phase in ['add_more_columns', 'generate_week_metrics', 'generate_month_metrics', 'format_data']:
+            getattr(taxi_data, phase)()
+        results.append(taxi_data)
+
+    # The synthetic files store RatecodeID as double, like the current TLC files
+    assert set(results[0].schema_mismatches[str(paths['2022-02'])]) == {'RatecodeID'}
+    assert set(results[1].schema_mismatches[str(drifted_path)]) == {
+        'tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count'
+    }
+    for name in ['csv_df', 'jfk_df', 'regular_df', 'other_df']:
+        actual, expected = getattr(results[1], name), getattr(results[0], name)
+        if module is main_polars:
+            actual, expected = actual.to_pandas(), expected.to_pandas()
+        pd.testing.assert_frame_equal(actual, expected)
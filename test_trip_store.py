@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import main_optimized
+from trip_reader import REQUIRED_COLUMNS, scan_month
+from trip_store import TripStore
+
+PHASES = ['import_data', 'clean_data', 'add_more_columns', 'generate_week_metrics', 'generate_month_metrics',
+          'format_data']
+
+
+def run(paths, cache=None):
+    taxi_data = main_optimized.YellowTaxiData(start_date='2022-01-01', end_date='2022-02-28', cache=cache)
+    taxi_data.urls_list = [str(p) for p in paths]
+    for phase in PHASES:
+        getattr(taxi_data, phase)()
+    return taxi_data
+
+
+def test_ingest_writes_sorted_hive_partitions(tmp_path, trip_files):
+    paths = trip_files(['2022-01', '2022-02'])
+    store = TripStore(tmp_path / 'store', row_group_size=100)
+
+    path = store.fetch(str(paths['2022-02']))
+    assert os.path.relpath(path, tmp_path / 'store') == os.path.join('year=2022', 'month=2', 'part-0.parquet')
+    table = pq.ParquetFile(path).read()
+    assert table.column_names == REQUIRED_COLUMNS
+    assert table.num_rows == pq.read_metadata(paths['2022-02']).num_rows
+    dropoff = table.column('tpep_dropoff_datetime').to_numpy()
+    assert (np.diff(dropoff) >= np.timedelta64(0)).all()
+    assert pq.ParquetFile(path).num_row_groups == -(-table.num_rows // 100)
+
+    mtime = os.stat(path).st_mtime_ns
+    assert store.fetch(str(paths['2022-02'])) == path and os.stat(path).st_mtime_ns == mtime
+
+
+def test_engine_reads_through_store(tmp_path, trip_files):
+    paths = trip_files(['2022-01', '2022-02']).values()
+    expected = run(paths)
+    stored = run(paths, cache=TripStore(tmp_path / 'store', row_group_size=100))
+
+    # Rows come sorted by dropoff, so sums may only differ in their last bits
+    pd.testing.assert_frame_equal(stored.csv_df, expected.csv_df)
+    for name in ['jfk_df', 'regular_df', 'other_df']:
+        pd.testing.assert_frame_equal(getattr(stored, name), getattr(expected, name))
+
+
+def test_scan_prunes_partitions_and_row_groups(tmp_path, trip_files):
+    paths = trip_files(['2022-01', '2022-02', '2022-03'], rows=5000)
+    store = TripStore(tmp_path / 'store', row_group_size=200)
+    for path in paths.values():
+        store.fetch(str(path))
+
+    row_groups = store.row_groups('2022-02-07', '2022-02-13')
+    assert list(row_groups) == [store.month_path('2022-02')]
+    assert 0 < len(row_groups[store.month_path('2022-02')]) <= 8
+    assert pq.ParquetFile(store.month_path('2022-02')).num_row_groups == 26
+
+    scanned = store.scan('2022-02-07', '2022-02-13').to_pandas()
+    expected = scan_month(paths['2022-02'], '2022-02-07', '2022-02-13').to_pandas()
+    pd.testing.assert_frame_equal(scanned.sort_values(REQUIRED_COLUMNS).reset_index(drop=True),
+                                  expected.sort_values(REQUIRED_COLUMNS).reset_index(drop=True))
@@ -0,0 +1,197 @@
+"""Synthetic yellow-taxi month files for scale testing.
+
+    python trip_generator.py 2019-01 2023-12 100000000 data/ --workers 8
+
+Rows are split over the months by their number of days and written as
+``yellow_tripdata_YYYY-MM.parquet`` with the TLC schema. Months are generated in
+parallel on a process pool, each one in row-group sized chunks, so memory stays
+bounded by the chunk size whatever the row count.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Like the TLC files, which hold about a million rows per row group
+ROW_GROUP_SIZE = 1_048_576
+
+SCHEMA = pa.schema([
+    ('VendorID', pa.int64()),
+    ('tpep_pickup_datetime', pa.timestamp('us')),
+    ('tpep_dropoff_datetime', pa.timestamp('us')),
+    ('passenger_count', pa.float64()),
+    ('trip_distance', pa.float64()),
+    ('RatecodeID', pa.float64()),
+    ('store_and_fwd_flag', pa.string()),
+    ('PULocationID', pa.int64()),
+    ('DOLocationID', pa.int64()),
+    ('payment_type', pa.int64()),
+    ('fare_amount', pa.float64()),
+    ('extra', pa.float64()),
+    ('mta_tax', pa.float64()),
+    ('tip_amount', pa.float64()),
+    ('tolls_amount', pa.float64()),
+    ('improvement_surcharge', pa.float64()),
+    ('total_amount', pa.float64()),
+    ('congestion_surcharge', pa.float64()),
+    ('airport_fee', pa.float64()),
+])
+
+# Fraction of rows turned into each of the cases clean_data rejects
+DIRTY_RATES = {
+    'null': 0.03,                  # passenger_count, RatecodeID, flag and surcharges missing together
+    'duplicate': 0.01,             # exact copies of other rows of the same chunk
+    'non_positive_amount': 0.01,   # refunds and voided trips
+    'short_trip': 0.02,            # under 60 seconds, including dropoff before pickup
+    'speeding': 0.003,             # average speed over 100 mph
+    'zero_distance': 0.015,
+    'zero_passengers': 0.02,
+    'out_of_range': 0.001,         # pickup years away from the file's month
+}
+
+# Relative pickup volume per hour of the day
+HOURLY_WEIGHTS = np.array([3.0, 2.0, 1.4, 1.0, 0.8, 1.0, 2.2, 3.6, 4.4, 4.6, 4.6, 4.8,
+                           5.0, 5.0, 5.4, 5.6, 5.6, 6.2, 6.6, 6.2, 5.6, 5.4, 5.0, 4.0])
+HOURLY_WEIGHTS = HOURLY_WEIGHTS / HOURLY_WEIGHTS.sum()
+RATE_CODES = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 99.0])
+RATE_CODE_WEIGHTS = np.array([0.93, 0.035, 0.005, 0.002, 0.022, 0.001, 0.005])
+FLAGS = pa.array(['N', 'Y'])
+
+
+def generate_chunk(month, rows, seed, dirty_rates=None):
+    """``rows`` trips for ``month`` ('YYYY-MM') plus their duplicates, as an Arrow table."""
+    rates = dict(DIRTY_RATES, **(dirty_rates or {}))
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(f'{month}-01')
+    days = (start + pd.offsets.MonthBegin(1) - start).days
+
+    def pick(rate):
+        return rng.random(rows) < rate
+
+    # Pickups follow the daily demand curve and durations follow distance at a city speed
+    seconds = (rng.integers(0, days, rows) * 86400 + rng.choice(24, rows, p=HOURLY_WEIGHTS) * 3600
+               + rng.integers(0, 3600, rows))
+    pickup = np.datetime64(start, 's') + seconds.astype('timedelta64[s]')
+    rate_code = rng.choice(RATE_CODES, rows, p=RATE_CODE_WEIGHTS)
+    jfk = rate_code == 2.0
+    distance = np.round(np.clip(np.where(jfk, rng.normal(17.5, 2.5, rows), rng.lognormal(0.55, 0.85, rows)),
+                                0.01, 200), 2)
+    speed = np.clip(rng.lognormal(2.4, 0.35, rows), 2, 60)
+    duration = np.maximum(60, distance / speed * 3600 + rng.normal(120, 60, rows)).astype(np.int64)
+    passengers = rng.choice([1.0, 2.0, 3.0, 4.0, 5.0, 6.0], rows, p=[0.72, 0.15, 0.05, 0.03, 0.03, 0.02])
+
+    short = pick(rates['short_trip'])
+    duration[short] = rng.integers(-300, 60, short.sum())
+    speeding = pick(rates['speeding'])
+    distance[speeding] = np.round(np.maximum(duration[speeding], 60) / 3600 * rng.uniform(110, 1000, speeding.sum()), 2)
+    distance[pick(rates['zero_distance'])] = 0.0
+    passengers[pick(rates['zero_passengers'])] = 0.0
+    out_of_range = pick(rates['out_of_range'])
+    pickup[out_of_range] += (rng.choice([-13, -1, 76], out_of_range.sum()) * 365 * 86400).astype('timedelta64[s]')
+
+    payment_type = rng.choice([1, 2, 3, 4], rows, p=[0.76, 0.21, 0.02, 0.01])
+    fare = np.where(jfk, 52.0, np.round(3.0 + 2.5 * distance + 0.5 * np.maximum(duration, 0) / 60, 1))
+    extra = rng.choice([0.0, 0.5, 1.0, 2.5], rows, p=[0.4, 0.3, 0.1, 0.2])
+    tip = np.where(payment_type == 1, np.round(fare * rng.uniform(0.1, 0.3, rows), 2), 0.0)
+    tolls = np.where(rng.random(rows) < 0.05, 6.55, 0.0)
+    congestion = np.where(rng.random(rows) < 0.9, 2.5, 0.0)
+    airport = np.where(jfk, 1.25, 0.0)
+    total = np.round(fare + extra + 0.5 + tip + tolls + 0.3 + congestion + airport, 2)
+
+    # Refunds are negated, voided trips are zeroed
+    refund = pick(rates['non_positive_amount'])
+    total[refund] *= np.where(rng.random(refund.sum()) < 0.8, -1.0, 0.0)
+    fare[refund] = np.copysign(fare[refund], total[refund])
+
+    missing = pick(rates['null'])
+    flags = pc.take(FLAGS, pa.array((rng.random(rows) < 0.005).astype(np.int8)))
+    table = pa.table([
+        pa.array(rng.choice([1, 2], rows, p=[0.3, 0.7])),
+        pa.array(pickup, pa.timestamp('us')),
+        pa.array(pickup + duration.astype('timedelta64[s]'), pa.timestamp('us')),
+        pa.array(passengers, mask=missing),
+        pa.array(distance),
+        pa.array(rate_code, mask=missing),
+        pc.if_else(pa.array(missing), pa.scalar(None, pa.string()), flags),
+        pa.array(rng.integers(1, 266, rows)),
+        pa.array(rng.integers(1, 266, rows)),
+        pa.array(payment_type),
+        pa.array(fare),
+        pa.array(extra),
+        pa.array(np.full(rows, 0.5)),
+        pa.array(tip),
+        pa.array(tolls),
+        pa.array(np.full(rows, 0.3)),
+        pa.array(total),
+        pa.array(congestion, mask=missing),
+        pa.array(airport, mask=missing),
+    ], schema=SCHEMA)
+
+    duplicates = np.sort(rng.integers(0, rows, int(rows * rates['duplicate'])))
+    return pa.concat_tables([table, table.take(duplicates)])
+
+
+def month_rows(months, rows):
+    """Split ``rows`` over the months proportionally to their number of days."""
+    days = np.array([pd.Period(month, 'M').days_in_month for month in months])
+    counts = np.floor(rows * days / days.sum()).astype(int)
+    counts[:rows - counts.sum()] += 1
+    return dict(zip(months, counts.tolist()))
+
+
+def write_month(path, month, rows, seed, dirty_rates=None, row_group_size=ROW_GROUP_SIZE):
+    """Generate ``month`` chunk by chunk into ``path``, one row group per chunk."""
+    with pq.ParquetWriter(path, SCHEMA) as writer:
+        if rows == 0:
+            writer.write_table(SCHEMA.empty_table())
+        for i, offset in enumerate(range(0, rows, row_group_size)):
+            table = generate_chunk(month, min(row_group_size, rows - offset), seed + [i], dirty_rates)
+            writer.write_table(table, row_group_size=len(table))
+    return path
+
+
+def generate_months(start_month, end_month, rows, out_dir, dirty_rates=None, row_group_size=ROW_GROUP_SIZE,
+                    workers=None, seed=0):
+    """Write one parquet file per month from ``start_month`` to ``end_month``; returns {month: path}."""
+    months = pd.period_range(start_month, end_month, freq='M').strftime('%Y-%m').tolist()
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {month: os.path.join(out_dir, f'yellow_tripdata_{month}.parquet') for month in months}
+
+    # Months are independent, so each worker writes whole files and nothing is sent back
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(write_month, paths[month], month, count, [seed, i], dirty_rates, row_group_size)
+                   for i, (month, count) in enumerate(month_rows(months, rows).items())]
+        for future in futures:
+            future.result()
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('start_month', help='first month, YYYY-MM')
+    parser.add_argument('end_month', help='last month, YYYY-MM')
+    parser.add_argument('rows', type=int, help='rows over the whole range, before duplicates')
+    parser.add_argument('out_dir')
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    for name, rate in DIRTY_RATES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}-rate", type=float, default=rate, dest=name)
+
+    args = parser.parse_args(argv)
+    dirty_rates = {name: getattr(args, name) for name in DIRTY_RATES}
+    paths = generate_months(args.start_month, args.end_month, args.rows, args.out_dir, dirty_rates,
+                            args.row_group_size, args.workers, args.seed)
+    for path in paths.values():
+        print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
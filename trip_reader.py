@@ -0,0 +1,136 @@
+from urllib.parse import urlparse
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+from download import read_url
+
+REQUIRED_COLUMNS = ['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count',
+                    'trip_distance', 'RatecodeID', 'total_amount']
+
+# Type every required column is read as, whichever type a monthly file stores it with: across the years the
+# TLC files have stored passenger_count and RatecodeID as int64 or double and the timestamps in ns or us.
+CANONICAL_SCHEMA = pa.schema([
+    ('tpep_pickup_datetime', pa.timestamp('us')),
+    ('tpep_dropoff_datetime', pa.timestamp('us')),
+    ('passenger_count', pa.float64()),
+    ('trip_distance', pa.float64()),
+    ('RatecodeID', pa.int64()),
+    ('total_amount', pa.float64()),
+])
+
+# Integer targets of the compact profile; other float64 columns go to float32 when lossless.
+COMPACT_TYPES = {'passenger_count': pa.uint8(), 'RatecodeID': pa.uint8()}
+
+PARQUET_FORMAT = ds.ParquetFileFormat()
+LOCAL_FS = pafs.LocalFileSystem()
+
+
+def pushdown_filter(start_date, end_date):
+    """The row-wise clean_data rules that parquet statistics can prune on.
+
+    A ``None`` start_date / end_date leaves that side of the date window open.
+    """
+    scan_filter = (
+        (ds.field('trip_distance') > 0) &
+        (ds.field('total_amount') > 0) &
+        (ds.field('total_amount') <= 5000) &
+        (ds.field('passenger_count') > 0)
+    )
+    if start_date is not None:
+        scan_filter &= ds.field('tpep_pickup_datetime') >= pd.Timestamp(start_date).to_pydatetime()
+    if end_date is not None:
+        scan_filter &= ds.field('tpep_dropoff_datetime') <= pd.Timestamp(end_date).to_pydatetime()
+    return scan_filter
+
+
+def open_fragment(source):
+    """Parquet fragment of a local path, an HTTP(S) URL (downloaded with retries) or an in-memory buffer."""
+    if isinstance(source, pa.Buffer):
+        return PARQUET_FORMAT.make_fragment(pa.BufferReader(source))
+    if urlparse(str(source)).scheme in ('http', 'https'):
+        return PARQUET_FORMAT.make_fragment(pa.BufferReader(read_url(source)))
+    return PARQUET_FORMAT.make_fragment(str(source), filesystem=LOCAL_FS)
+
+
+def schema_mismatches(physical_schema):
+    """{column: (stored type, canonical type)} of the CANONICAL_SCHEMA columns a file stores with another type."""
+    return {
+        field.name: (str(field.type), str(CANONICAL_SCHEMA.field(field.name).type))
+        for field in physical_schema
+        if field.name in CANONICAL_SCHEMA.names and field.type != CANONICAL_SCHEMA.field(field.name).type
+    }
+
+
+def scan_fragment(fragment, columns=REQUIRED_COLUMNS, filter=None, schema=CANONICAL_SCHEMA, **kwargs):
+    """Scanner of ``fragment`` casting every batch to ``schema`` while it is read.
+
+    Frames of months stored with different types then concatenate without any further
+    conversion. A cast that would lose information (e.g. a RatecodeID of 1.5) raises
+    ArrowInvalid. Columns missing from ``schema`` keep their stored type.
+    """
+    schema = pa.schema([schema.field(field.name) if field.name in schema.names else field
+                        for field in fragment.physical_schema])
+    return ds.Scanner.from_fragment(fragment, schema=schema, columns=columns, filter=filter, **kwargs)
+
+
+def scan_month_checked(source, start_date, end_date, columns=REQUIRED_COLUMNS, pushdown=True):
+    """scan_month that also returns the schema_mismatches of the file it cast."""
+    fragment = open_fragment(source)
+    table = scan_fragment(fragment, columns, pushdown_filter(start_date, end_date) if pushdown else None).to_table()
+    return table, schema_mismatches(fragment.physical_schema)
+
+
+def scan_month(source, start_date, end_date, columns=REQUIRED_COLUMNS, pushdown=True):
+    """Read one monthly file with the column projection and simple predicates pushed into the scan.
+
+    Row groups whose statistics cannot satisfy the filter are never decoded, and
+    the remaining rows are filtered in Arrow before any pandas/polars conversion.
+    ``pushdown=False`` reads every row instead, so that clean_data sees, and counts,
+    the rows those rules reject. Columns are cast to CANONICAL_SCHEMA batch by batch,
+    see scan_fragment.
+    """
+    return scan_month_checked(source, start_date, end_date, columns, pushdown)[0]
+
+
+def arrow_dtype(arrow_type):
+    # Dictionary columns (e.g. checkpointed categorical keys) still become pandas Categoricals
+    return None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+
+
+def to_pandas(table, dtype_backend=None):
+    """``table`` as a DataFrame of NumPy columns, or of Arrow-backed ArrowDtype columns for dtype_backend='pyarrow'.
+
+    Arrow-backed columns wrap the Arrow buffers instead of copying them into NumPy arrays,
+    and strings stay Arrow strings instead of Python objects.
+    """
+    if dtype_backend is None:
+        return table.to_pandas()
+    if dtype_backend != 'pyarrow':
+        raise ValueError(f"dtype_backend must be None or 'pyarrow', got {dtype_backend!r}")
+    return table.to_pandas(types_mapper=arrow_dtype)
+
+
+def compact_table(table):
+    """Downcast ``table`` to the compact dtype profile wherever that is lossless.
+
+    Integer targets are only used for null-free columns (pandas would turn them back
+    into float64) and float32 only when every value round-trips exactly. Returns the
+    compacted table and the number of bytes saved.
+    """
+    before = table.nbytes
+    for i, name in enumerate(table.column_names):
+        column = table.column(i)
+        if name in COMPACT_TYPES and column.null_count == 0:
+            try:
+                table = table.set_column(i, name, column.cast(COMPACT_TYPES[name]))
+            except pa.ArrowInvalid:
+                pass
+        elif pa.types.is_float64(column.type):
+            compact = column.cast(pa.float32())
+            if pc.all(pc.equal(compact.cast(pa.float64()), column)).as_py() is not False:
+                table = table.set_column(i, name, compact)
+    return table, before - table.nbytes
@@ -0,0 +1,131 @@
+"""Local trip store: the source months rewritten as year=YYYY/month=M hive partitions.
+
+    python trip_store.py 2019-01 2023-12 --base-url <mirror>
+
+Every partition holds the REQUIRED_COLUMNS of one source month sorted by
+tpep_dropoff_datetime, in row groups of ``row_group_size`` rows with statistics, so a
+date window maps onto a few contiguous row groups. TripStore.fetch has the interface
+of ParquetCache.fetch, so a store can be passed as any engine's ``cache``: the months
+of the range are then read from their partition with the row groups outside the window
+skipped. TripStore.scan reads a whole range through the hive partitioning instead.
+"""
+import argparse
+import os
+import re
+import sys
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from parquet_cache import ParquetCache
+from trip_reader import REQUIRED_COLUMNS, open_fragment, pushdown_filter, scan_fragment
+
+URL_TEMPLATE = 'https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{dt}.parquet'
+# About a day of trips per row group for a typical month
+STORE_ROW_GROUP_SIZE = 131_072
+MONTH_PATTERN = re.compile(r'(\d{4})-(\d{2})\.parquet$')
+
+
+def month_of(url):
+    """'YYYY-MM' of a monthly trip file URL or path."""
+    match = MONTH_PATTERN.search(str(url))
+    if match is None:
+        raise ValueError(f'{url} is not a monthly trip file')
+    return f'{match.group(1)}-{match.group(2)}'
+
+
+def partition_filter(months):
+    """Expression that only keeps the year=/month= partitions of ``months``."""
+    expression = None
+    for month in months:
+        year, month_number = (int(part) for part in month.split('-'))
+        selected = (ds.field('year') == year) & (ds.field('month') == month_number)
+        expression = selected if expression is None else expression | selected
+    return expression
+
+
+class TripStore:
+    """Hive-partitioned local copy of the source months, ingested on first use.
+
+    Source files are fetched through ``cache`` when given. A month is only ingested once;
+    ``refresh`` ingests it again, e.g. after the source was republished.
+    """
+
+    def __init__(self, path='.trip_store', cache=None, row_group_size=STORE_ROW_GROUP_SIZE):
+        self.path = path
+        self.cache = cache
+        self.row_group_size = row_group_size
+        os.makedirs(path, exist_ok=True)
+
+    def month_path(self, month):
+        year, month_number = (int(part) for part in month.split('-'))
+        return os.path.join(self.path, f'year={year}', f'month={month_number}', 'part-0.parquet')
+
+    def __contains__(self, month):
+        return os.path.exists(self.month_path(month))
+
+    def ingest(self, month, source):
+        """Rewrite one source month into its partition, sorted by dropoff time."""
+        table = scan_fragment(open_fragment(source)).to_table().sort_by('tpep_dropoff_datetime')
+        path = self.month_path(month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Hidden, so that dataset discovery ignores a leftover temporary file
+        tmp_path = os.path.join(os.path.dirname(path), '.part-0.parquet.tmp')
+        pq.write_table(table, tmp_path, row_group_size=self.row_group_size, write_statistics=True)
+        os.replace(tmp_path, path)
+        return path
+
+    def fetch(self, url, refresh=False):
+        """Partition file of the month of ``url``, ingesting it first if needed."""
+        month = month_of(url)
+        if refresh or month not in self:
+            self.ingest(month, self.cache.fetch(url) if self.cache is not None else url)
+        return self.month_path(month)
+
+    def dataset(self):
+        return ds.dataset(self.path, format='parquet', partitioning='hive')
+
+    @staticmethod
+    def months(start_date, end_date):
+        """Source months ('YYYY-MM') overlapping the range."""
+        return pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq='M').strftime('%Y-%m').tolist()
+
+    def scan_filter(self, start_date, end_date):
+        return partition_filter(self.months(start_date, end_date)) & pushdown_filter(start_date, end_date)
+
+    def scan(self, start_date, end_date, columns=REQUIRED_COLUMNS):
+        """The trips of the source months overlapping the range, skipping other partitions and row groups.
+
+        Every one of those months must have been ingested.
+        """
+        return self.dataset().to_table(columns=columns, filter=self.scan_filter(start_date, end_date))
+
+    def row_groups(self, start_date, end_date):
+        """{partition file: ids of the row groups a scan of the range reads}."""
+        # Row groups are matched against the file schema, which has no partition fields
+        row_filter = pushdown_filter(start_date, end_date)
+        return {
+            fragment.path: [piece.row_groups[0].id for piece in fragment.split_by_row_group(row_filter)]
+            for fragment in self.dataset().get_fragments(self.scan_filter(start_date, end_date))
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('start_month', help='first month, YYYY-MM')
+    parser.add_argument('end_month', help='last month, YYYY-MM')
+    parser.add_argument('--path', default='.trip_store')
+    parser.add_argument('--base-url', default=None, help='local directory or HTTP mirror of the trip files')
+    parser.add_argument('--row-group-size', type=int, default=STORE_ROW_GROUP_SIZE)
+    parser.add_argument('--refresh', action='store_true', help='ingest months already in the store again')
+    args = parser.parse_args(argv)
+
+    store = TripStore(args.path, cache=ParquetCache(base_url=args.base_url), row_group_size=args.row_group_size)
+    for month in TripStore.months(args.start_month, args.end_month):
+        print(f'{month}: {store.fetch(URL_TEMPLATE.format(dt=month), refresh=args.refresh)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())